@@ -0,0 +1,17 @@
+-- 广告观看记录延迟写入时，金币流水通过关联键找到观看记录（记录ID在落库前未知）
+-- ad_watch_records.watch_key：观看记录关联键（唯一，后台落库重复投递时按它去重）
+-- coin_transactions.related_key：广告奖励流水对应的 watch_key
+-- 新建库由 Base.metadata.create_all 自动创建，已有库执行本脚本一次（coin_transactions 新增可空列为即时DDL，ad_watch_records 的唯一索引在线创建）
+
+USE game_db;
+
+ALTER TABLE ad_watch_records
+    ADD COLUMN watch_key VARCHAR(32) NULL COMMENT '观看记录关联键（金币流水的related_key）',
+    ADD UNIQUE INDEX watch_key (watch_key);
+
+ALTER TABLE coin_transactions
+    ADD COLUMN related_key VARCHAR(32) NULL COMMENT '关联键（广告奖励：观看记录的watch_key）';
+
+-- 验证
+SHOW INDEX FROM ad_watch_records;
+DESCRIBE coin_transactions;
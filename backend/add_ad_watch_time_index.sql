@@ -0,0 +1,11 @@
+-- 今日广告计数回退数据库时按 watch_time 时间范围查询（func.date() 无法使用普通索引），为其添加组合索引
+-- 新建库由 Base.metadata.create_all 自动创建，已有库执行本脚本一次
+
+USE game_db;
+
+ALTER TABLE ad_watch_records
+    ADD INDEX idx_user_watch_time (user_id, watch_time),
+    ADD INDEX idx_ad_watch_time (ad_id, watch_time);
+
+-- 验证
+SHOW INDEX FROM ad_watch_records;
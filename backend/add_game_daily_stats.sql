@@ -0,0 +1,31 @@
+-- 每日游戏统计汇总表：提交游戏时增量更新，图表和管理后台读取汇总表，不再按 DATE(play_time) 扫描 game_records
+-- 每天按 user_id % 16 分为多行，避免所有提交更新同一行
+-- 用户每日计数表 game_daily_players：提交时加锁判断当天第一局和每日奖励次数上限（并发提交不会重复计数）
+-- 新建库由 Base.metadata.create_all 自动创建，已有库执行本脚本一次（可重复执行），然后运行 python backfill_game_stats.py 回填历史
+-- （至少回填当天：计数表缺少当天的行时，用户当天的奖励次数会从0重新计算）
+
+USE game_db;
+
+CREATE TABLE IF NOT EXISTS game_daily_stats (
+    stat_date DATE NOT NULL COMMENT '统计日期',
+    slot INT NOT NULL COMMENT '分片（user_id % 分片数）',
+    games INT NOT NULL DEFAULT 0 COMMENT '游戏局数',
+    players INT NOT NULL DEFAULT 0 COMMENT '游戏人数（去重）',
+    score_sum BIGINT NOT NULL DEFAULT 0 COMMENT '得分合计',
+    max_score INT NOT NULL DEFAULT 0 COMMENT '最高得分',
+    total_coins BIGINT NOT NULL DEFAULT 0 COMMENT '奖励金币合计（分）',
+    updated_time DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (stat_date, slot)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS game_daily_players (
+    stat_date DATE NOT NULL COMMENT '统计日期',
+    user_id INT NOT NULL COMMENT '用户ID',
+    games INT NOT NULL DEFAULT 0 COMMENT '当天游戏局数',
+    rewarded_games INT NOT NULL DEFAULT 0 COMMENT '当天获得奖励的局数',
+    PRIMARY KEY (stat_date, user_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 验证
+DESCRIBE game_daily_stats;
+DESCRIBE game_daily_players;
@@ -0,0 +1,16 @@
+-- 历史记录接口改为按 (时间, id) 倒序的游标分页，为游戏记录和提现记录添加 (user_id, 时间) 组合索引
+-- InnoDB二级索引隐含主键id，(user_id, 时间) 索引即可按 (时间, id) 顺序扫描，无需额外排序
+-- 广告观看记录（idx_user_watch_time）和金币流水（idx_user_time）已有对应索引
+-- 新建库由 Base.metadata.create_all 自动创建，已有库执行本脚本一次
+
+USE game_db;
+
+ALTER TABLE game_records
+    ADD INDEX idx_user_play_time (user_id, play_time);
+
+ALTER TABLE withdraw_requests
+    ADD INDEX idx_user_request_time (user_id, request_time);
+
+-- 验证
+SHOW INDEX FROM game_records;
+SHOW INDEX FROM withdraw_requests;
@@ -0,0 +1,9 @@
+-- IP黑名单增量同步按 updated_time 读取变更记录，为其添加索引
+-- 新建库由 Base.metadata.create_all 自动创建，已有库执行本脚本一次
+
+USE game_db;
+
+ALTER TABLE ip_blacklist ADD INDEX idx_ip_updated_time (updated_time);
+
+-- 验证
+SHOW INDEX FROM ip_blacklist;
@@ -2,18 +2,23 @@
 # -*- coding: utf-8 -*-
 """
 自动同步数据库黑名单IP到防火墙
-- 从数据库读取活跃的黑名单IP
-- 自动添加到UFW和iptables防火墙
-- 可以作为定时任务运行，或持续监控模式
+- 封禁网段统一放在ipset哈希集合中，iptables只需一条 --match-set 规则（规则数量不随封禁数增长）
+- 以数据库为期望状态、ipset为实际状态，比对差异后用一次 ipset restore 批量增删
+- 持续监控模式订阅Redis黑名单变更频道，封禁实时下发；定期全量比对兜底
+- 命令执行器可替换，--fake 模式在内存中模拟ipset/iptables，便于本地验证逻辑
 """
 
 import os
 import sys
 import time
+import ipaddress
 import subprocess
+from abc import ABC, abstractmethod
 from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+from config import settings
 
 # 数据库配置
 DB_CONFIG = {
@@ -24,127 +29,360 @@ DB_CONFIG = {
     'database': 'game_db'
 }
 
-# 防火墙封禁记录文件（避免重复封禁）
+# Redis配置（订阅后端的黑名单变更通知）
+REDIS_CONFIG = {
+    'host': 'localhost',
+    'port': 6379,
+    'password': None,
+    'db': 0,
+    'channel': 'ip_blacklist:events'
+}
+
+# 防火墙配置
+IPSET_NAMES = {4: 'game_blacklist', 6: 'game_blacklist6'}
+IPTABLES_BINS = {4: 'iptables', 6: 'ip6tables'}
+FIREWALL_CHAIN = 'ufw-before-input'             # 插入到UFW前置链，优先级最高
+# 单个IP按网段封禁（与后端自动封禁共用 IP_BAN_PREFIX_V4/V6 配置）
+SUBNET_PREFIX = {4: settings.IP_BAN_PREFIX_V4, 6: settings.IP_BAN_PREFIX_V6}
+IPSET_MAX_TIMEOUT = 2147483                     # ipset单条超时上限（秒），超出按永久处理，由全量比对负责移除
+IPSET_RULES_FILE = '/etc/iptables/ipset.rules'  # ipset持久化文件
+IPTABLES_RULES_FILE = '/etc/iptables/rules.v4'
+
+# 批量下发配置
+EVENT_BATCH_SECONDS = 1          # 实时事件攒批时间（秒）
+EVENT_BATCH_SIZE = 500           # 实时事件单批最大条数
+CONNTRACK_FLUSH_LIMIT = 50       # 单批新增网段不超过该数量时清除其现有连接
+
+# 旧版逐条规则的封禁记录文件（仅用于清理旧规则）
 BANNED_IPS_FILE = '/tmp/firewall_banned_ips.txt'
 
 
-class FirewallSyncManager:
-    """防火墙同步管理器"""
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class CommandResult(NamedTuple):
+    returncode: int
+    stdout: str = ''
+    stderr: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
 
-    def __init__(self):
-        # 创建数据库连接
-        db_url = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-        self.engine = create_engine(db_url, pool_pre_ping=True)
-        self.Session = sessionmaker(bind=self.engine)
 
-        # 加载已封禁的IP列表
-        self.banned_ips = self._load_banned_ips()
+class CommandRunner(ABC):
+    """命令执行器接口"""
 
-    def _load_banned_ips(self):
-        """加载已封禁的IP列表"""
-        if os.path.exists(BANNED_IPS_FILE):
-            with open(BANNED_IPS_FILE, 'r') as f:
-                return set(line.strip() for line in f if line.strip())
-        return set()
+    @abstractmethod
+    def run(self, args: List[str], input_text: str = None) -> CommandResult:
+        """执行命令（args为参数列表，input_text写入标准输入）"""
 
-    def _save_banned_ip(self, ip):
-        """保存已封禁的IP"""
-        self.banned_ips.add(ip)
-        with open(BANNED_IPS_FILE, 'a') as f:
-            f.write(f"{ip}\n")
 
-    def _run_command(self, cmd, silent=False):
-        """执行shell命令"""
+class SubprocessRunner(CommandRunner):
+    """真实执行（不经过shell，参数按列表传递）"""
+
+    def run(self, args: List[str], input_text: str = None) -> CommandResult:
         try:
             result = subprocess.run(
-                cmd,
-                shell=True,
+                args,
+                input=input_text,
                 capture_output=True,
                 text=True,
-                timeout=30
+                timeout=60
             )
-            if not silent and result.returncode != 0:
-                print(f"⚠️  命令执行失败: {cmd}")
-                print(f"错误: {result.stderr}")
-            return result.returncode == 0
+            return CommandResult(result.returncode, result.stdout, result.stderr)
         except Exception as e:
-            if not silent:
-                print(f"❌ 命令执行异常: {cmd}, 错误: {e}")
-            return False
+            return CommandResult(1, '', str(e))
 
-    def get_blocked_ips_from_db(self):
-        """从数据库获取所有活跃的黑名单IP"""
+
+class FakeFirewallRunner(CommandRunner):
+    """
+    内存模拟的ipset/iptables（--fake 模式）
+    只实现本脚本用到的命令，记录执行过的命令便于检查
+    """
+
+    def __init__(self):
+        self.sets: Dict[str, Dict[str, int]] = {}      # 集合名 -> {网段: 超时}
+        self.rules: Set[Tuple[str, ...]] = set()
+        self.commands: List[str] = []
+
+    def run(self, args: List[str], input_text: str = None) -> CommandResult:
+        self.commands.append(' '.join(args) + (f' <<< {len(input_text.splitlines())}行' if input_text else ''))
+        tool = args[0]
+
+        if tool == 'ipset' and args[1] == 'restore':
+            for line in input_text.splitlines():
+                parts = line.split()
+                if not parts:
+                    continue
+                if parts[0] == 'create':
+                    self.sets.setdefault(parts[1], {})
+                elif parts[0] == 'add':
+                    timeout = int(parts[parts.index('timeout') + 1]) if 'timeout' in parts else 0
+                    self.sets[parts[1]][parts[2]] = timeout
+                elif parts[0] == 'del':
+                    self.sets[parts[1]].pop(parts[2], None)
+            return CommandResult(0)
+
+        if tool == 'ipset' and args[1] == 'save':
+            names = args[2:] or list(self.sets)
+            lines = []
+            for name in names:
+                if name not in self.sets:
+                    return CommandResult(1, '', f'The set with the given name does not exist: {name}')
+                lines.append(f'create {name} hash:net timeout 0')
+                lines += [f'add {name} {net} timeout {timeout}' for net, timeout in self.sets[name].items()]
+            return CommandResult(0, '\n'.join(lines) + '\n')
+
+        if tool in IPTABLES_BINS.values():
+            rule = tuple([tool] + args[2:])
+            if args[1] == '-C':
+                return CommandResult(0 if rule in self.rules else 1)
+            if args[1] == '-I':
+                self.rules.add(tuple([tool, args[2]] + args[4:]))
+                return CommandResult(0)
+            if args[1] == '-D':
+                self.rules.discard(rule)
+                return CommandResult(0)
+
+        # conntrack / ufw / iptables-save 等命令直接视为成功
+        return CommandResult(0)
+
+
+def subnet_for_entry(entry: str) -> Optional[IPNetwork]:
+    """
+    黑名单条目转换为防火墙封禁网段
+    单个IP按SUBNET_PREFIX扩展为网段，例如: 112.82.180.220 -> 112.82.180.0/24；CIDR条目保持原网段
+    """
+    entry = (entry or '').strip()
+    try:
+        if '/' in entry:
+            network = ipaddress.ip_network(entry, strict=False)
+        else:
+            address = ipaddress.ip_address(entry.split('%', 1)[0])
+            if address.version == 6 and address.ipv4_mapped is not None:
+                address = address.ipv4_mapped
+            network = ipaddress.ip_network(f"{address}/{SUBNET_PREFIX[address.version]}", strict=False)
+    except ValueError:
+        return None
+    return network
+
+
+def ipset_timeout(expire_at: Optional[float], now: float = None) -> Optional[int]:
+    """过期时间戳转换为ipset超时秒数：0表示永久，None表示已过期"""
+    if expire_at is None or expire_at == float('inf'):
+        return 0
+    remaining = int(expire_at - (time.time() if now is None else now))
+    if remaining <= 0:
+        return None
+    return remaining if remaining <= IPSET_MAX_TIMEOUT else 0
+
+
+class FirewallSyncManager:
+    """防火墙同步管理器"""
+
+    def __init__(self, runner: CommandRunner = None, engine=None):
+        # 创建数据库连接
+        if engine is None:
+            db_url = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+            engine = create_engine(db_url, pool_pre_ping=True)
+        self.engine = engine
+        self.Session = sessionmaker(bind=self.engine)
+        self.runner = runner or SubprocessRunner()
+        self._rules_ready = False
+
+    def _run(self, args: List[str], input_text: str = None, silent: bool = False) -> CommandResult:
+        """执行命令，失败时打印错误"""
+        result = self.runner.run(args, input_text)
+        if not silent and not result.ok:
+            print(f"⚠️  命令执行失败: {' '.join(args)}")
+            print(f"错误: {result.stderr.strip()}")
+        return result
+
+    # ==================== 期望状态 ====================
+
+    def _query_blocked_entries(self) -> List[Tuple[str, Optional[datetime]]]:
+        """查询所有生效中的黑名单条目 (ip_address, expire_time)，失败时抛出异常"""
         session = self.Session()
         try:
             query = text("""
-                SELECT ip_address
+                SELECT ip_address, expire_time
                 FROM ip_blacklist
                 WHERE is_active = 1
-                ORDER BY blocked_time DESC
+                  AND (expire_time IS NULL OR expire_time > :now)
             """)
-            result = session.execute(query)
-            ips = [row[0] for row in result]
-            return ips
-        except Exception as e:
-            print(f"❌ 查询数据库失败: {e}")
-            return []
+            return [(row[0], row[1]) for row in session.execute(query, {"now": datetime.now()})]
         finally:
             session.close()
 
-    def convert_to_subnet(self, ip):
-        """
-        将IP地址转换为子网段（/24）
-        例如: 112.82.180.220 -> 112.82.180.0/24
-        """
-        parts = ip.split('.')
-        if len(parts) == 4:
-            return f"{parts[0]}.{parts[1]}.{parts[2]}.0/24"
-        return ip
-
-    def ban_ip_in_firewall(self, ip):
-        """在防火墙中封禁IP"""
-        # 转换为子网段
-        subnet = self.convert_to_subnet(ip)
-        return self._ban_subnet(subnet)
-
-    def _ban_subnet(self, subnet):
-        """封禁一个子网段"""
-        # 检查是否已经封禁过
-        if subnet in self.banned_ips:
-            return True
-
-        print(f"🔒 正在封禁: {subnet}")
+    def get_blocked_entries_from_db(self) -> List[Tuple[str, Optional[datetime]]]:
+        """从数据库获取所有生效中的黑名单条目 (ip_address, expire_time)"""
+        try:
+            return self._query_blocked_entries()
+        except Exception as e:
+            print(f"❌ 查询数据库失败: {e}")
+            return []
 
-        # 1. 添加到UFW
-        ufw_cmd = f"ufw insert 1 deny from {subnet}"
-        ufw_success = self._run_command(ufw_cmd, silent=True)
+    def get_blocked_ips_from_db(self) -> List[str]:
+        """从数据库获取所有活跃的黑名单IP"""
+        return [ip for ip, _ in self.get_blocked_entries_from_db()]
 
-        # 2. 添加到iptables (ufw-before-input链，最高优先级)
-        iptables_cmd = f"iptables -I ufw-before-input 1 -s {subnet} -j DROP"
-        iptables_success = self._run_command(iptables_cmd, silent=True)
+    def desired_state(self) -> Optional[Dict[int, Dict[str, int]]]:
+        """期望状态: {IP版本: {网段: ipset超时}}；数据库查询失败返回None（避免误删全部封禁）"""
+        try:
+            entries = self._query_blocked_entries()
+        except Exception as e:
+            print(f"❌ 数据库不可用，跳过本次比对: {e}")
+            return None
+
+        desired: Dict[int, Dict[str, int]] = {4: {}, 6: {}}
+        now = time.time()
+        for ip, expire_time in entries:
+            if isinstance(expire_time, str):
+                expire_time = datetime.fromisoformat(expire_time)
+            network = subnet_for_entry(ip)
+            if network is None:
+                continue
+            timeout = ipset_timeout(expire_time.timestamp() if expire_time else None, now)
+            if timeout is None:
+                continue
+            self._merge(desired[network.version], str(network), timeout)
+        return desired
+
+    @staticmethod
+    def _merge(entries: Dict[str, int], subnet: str, timeout: int):
+        """同一网段多条封禁取最长期限（0为永久）"""
+        current = entries.get(subnet)
+        if current is None or timeout == 0 or (current != 0 and timeout > current):
+            entries[subnet] = timeout
+
+    # ==================== 实际状态 ====================
+
+    def ensure_firewall(self) -> bool:
+        """确保ipset集合和iptables匹配规则存在（幂等）"""
+        if self._rules_ready:
+            return True
 
-        # 3. 清除该IP的现有连接
-        conntrack_cmd = f"conntrack -D -s {subnet} 2>/dev/null"
-        self._run_command(conntrack_cmd, silent=True)
+        restore = []
+        for version, name in IPSET_NAMES.items():
+            family = 'inet' if version == 4 else 'inet6'
+            restore.append(f"create {name} hash:net family {family} hashsize 4096 maxelem 1048576 timeout 0 -exist")
+        if not self._run(['ipset', 'restore'], '\n'.join(restore) + '\n').ok:
+            return False
 
-        if ufw_success and iptables_success:
-            print(f"   ✅ 成功封禁: {subnet}")
-            self._save_banned_ip(subnet)
+        rules_changed = False
+        for version, name in IPSET_NAMES.items():
+            rule = ['-m', 'set', '--match-set', name, 'src', '-j', 'DROP']
+            binary = IPTABLES_BINS[version]
+            if self._run([binary, '-C', FIREWALL_CHAIN] + rule, silent=True).ok:
+                continue
+            if self._run([binary, '-I', FIREWALL_CHAIN, '1'] + rule).ok:
+                rules_changed = True
+                print(f"   ✅ 已添加规则: {binary} {FIREWALL_CHAIN} --match-set {name}")
+            elif version == 4:
+                return False
+
+        if rules_changed:
+            self.save_iptables_rules()
+        self._rules_ready = True
+        return True
+
+    def actual_state(self) -> Dict[int, Dict[str, int]]:
+        """实际状态：读取ipset集合中的网段及剩余超时"""
+        actual: Dict[int, Dict[str, int]] = {4: {}, 6: {}}
+        for version, name in IPSET_NAMES.items():
+            result = self._run(['ipset', 'save', name], silent=True)
+            if not result.ok:
+                continue
+            for line in result.stdout.splitlines():
+                parts = line.split()
+                if len(parts) >= 3 and parts[0] == 'add':
+                    timeout = int(parts[parts.index('timeout') + 1]) if 'timeout' in parts else 0
+                    actual[version][parts[2]] = timeout
+        return actual
+
+    # ==================== 下发 ====================
+
+    def apply_changes(self, adds: Dict[int, Dict[str, int]], removes: Dict[int, Set[str]]) -> bool:
+        """一次 ipset restore 批量增删（-exist 保证重复添加/删除不报错，重复添加会刷新超时）"""
+        lines = []
+        for version, entries in adds.items():
+            for subnet, timeout in sorted(entries.items()):
+                lines.append(f"add {IPSET_NAMES[version]} {subnet} timeout {timeout} -exist")
+        for version, subnets in removes.items():
+            for subnet in sorted(subnets):
+                lines.append(f"del {IPSET_NAMES[version]} {subnet} -exist")
+        if not lines:
             return True
-        else:
-            print(f"   ⚠️  部分失败: {subnet}")
+
+        if not self._run(['ipset', 'restore'], '\n'.join(lines) + '\n').ok:
             return False
 
+        # 清除新封禁网段的现有连接（批量较大时跳过，避免大量子进程）
+        new_subnets = [subnet for entries in adds.values() for subnet in entries]
+        if len(new_subnets) <= CONNTRACK_FLUSH_LIMIT:
+            for subnet in new_subnets:
+                self._run(['conntrack', '-D', '-s', subnet], silent=True)
+        return True
+
+    def reconcile(self) -> Optional[Dict[str, int]]:
+        """比对期望状态与实际状态，批量下发差异；返回统计信息"""
+        if not self.ensure_firewall():
+            print("❌ 初始化ipset/iptables失败")
+            return None
+
+        desired = self.desired_state()
+        if desired is None:
+            return None
+        actual = self.actual_state()
+
+        adds: Dict[int, Dict[str, int]] = {4: {}, 6: {}}
+        removes: Dict[int, Set[str]] = {4: set(), 6: set()}
+        for version in (4, 6):
+            for subnet, timeout in desired[version].items():
+                current = actual[version].get(subnet)
+                # 新增；或者期望永久/期限明显更长（如被重新封禁）时刷新超时
+                if current is None or (current != 0 and (timeout == 0 or timeout > current + 60)):
+                    adds[version][subnet] = timeout
+            removes[version] = set(actual[version]) - set(desired[version])
+
+        if not self.apply_changes(adds, removes):
+            return None
+
+        stats = {
+            'desired': sum(len(v) for v in desired.values()),
+            'added': sum(len(v) for v in adds.values()),
+            'removed': sum(len(v) for v in removes.values())
+        }
+        if stats['added'] or stats['removed']:
+            self.save_ipset_rules()
+        return stats
+
     def save_iptables_rules(self):
         """保存iptables规则（持久化）"""
         print("💾 保存防火墙规则...")
-        cmd = "iptables-save > /etc/iptables/rules.v4"
-        if self._run_command(cmd):
-            print("   ✅ 规则已保存到: /etc/iptables/rules.v4")
-            return True
-        else:
-            print("   ⚠️  保存规则失败")
-            return False
+        result = self._run(['iptables-save'])
+        if result.ok:
+            try:
+                with open(IPTABLES_RULES_FILE, 'w') as f:
+                    f.write(result.stdout)
+                print(f"   ✅ 规则已保存到: {IPTABLES_RULES_FILE}")
+                return True
+            except OSError as e:
+                print(f"   ⚠️  保存规则失败: {e}")
+        return False
+
+    def save_ipset_rules(self):
+        """保存ipset集合（持久化，开机后可用 ipset restore -f 恢复）"""
+        result = self._run(['ipset', 'save'])
+        if result.ok:
+            try:
+                with open(IPSET_RULES_FILE, 'w') as f:
+                    f.write(result.stdout)
+                return True
+            except OSError as e:
+                print(f"   ⚠️  保存ipset失败: {e}")
+        return False
 
     def sync_once(self):
         """执行一次同步"""
@@ -152,57 +390,116 @@ class FirewallSyncManager:
         print(f"🔄 开始同步防火墙规则 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("=" * 60)
 
-        # 1. 从数据库获取黑名单IP
-        db_ips = self.get_blocked_ips_from_db()
-        if not db_ips:
-            print("ℹ️  数据库中没有黑名单IP")
-            return
-
-        print(f"📊 数据库中共有 {len(db_ips)} 个黑名单IP")
-
-        # 2. 转换为子网段并去重
-        subnets = set()
-        for ip in db_ips:
-            subnet = self.convert_to_subnet(ip)
-            subnets.add(subnet)
-
-        print(f"📊 转换为 {len(subnets)} 个子网段")
-
-        # 3. 封禁新的IP段
-        new_bans = 0
-        for subnet in sorted(subnets):
-            if subnet not in self.banned_ips:
-                # 直接封禁子网段
-                if self._ban_subnet(subnet):
-                    new_bans += 1
-
-        if new_bans > 0:
-            print(f"\n🎉 本次新增封禁: {new_bans} 个IP段")
-            # 保存规则
-            self.save_iptables_rules()
+        stats = self.reconcile()
+        if stats is None:
+            print("❌ 同步失败")
         else:
-            print(f"\nℹ️  没有新的IP需要封禁")
-
-        print(f"📊 当前总共封禁: {len(self.banned_ips)} 个IP段")
+            print(f"📊 期望封禁: {stats['desired']} 个IP段")
+            print(f"🎉 本次新增/刷新: {stats['added']} 个, 移除: {stats['removed']} 个")
         print("=" * 60)
+        return stats
+
+    # ==================== 实时事件 ====================
+
+    @staticmethod
+    def parse_event(message: str) -> Tuple[str, Optional[IPNetwork], Optional[int]]:
+        """
+        解析后端黑名单变更通知: add:<条目> [过期时间戳] / remove:<条目> / reload:
+        返回 (动作, 网段, ipset超时)
+        """
+        action, _, payload = message.partition(':')
+        entry, _, score = payload.partition(' ')
+        if action != 'add':
+            return action, None, None
+        network = subnet_for_entry(entry)
+        timeout = ipset_timeout(float(score) if score else None)
+        return action, network, timeout
+
+    def _connect_redis(self):
+        import redis
+        client = redis.Redis(
+            host=REDIS_CONFIG['host'],
+            port=REDIS_CONFIG['port'],
+            password=REDIS_CONFIG['password'],
+            db=REDIS_CONFIG['db'],
+            decode_responses=True
+        )
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(REDIS_CONFIG['channel'])
+        return pubsub
 
     def watch_mode(self, interval=60):
-        """持续监控模式"""
+        """
+        持续监控模式：订阅黑名单变更实时下发封禁（攒批后一次restore），
+        解封/重载通知触发全量比对；每interval秒全量比对一次兜底。
+        Redis不可用时退化为按interval轮询比对
+        """
         print("=" * 60)
-        print("🔍 启动持续监控模式")
-        print(f"⏱️  检查间隔: {interval} 秒")
+        print("🔍 启动持续监控模式（Redis事件 + 定期全量比对）")
+        print(f"⏱️  全量比对间隔: {interval} 秒")
         print("按 Ctrl+C 停止监控")
         print("=" * 60)
         print()
 
+        pubsub = None
+        last_reconcile = 0.0
+        need_reconcile = True
+        pending: Dict[int, Dict[str, int]] = {4: {}, 6: {}}
+        batch_started = None
+
         try:
             while True:
-                self.sync_once()
-                print(f"\n⏳ 等待 {interval} 秒后进行下一次检查...\n")
-                time.sleep(interval)
+                if pubsub is None:
+                    try:
+                        # 先订阅再比对，比对期间的通知不会丢失
+                        pubsub = self._connect_redis()
+                        need_reconcile = True
+                        print("✅ 已订阅黑名单变更通知")
+                    except Exception as e:
+                        print(f"⚠️  订阅Redis失败，{interval}秒后重试: {e}")
+                        pubsub = None
+
+                if need_reconcile or time.time() - last_reconcile >= interval:
+                    self.sync_once()
+                    last_reconcile = time.time()
+                    need_reconcile = False
+
+                if pubsub is None:
+                    time.sleep(interval)
+                    continue
+
+                try:
+                    message = pubsub.get_message(timeout=EVENT_BATCH_SECONDS)
+                except Exception as e:
+                    print(f"⚠️  订阅中断，将重新连接: {e}")
+                    pubsub = None
+                    continue
+
+                if message and message.get('type') == 'message':
+                    action, network, timeout = self.parse_event(message['data'])
+                    if action == 'add' and network is not None and timeout is not None:
+                        self._merge(pending[network.version], str(network), timeout)
+                        batch_started = batch_started or time.time()
+                    elif action != 'add':
+                        # 解封可能涉及同网段的其他封禁，统一交给全量比对处理
+                        need_reconcile = True
+
+                pending_count = len(pending[4]) + len(pending[6])
+                if pending_count and (
+                    pending_count >= EVENT_BATCH_SIZE or time.time() - batch_started >= EVENT_BATCH_SECONDS
+                ):
+                    if self.ensure_firewall() and self.apply_changes(pending, {4: set(), 6: set()}):
+                        print(f"🔒 实时封禁 {pending_count} 个IP段")
+                    else:
+                        need_reconcile = True
+                    pending = {4: {}, 6: {}}
+                    batch_started = None
+
         except KeyboardInterrupt:
             print("\n\n👋 监控已停止")
 
+    # ==================== 统计与清理 ====================
+
     def show_stats(self):
         """显示统计信息"""
         print("=" * 60)
@@ -213,36 +510,45 @@ class FirewallSyncManager:
         db_ips = self.get_blocked_ips_from_db()
         print(f"数据库黑名单IP数量: {len(db_ips)}")
 
-        # 已封禁的IP段数量
-        print(f"防火墙已封禁IP段: {len(self.banned_ips)}")
-
-        # UFW规则数量
-        result = subprocess.run(
-            "ufw status numbered | grep -c 'DENY' || echo 0",
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        ufw_count = result.stdout.strip()
-        print(f"UFW规则数量: {ufw_count}")
+        # ipset中的网段数量
+        actual = self.actual_state()
+        for version, name in IPSET_NAMES.items():
+            print(f"ipset {name}: {len(actual[version])} 个IP段")
 
         # iptables拦截统计
-        result = subprocess.run(
-            "iptables -L ufw-before-input -n -v | grep '112.82.180.0/24' | awk '{print $1}' || echo 0",
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        packets = result.stdout.strip()
-        print(f"已拦截数据包: {packets}")
+        result = self._run(['iptables', '-L', FIREWALL_CHAIN, '-n', '-v'], silent=True)
+        for line in result.stdout.splitlines():
+            if 'match-set' in line:
+                print(f"已拦截数据包: {line.split()[0]}")
 
         print("=" * 60)
 
-        # 显示最近10个封禁的IP段
-        if self.banned_ips:
-            print("\n最近封禁的IP段（前10个）:")
-            for ip in list(self.banned_ips)[-10:]:
-                print(f"  - {ip}")
+        # 显示部分封禁的IP段
+        subnets = list(actual[4]) + list(actual[6])
+        if subnets:
+            print("\n部分封禁的IP段（前10个）:")
+            for subnet in subnets[:10]:
+                print(f"  - {subnet}")
+
+    def cleanup_legacy_rules(self):
+        """删除旧版逐条添加的UFW/iptables规则（这些网段已由ipset统一覆盖）"""
+        if not os.path.exists(BANNED_IPS_FILE):
+            print("ℹ️  没有旧版封禁记录")
+            return
+
+        if self.reconcile() is None:
+            print("❌ ipset同步失败，保留旧规则")
+            return
+
+        with open(BANNED_IPS_FILE, 'r') as f:
+            subnets = [line.strip() for line in f if line.strip()]
+
+        for subnet in subnets:
+            self._run(['ufw', 'delete', 'deny', 'from', subnet], silent=True)
+            self._run(['iptables', '-D', FIREWALL_CHAIN, '-s', subnet, '-j', 'DROP'], silent=True)
+        os.rename(BANNED_IPS_FILE, BANNED_IPS_FILE + '.migrated')
+        self.save_iptables_rules()
+        print(f"✅ 已清理 {len(subnets)} 条旧版规则")
 
 
 def main():
@@ -252,27 +558,34 @@ def main():
     parser = argparse.ArgumentParser(description='自动同步数据库黑名单IP到防火墙')
     parser.add_argument(
         '--mode',
-        choices=['once', 'watch', 'stats'],
+        choices=['once', 'watch', 'stats', 'cleanup-legacy'],
         default='once',
-        help='运行模式: once=执行一次, watch=持续监控, stats=显示统计'
+        help='运行模式: once=执行一次, watch=持续监控, stats=显示统计, cleanup-legacy=清理旧版逐条规则'
     )
     parser.add_argument(
         '--interval',
         type=int,
         default=60,
-        help='监控模式下的检查间隔（秒），默认60秒'
+        help='监控模式下的全量比对间隔（秒），默认60秒'
+    )
+    parser.add_argument(
+        '--fake',
+        action='store_true',
+        help='使用内存模拟的ipset/iptables（不修改系统防火墙，用于本地验证）'
     )
 
     args = parser.parse_args()
 
+    runner = FakeFirewallRunner() if args.fake else SubprocessRunner()
+
     # 检查是否为root权限
-    if os.geteuid() != 0:
+    if not args.fake and os.geteuid() != 0:
         print("❌ 此脚本需要root权限运行")
         print("请使用: sudo python3 auto_sync_firewall.py")
         sys.exit(1)
 
     # 创建管理器
-    manager = FirewallSyncManager()
+    manager = FirewallSyncManager(runner=runner)
 
     # 根据模式执行
     if args.mode == 'once':
@@ -281,6 +594,13 @@ def main():
         manager.watch_mode(interval=args.interval)
     elif args.mode == 'stats':
         manager.show_stats()
+    elif args.mode == 'cleanup-legacy':
+        manager.cleanup_legacy_rules()
+
+    if args.fake:
+        print("\n🧪 模拟执行的命令:")
+        for command in runner.commands:
+            print(f"  $ {command}")
 
 
 if __name__ == '__main__':
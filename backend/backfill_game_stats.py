@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+回填每日游戏统计汇总（game_daily_stats）- 按天从游戏记录重算，可在线运行
+使用方法:
+  python backfill_game_stats.py                          # 从第一条游戏记录回填到今天（上线时运行一次）
+  python backfill_game_stats.py --start 2025-09-01       # 只重算某天之后的统计
+  python backfill_game_stats.py --days 7                 # 重算最近7天
+  python backfill_game_stats.py --budget 0.1             # 回填查询耗时不超过运行时间的10%
+"""
+import sys
+import argparse
+from datetime import date, timedelta
+from config import settings
+from services.game_stats_service import GameDailyStatsService
+from services.money import format_cents
+
+
+def print_day(day, totals):
+    print(f"  {day}: {totals['games']}局 {totals['players']}人 最高分{totals['max_score']} "
+          f"奖励{format_cents(totals['total_coins'])}金币")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回填每日游戏统计汇总')
+    parser.add_argument('--start', type=date.fromisoformat, default=None, help='起始日期（YYYY-MM-DD），默认第一条游戏记录的日期')
+    parser.add_argument('--end', type=date.fromisoformat, default=None, help='结束日期（YYYY-MM-DD），默认今天')
+    parser.add_argument('--days', type=int, default=None, help='只重算最近N天（与--start互斥）')
+    parser.add_argument('--budget', type=float, default=settings.GAME_STATS_BACKFILL_DB_BUDGET,
+                        help=f'数据库负载预算（0~1，1表示不限速），默认{settings.GAME_STATS_BACKFILL_DB_BUDGET}')
+    parser.add_argument('--quiet', action='store_true', help='不输出每天的统计')
+
+    args = parser.parse_args()
+    if args.days is not None:
+        if args.start is not None:
+            parser.error('--days 与 --start 不能同时使用')
+        args.start = (args.end or date.today()) - timedelta(days=max(1, args.days) - 1)
+
+    print(f"📊 开始回填每日游戏统计（负载预算{args.budget}）")
+    try:
+        result = GameDailyStatsService.backfill(
+            start=args.start,
+            end=args.end,
+            db_budget=args.budget,
+            on_day=None if args.quiet else print_day
+        )
+    except KeyboardInterrupt:
+        print("\n✋ 已中断，已完成的日期不受影响，重新运行即可继续")
+        sys.exit(130)
+
+    if not result["days"]:
+        print("没有需要回填的游戏记录")
+        return
+    print(f"✅ 回填完成: {result['start']} 到 {result['end']}，共{result['days']}天 {result['games']}局")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+防护中间件性能对比脚本
+对比基线版本（git中指定提交的中间件，默认仓库第一个提交：BaseHTTPMiddleware + 同步Redis）
+与当前工作区的中间件（纯ASGI + 异步Redis）单worker的请求吞吐量
+
+使用方法:
+  python benchmark_protection.py                       # 使用config中的Redis，基线为仓库第一个提交
+  python benchmark_protection.py --baseline <提交>      # 指定基线提交
+  python benchmark_protection.py --baseline-dir /path/to/old/backend   # 使用已有的旧版代码目录
+  python benchmark_protection.py --requests 20000 --concurrency 200
+  python benchmark_protection.py --fake-redis          # 无Redis环境下冒烟测试（结果不代表真实网络开销）
+
+说明:
+  - 基线代码通过 git worktree 检出到临时目录，两种实现分别在独立子进程中导入和运行，互不影响
+  - 请求在进程内通过ASGI直接驱动（不经过网络栈），测到的是中间件本身 + Redis往返的开销
+  - 每个请求随机分配客户端IP，避免触发速率限制
+  - 默认不启动本地黑名单快照，两种实现都需要访问Redis检查黑名单；加 --snapshot 可对比快照模式（基线没有快照时忽略）
+  - 对比结论应以真实Redis的结果为准，--fake-redis 只用于验证脚本可以运行
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def patch_fake_redis():
+    """使用fakeredis替换全局Redis客户端（必须在导入中间件之前调用）"""
+    try:
+        import fakeredis
+    except ImportError:
+        print("❌ 需要安装fakeredis: pip install 'fakeredis[lua]'")
+        sys.exit(1)
+
+    import database
+    server = fakeredis.FakeServer()
+    database.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    database.async_redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+
+def build_app(middleware_cls):
+    """构建只有一个简单接口的测试应用"""
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def endpoint(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/api/game/leaderboard", endpoint)])
+    app.add_middleware(middleware_cls)
+    return app
+
+
+async def run_benchmark(app, total: int, concurrency: int) -> dict:
+    """并发发送请求，返回吞吐量和状态码分布"""
+    import httpx
+
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def worker():
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                ip = f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+                response = await client.get("/api/game/leaderboard", headers={"X-Forwarded-For": ip})
+                statuses[response.status_code] += 1
+
+        # 预热（加载Lua脚本、建立连接）
+        await client.get("/api/game/leaderboard", headers={"X-Forwarded-For": "10.0.0.1"})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "rps": total / elapsed if elapsed > 0 else 0,
+        "statuses": {str(code): count for code, count in statuses.items()}
+    }
+
+
+def run_worker(args):
+    """子进程：从 --source-dir 导入中间件并运行一轮测试，结果以JSON输出到最后一行"""
+    os.chdir(args.source_dir)
+    sys.path.insert(0, args.source_dir)
+
+    if args.fake_redis:
+        patch_fake_redis()
+
+    from middleware.enhanced_protection import EnhancedProtectionMiddleware
+
+    if args.snapshot:
+        from services.ip_service_optimized import IPServiceOptimized
+        if hasattr(IPServiceOptimized, "start_blacklist_listener"):
+            IPServiceOptimized.start_blacklist_listener()
+            time.sleep(1)
+
+    result = asyncio.run(run_benchmark(build_app(EnhancedProtectionMiddleware), args.requests, args.concurrency))
+    print(json.dumps(result))
+
+
+def run_in_subprocess(source_dir: str, args) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--worker", "--source-dir", source_dir,
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    if args.fake_redis:
+        command.append("--fake-redis")
+    if args.snapshot:
+        command.append("--snapshot")
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stdout)
+        print(completed.stderr, file=sys.stderr)
+        raise SystemExit(f"❌ 测试进程失败: {source_dir}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git(*args) -> str:
+    return subprocess.run(["git", *args], cwd=BACKEND_DIR, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='防护中间件性能对比')
+    parser.add_argument('--requests', type=int, default=5000, help='每种实现的请求总数，默认5000')
+    parser.add_argument('--concurrency', type=int, default=100, help='并发数，默认100')
+    parser.add_argument('--fake-redis', action='store_true', help='使用fakeredis（无Redis环境冒烟测试）')
+    parser.add_argument('--snapshot', action='store_true', help='启用进程内黑名单快照')
+    parser.add_argument('--baseline', default=None, help='基线版本的git提交，默认仓库第一个提交')
+    parser.add_argument('--baseline-dir', default=None, help='使用已有的基线backend目录（不使用git检出）')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--source-dir', default=BACKEND_DIR, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    worktree = None
+    baseline_dir = args.baseline_dir
+    try:
+        if not baseline_dir:
+            baseline = args.baseline or git("rev-list", "--max-parents=0", "HEAD").splitlines()[0]
+            repo_root = git("rev-parse", "--show-toplevel")
+            worktree = tempfile.mkdtemp(prefix="benchmark-baseline-")
+            git("worktree", "add", "--detach", worktree, baseline)
+            baseline_dir = os.path.join(worktree, os.path.relpath(BACKEND_DIR, repo_root))
+            # 基线没有的本地配置（.env）沿用当前目录的
+            env_file = os.path.join(BACKEND_DIR, ".env")
+            if os.path.exists(env_file) and not os.path.exists(os.path.join(baseline_dir, ".env")):
+                shutil.copy(env_file, baseline_dir)
+            print(f"基线: {baseline}（检出到 {worktree}）")
+
+        print("=" * 60)
+        print(f"防护中间件性能对比: {args.requests}个请求, 并发{args.concurrency}"
+              f"{'（fakeredis，结果不代表真实开销）' if args.fake_redis else ''}")
+        print("=" * 60)
+
+        results = {}
+        for name, source_dir in [("基线版本", baseline_dir), ("当前版本", BACKEND_DIR)]:
+            result = run_in_subprocess(source_dir, args)
+            results[name] = result
+            print(f"\n{name}（{source_dir}）")
+            print(f"  耗时: {result['elapsed']:.2f}秒")
+            print(f"  吞吐量: {result['rps']:.0f} 请求/秒")
+            print(f"  状态码: {result['statuses']}")
+    finally:
+        if worktree:
+            try:
+                git("worktree", "remove", "--force", worktree)
+            except subprocess.CalledProcessError as e:
+                print(f"⚠️  清理基线检出失败，请手动执行 git worktree prune: {e.stderr}")
+
+    old_rps, new_rps = [r["rps"] for r in results.values()]
+    if old_rps > 0:
+        print(f"\n📊 提升: {new_rps / old_rps:.2f}倍")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,27 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: Optional[str] = None
     REDIS_DB: int = 0
+    REDIS_SOCKET_TIMEOUT: float = 0.5          # 异步客户端读写超时（秒），防护中间件不允许长时间阻塞
+    REDIS_CONNECT_TIMEOUT: float = 0.5         # 异步客户端连接超时（秒）
+    REDIS_MAX_CONNECTIONS: int = 200           # 异步连接池上限（每个worker）
+    REDIS_LATENCY_BUDGET_MS: float = 50        # 防护中间件单次Redis调用的延迟预算，超出计为一次失败
+    REDIS_BREAKER_FAILURES: int = 5            # 连续失败（含超预算）多少次后熔断，切换到本地限流
+    REDIS_BREAKER_RESET_SECONDS: float = 10    # 熔断后多久放行一次探测请求
+
+    # 防护中间件影子模式：只记录会被限流/封禁的请求，不实际拦截（黑名单仍然生效）
+    PROTECTION_SHADOW_MODE: bool = False
+
+    # 广告观看记录延迟写入：计数和金币同步更新后，观看记录进入Redis Stream，由后台线程批量写库
+    AD_WATCH_WRITE_BEHIND: bool = False
+    # 延迟写入队列的积压上限：超过时报警并改为同步写库（队列不裁剪，未落库的记录不会被丢弃）
+    AD_WATCH_QUEUE_MAX_PENDING: int = 200000
+
+    # 金币账本对账任务：每批检查的用户数、数据库负载预算（对账查询耗时占总运行时间的比例上限）
+    LEDGER_RECONCILE_CHUNK_SIZE: int = 1000
+    LEDGER_RECONCILE_DB_BUDGET: float = 0.2
+
+    # 每日游戏统计汇总回填：数据库负载预算（回填查询耗时占总运行时间的比例上限）
+    GAME_STATS_BACKFILL_DB_BUDGET: float = 0.2
     
     # JWT配置
     SECRET_KEY: str = "your-secret-key-here-change-in-production"
@@ -39,6 +60,13 @@ class Settings(BaseSettings):
     SERVER_HOST: str = "0.0.0.0"
     SERVER_PORT: int = 3001
 
+    # IP封禁前缀长度（自动封禁按网段封禁，与防火墙的/24子网封禁保持一致）
+    IP_BAN_PREFIX_V4: int = 24
+    IP_BAN_PREFIX_V6: int = 64
+
+    # 受信反向代理（逗号分隔，支持CIDR）：只有直连地址属于这些代理时才读取 X-Forwarded-For / X-Real-IP
+    TRUSTED_PROXIES: str = "127.0.0.1,::1"
+
     # 管理后台路径前缀（用于安全隐藏后台入口）
     ADMIN_PREFIX: str = "/vfjsadrhbadmin"
 
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import redis
+import redis.asyncio as aioredis
 from config import settings
 
 # 创建数据库引擎
@@ -30,6 +31,20 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# 创建异步Redis连接（供ASGI中间件使用，共享连接池，显式超时避免阻塞请求）
+async_redis_client = aioredis.Redis(
+    connection_pool=aioredis.ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PASSWORD,
+        db=settings.REDIS_DB,
+        decode_responses=True,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        max_connections=settings.REDIS_MAX_CONNECTIONS
+    )
+)
+
 # 数据库依赖
 def get_db():
     db = SessionLocal()
@@ -40,4 +55,8 @@ def get_db():
 
 # Redis依赖
 def get_redis():
-    return redis_client 
\ No newline at end of file
+    return redis_client
+
+# 异步Redis依赖
+def get_async_redis():
+    return async_redis_client 
\ No newline at end of file
@@ -15,7 +15,13 @@ fi
 # 1. 安装Python依赖
 echo ""
 echo "📦 安装Python依赖..."
-pip3 install pymysql sqlalchemy conntrack-tools > /dev/null 2>&1 || pip install pymysql sqlalchemy conntrack-tools
+pip3 install pymysql sqlalchemy redis > /dev/null 2>&1 || pip install pymysql sqlalchemy redis
+
+# 安装ipset（封禁网段统一放在ipset集合中）
+if ! command -v ipset > /dev/null 2>&1; then
+    echo "📦 安装ipset..."
+    apt-get install -y ipset conntrack > /dev/null 2>&1 || yum install -y ipset conntrack-tools > /dev/null 2>&1
+fi
 
 # 2. 复制脚本到系统目录
 echo ""
@@ -99,10 +105,13 @@ echo "  - 使用systemd服务（方式1）实现实时同步"
 echo "  - 或者保留cron定时任务（方式2）每5分钟同步一次"
 echo ""
 echo "🎯 现在，每当你在管理后台封禁IP后，脚本会自动："
-echo "  1. 从数据库读取新的黑名单IP"
-echo "  2. 自动添加到UFW防火墙"
-echo "  3. 自动添加到iptables规则"
-echo "  4. 清除该IP的现有连接"
-echo "  5. 保存规则（持久化）"
+echo "  1. 通过Redis订阅实时收到封禁通知（定期与数据库全量比对兜底）"
+echo "  2. 用一次 ipset restore 批量写入ipset集合"
+echo "  3. iptables只保留一条 --match-set 规则"
+echo "  4. 清除该IP段的现有连接"
+echo "  5. 保存ipset集合（持久化）"
+echo ""
+echo "💡 旧版逐条添加的UFW/iptables规则可执行以下命令清理："
+echo "  python3 $SCRIPT_PATH --mode cleanup-legacy"
 echo ""
 echo "========================================"
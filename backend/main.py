@@ -18,6 +18,7 @@ from services.ip_service_optimized import IPServiceOptimized
 from middleware.rate_limiter import RateLimitMiddleware
 from middleware.ip_block_optimized import OptimizedIPBlockMiddleware
 from middleware.enhanced_protection import EnhancedProtectionMiddleware
+from middleware.rate_limit_policy import compile_rate_limit_policies
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
@@ -99,6 +100,25 @@ async def startup_event():
     os.makedirs("uploads/videos", exist_ok=True)
     os.makedirs("uploads/avatars", exist_ok=True)
     os.makedirs("uploads/apk", exist_ok=True)
+
+    # 编译路由限流策略表（此时所有路由均已注册）
+    compile_rate_limit_policies(app)
+
+    # 启动本地黑名单快照订阅（黑名单检查零网络往返）
+    IPServiceOptimized.start_blacklist_listener()
+
+    # 启动自动封禁落库线程（中间件只写Redis队列，由该线程批量写数据库）
+    from services.auto_ban_service import AutoBanService
+    AutoBanService.start_worker()
+
+    # 启动广告观看记录批量落库线程（延迟写入模式）
+    if settings.AD_WATCH_WRITE_BEHIND:
+        from services.ad_watch_writer import AdWatchWriter
+        AdWatchWriter.start_worker()
+    
+    # 检查Redis排行榜，首次使用时从游戏记录重建（后台线程）
+    from services.leaderboard_service import LeaderboardService
+    LeaderboardService.start_rebuild()
     
     # 初始化默认配置
     db = next(get_db())
@@ -141,6 +161,13 @@ async def startup_event():
     finally:
         db.close()
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """应用关闭时把待写入的广告观看记录写入数据库"""
+    if settings.AD_WATCH_WRITE_BEHIND:
+        from services.ad_watch_writer import AdWatchWriter
+        AdWatchWriter.stop_worker()
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """根路径返回简单的欢迎页面"""
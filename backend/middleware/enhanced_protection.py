@@ -1,28 +1,95 @@
 """
 增强防护中间件 - 多层严格防护
 包括：速率限制、请求间隔检查、自动封禁
+纯ASGI实现 + 异步Redis（redis.asyncio），检查过程不阻塞事件循环
 """
 
-from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from database import redis_client, get_db
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+from database import async_redis_client
+from config import settings
 from services.ip_service_optimized import IPServiceOptimized
-from datetime import datetime
+from services.auto_ban_service import AutoBanService
+from services.ip_prefix_trie import ban_entry_for_ip
+from services.client_ip import resolve_client_ip
+from services.protection_metrics import ProtectionMetrics
+from services.redis_fallback import RedisUnavailable, guarded_call, local_limiter, redis_breaker
+from middleware.rate_limit_policy import match_policy
+import asyncio
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
-    """增强防护中间件 - 严格模式"""
+# 滑动窗口限流脚本（服务端原子执行，一次往返，可同时检查多个维度如IP+用户）
+# KEYS[2i-1]: 第i个限制的当前窗口计数键  KEYS[2i]: 第i个限制的上一窗口计数键
+# ARGV[1]: 当前时间戳  ARGV[2i]: 第i个限制的窗口内最大请求数  ARGV[2i+1]: 第i个限制的窗口长度（秒）
+# 返回: {是否放行(1/0), 当前估算请求数, 建议重试秒数, 触发限制的序号(从1开始，放行时为0)}
+# 任一维度超限则整体拒绝且不计数；全部通过才统一计数
+RATE_LIMIT_LUA = """
+local now = tonumber(ARGV[1])
+local currents = {}
+
+for i = 1, #KEYS / 2 do
+    local max_requests = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    local elapsed = now % window
+    local current = tonumber(redis.call('GET', KEYS[i * 2 - 1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[i * 2]) or '0')
+    local weight = (window - elapsed) / window
+    local estimated = math.floor(previous * weight) + current
+
+    if estimated >= max_requests then
+        local retry_after
+        if current >= max_requests or previous == 0 then
+            retry_after = window - elapsed
+        else
+            -- 上一窗口的权重衰减到足以放行所需的时间
+            retry_after = window * (1 - (max_requests - current) / previous) - elapsed
+            if retry_after > window - elapsed then
+                retry_after = window - elapsed
+            end
+        end
+        return {0, estimated, math.max(1, math.ceil(retry_after)), i}
+    end
+    currents[i] = current
+end
+
+for i = 1, #KEYS / 2 do
+    redis.call('INCR', KEYS[i * 2 - 1])
+    if currents[i] == 0 then
+        -- 保留到下一个窗口结束，供下一窗口做加权估算
+        redis.call('EXPIRE', KEYS[i * 2 - 1], tonumber(ARGV[i * 2 + 1]) * 2)
+    end
+end
+return {1, 0, 0, 0}
+"""
+
+# 违规计数脚本（有序集合滑动窗口，记录+清理+计数一次往返）
+# KEYS[1]: 违规记录键
+# ARGV[1]: 当前时间戳  ARGV[2]: 记录成员  ARGV[3]: 统计窗口（秒）  ARGV[4]: 最多保留条数
+# 返回: 窗口内违规次数
+VIOLATION_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[3])
+redis.call('ZADD', KEYS[1], now, ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[4]) + 1))
+redis.call('EXPIRE', KEYS[1], window)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+class EnhancedProtectionMiddleware:
+    """增强防护中间件 - 严格模式（纯ASGI）"""
 
     # 白名单路径（不检查）
     WHITELIST_PATHS = ["/health", "/docs", "/openapi.json", "/redoc"]
 
-    def __init__(self, app, **options):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, **options):
+        self.app = app
 
         # 宽松速率限制配置（适合正常用户使用）
         self.limits = {
@@ -31,10 +98,34 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
             'ad_watch': {'requests': 100, 'window': 3600},    # 看广告: 1小时100次（正常用户足够）
             'ad_random': {'requests': 200, 'window': 3600},   # 获取广告: 1小时200次（宽松）
             'withdraw': {'requests': 50, 'window': 3600},     # 提现: 1小时50次（足够用）
+            'withdraw_query': {'requests': 200, 'window': 60},  # 提现记录查询: 1分钟200次
             'user_info': {'requests': 200, 'window': 60},     # 用户信息: 1分钟200次（宽松）
+            'ad_query': {'requests': 200, 'window': 60},      # 广告统计/历史/可用列表: 1分钟200次
+            'game_submit': {'requests': 100, 'window': 60},   # 提交游戏结果: 1分钟100次
+            'leaderboard': {'requests': 100, 'window': 60},   # 排行榜: 1分钟100次
+            'version_check': {'requests': 100, 'window': 60}, # 检查更新: 1分钟100次
             'default': {'requests': 100, 'window': 60}        # 默认: 1分钟100次（宽松）
         }
 
+        # 按用户ID限流（路由通过 @rate_limit(..., per_user=True) 开启，与IP限流同时生效）
+        self.user_limits = {
+            'ad_watch': {'requests': 60, 'window': 3600},     # 单用户看广告: 1小时60次
+            'ad_random': {'requests': 120, 'window': 3600},   # 单用户获取广告: 1小时120次
+            'withdraw': {'requests': 20, 'window': 3600},     # 单用户提交提现: 1小时20次
+            'withdraw_query': {'requests': 120, 'window': 60},  # 单用户查询提现记录（翻页）: 1分钟120次
+            'user_info': {'requests': 120, 'window': 60},     # 单用户信息查询: 1分钟120次
+            'game_submit': {'requests': 60, 'window': 60},    # 单用户提交游戏: 1分钟60次
+        }
+
+        # 影子规则：与正式规则并行评估、独立计数，只记录日志和指标，不拦截请求
+        # 用于在收紧高成本接口的限额前观察误伤情况，确认后再合入 limits / user_limits
+        self.shadow_limits = {
+            'ad_watch': {'requests': 20, 'window': 60},       # 候选：单IP看广告1分钟20次
+        }
+        self.shadow_user_limits = {
+            'ad_watch': {'requests': 30, 'window': 3600},     # 候选：单用户看广告1小时30次
+        }
+
         # 请求间隔配置（秒）- 大幅放宽
         self.min_intervals = {
             'register': 60,       # 注册间隔：1分钟（之前5分钟太严格）
@@ -52,22 +143,55 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
             'ban_duration': 86400          # 封禁24小时
         }
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+        # 注册限流脚本（redis-py自动使用EVALSHA，脚本缓存丢失时回退EVAL）
+        self._rate_limit_script = async_redis_client.register_script(RATE_LIMIT_LUA)
+        self._violation_script = async_redis_client.register_script(VIOLATION_LUA)
+
+        ProtectionMetrics.set_limits({
+            'shadow_mode': settings.PROTECTION_SHADOW_MODE,
+            'limits': self.limits,
+            'user_limits': self.user_limits,
+            'shadow_limits': self.shadow_limits,
+            'shadow_user_limits': self.shadow_user_limits,
+            'auto_ban': self.auto_ban
+        })
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        response = await self._check_request(scope)
+        ProtectionMetrics.observe("middleware", time.perf_counter() - started)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    async def _check_request(self, scope: Scope):
+        """执行各层防护检查，需要拦截时返回响应，放行时返回None"""
+        path = scope["path"]
 
         # 白名单路径放行
         if any(path.startswith(p) for p in self.WHITELIST_PATHS):
-            return await call_next(request)
+            return None
 
         # 管理后台放行
         if path.startswith("/vfjsadrhbadmin"):
-            return await call_next(request)
+            return None
 
         # 获取客户端IP
-        client_ip = self._get_client_ip(request)
+        client_ip = self._get_client_ip(scope)
+
+        # 根据启动时编译的路由策略表确定限流类别
+        policy, user_id = match_policy(scope)
+        action = policy['action']
 
         # 1. 检查IP黑名单（优先级最高）
-        if IPServiceOptimized.is_ip_blocked_fast(client_ip):
+        if await IPServiceOptimized.is_ip_blocked_async(client_ip):
+            ProtectionMetrics.record(action, "blocked")
             logger.warning(f"🚫 黑名单IP访问: {client_ip} -> {path}")
             return JSONResponse(
                 status_code=403,
@@ -83,18 +207,30 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
             )
 
         # 2. 请求间隔检查已禁用（改为只使用速率限制）
-        # interval_check = self._check_request_interval(client_ip, path)
+        # interval_check = await self._check_request_interval(client_ip, action)
         # if not interval_check['allowed']:
         #     ...
 
         # 3. 检查速率限制（保留）
-        rate_check = self._check_rate_limit(client_ip, path)
+        rate_check = await self._check_rate_limit(client_ip, action, user_id)
         if not rate_check['allowed']:
-            self._record_violation(client_ip, "rate_limit")
-
-            # 检查是否需要自动封禁
-            if self._should_auto_ban(client_ip):
-                self._auto_ban_ip(client_ip, "频繁违规速率限制")
+            logger.warning(f"📊 超速率限制: {rate_check['scope']}={rate_check['identity']} -> {action} ({rate_check['current_count']}/{rate_check['max_requests']}，{rate_check['retry_after']}秒后重置)")
+            if settings.PROTECTION_SHADOW_MODE:
+                # 影子模式：只记录，不拦截、不封禁；违规计入单独的影子计数，
+                # 关闭影子模式后IP不会带着影子期间的违规次数被立即封禁
+                violation_count = await self._record_violation(client_ip, "rate_limit", shadow=True)
+                should_ban = self._should_auto_ban(violation_count)
+                ProtectionMetrics.record(action, "shadow_limited")
+                logger.warning(f"👻 [影子模式] 将{'封禁' if should_ban else '限流'}: {client_ip} -> {action}")
+                return None
+
+            violation_count = await self._record_violation(client_ip, "rate_limit")
+            should_ban = self._should_auto_ban(violation_count)
+
+            # 检查是否需要自动封禁（封禁只写Redis，落库由后台线程批量完成）
+            if should_ban:
+                ProtectionMetrics.record(action, "banned")
+                await self._auto_ban_ip(client_ip, "频繁违规速率限制")
                 return JSONResponse(
                     status_code=403,
                     content={
@@ -107,11 +243,19 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
                     }
                 )
 
+            ProtectionMetrics.record(action, "limited")
             action_name = {
                 'register': '注册',
                 'login': '登录',
                 'ad_watch': '观看广告',
                 'ad_random': '获取广告',
+                'ad_query': '查询广告',
+                'withdraw': '提现',
+                'withdraw_query': '查询提现记录',
+                'user_info': '查询用户信息',
+                'game_submit': '提交游戏',
+                'leaderboard': '查询排行榜',
+                'version_check': '检查更新',
                 'default': '请求'
             }.get(rate_check['action'], '请求')
 
@@ -132,47 +276,25 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
             )
 
         # 4. 记录请求时间（已禁用）
-        # self._record_request_time(client_ip, path)
+        # await self._record_request_time(client_ip, action)
 
-        return await call_next(request)
+        ProtectionMetrics.record(action, "allowed")
+        return None
 
-    def _get_client_ip(self, request: Request) -> str:
+    def _get_client_ip(self, scope: Scope) -> str:
         """获取客户端真实IP"""
-        forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
-
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
-
-        return request.client.host if request.client else "unknown"
-
-    def _get_action_type(self, path: str) -> str:
-        """根据路径获取操作类型"""
-        if '/register' in path or '/user/register' in path:
-            return 'register'
-        elif '/login' in path:
-            return 'login'
-        elif '/ad/watch' in path:
-            return 'ad_watch'
-        elif '/ad/random' in path or '/ad/' in path:
-            return 'ad_random'
-        elif '/withdraw' in path:
-            return 'withdraw'
-        elif '/user/' in path and ('/info' in path or path.endswith('/user')):
-            return 'user_info'
-        else:
-            return 'default'
+        headers = Headers(scope=scope)
+        client = scope.get("client")
+        return resolve_client_ip(client[0] if client else None,
+                                 headers.get("X-Forwarded-For"), headers.get("X-Real-IP"))
 
-    def _check_request_interval(self, ip: str, path: str) -> dict:
+    async def _check_request_interval(self, ip: str, action: str) -> dict:
         """检查请求间隔"""
         try:
-            action = self._get_action_type(path)
             min_interval = self.min_intervals.get(action, self.min_intervals['default'])
 
             redis_key = f"last_request:{ip}:{action}"
-            last_time = redis_client.get(redis_key)
+            last_time = await async_redis_client.get(redis_key)
 
             if last_time:
                 elapsed = time.time() - float(last_time)
@@ -193,137 +315,146 @@ class EnhancedProtectionMiddleware(BaseHTTPMiddleware):
             logger.error(f"间隔检查失败: {e}")
             return {'allowed': True}  # 优雅降级
 
-    def _record_request_time(self, ip: str, path: str):
+    async def _record_request_time(self, ip: str, action: str):
         """记录请求时间"""
         try:
-            action = self._get_action_type(path)
             redis_key = f"last_request:{ip}:{action}"
-            redis_client.setex(redis_key, 3600, str(time.time()))
+            await async_redis_client.setex(redis_key, 3600, str(time.time()))
         except Exception:
             pass
 
-    def _check_rate_limit(self, ip: str, path: str) -> dict:
-        """检查速率限制"""
+    async def _check_rate_limit(self, ip: str, action: str, user_id: str = None) -> dict:
+        """
+        检查速率限制（IP维度 + 可选的用户维度，Lua脚本一次往返完成判断+计数+retry_after）
+        Redis熔断或调用失败时改用进程内近似限流，不再直接放行
+        该类别配置了影子规则时与正式规则并发评估
+        """
+        checks = self._build_checks(
+            ip, user_id, self.limits.get(action, self.limits['default']), self.user_limits.get(action)
+        )
+        shadow_checks = self._build_checks(
+            ip, user_id, self.shadow_limits.get(action), self.shadow_user_limits.get(action)
+        )
+
+        if shadow_checks:
+            result, _ = await asyncio.gather(
+                self._evaluate_limits(checks, action, "rate_limit"),
+                self._check_shadow_limit(shadow_checks, action)
+            )
+        else:
+            result = await self._evaluate_limits(checks, action, "rate_limit")
+        return result
+
+    def _build_checks(self, ip: str, user_id: str, ip_config: dict, user_config: dict) -> list:
+        """组装需要检查的限流维度: [(维度, 标识, 配置), ...]"""
+        checks = []
+        if ip_config:
+            checks.append(('ip', ip, ip_config))
+        if user_id and user_config:
+            checks.append(('user', user_id, user_config))
+        return checks
+
+    async def _evaluate_limits(self, checks: list, action: str, key_prefix: str, fallback: bool = True) -> dict:
+        """执行一组限流检查（Redis脚本；fallback为True时Redis不可用则使用本地限流器）"""
+        now = time.time()
         try:
-            action = self._get_action_type(path)
-            config = self.limits.get(action, self.limits['default'])
-
-            max_requests = config['requests']
-            window = config['window']
-
-            redis_key = f"rate_limit:{ip}:{action}"
-            current = redis_client.get(redis_key)
+            redis_keys = []
+            args = [now]
+            for scope_name, identity, config in checks:
+                bucket = int(now // config['window'])
+                prefix = key_prefix if scope_name == 'ip' else f"{key_prefix}:user"
+                redis_keys.append(f"{prefix}:{identity}:{action}:{bucket}")
+                redis_keys.append(f"{prefix}:{identity}:{action}:{bucket - 1}")
+                args.extend([config['requests'], config['window']])
+
+            allowed, current_count, retry_after, failed_index = await guarded_call(
+                redis_breaker, self._rate_limit_script, keys=redis_keys, args=args
+            )
 
-            if current is None:
-                redis_client.setex(redis_key, window, 1)
+        except RedisUnavailable:
+            if not fallback:
                 return {'allowed': True}
-            else:
-                current_count = int(current)
-                if current_count >= max_requests:
-                    # 获取剩余过期时间
-                    ttl = redis_client.ttl(redis_key)
-                    retry_after = ttl if ttl > 0 else window
-
-                    logger.warning(f"📊 超速率限制: {ip} -> {action} ({current_count}/{max_requests}，{retry_after}秒后重置)")
-                    return {
-                        'allowed': False,
-                        'action': action,
-                        'current_count': current_count,
-                        'max_requests': max_requests,
-                        'window': window,
-                        'retry_after': retry_after
-                    }
-                else:
-                    redis_client.incr(redis_key)
-                    return {'allowed': True}
+            ProtectionMetrics.record(action, "local_fallback")
+            allowed, current_count, retry_after, failed_index = local_limiter.check(
+                [
+                    (f"{scope_name}:{identity}:{action}", config['requests'], config['window'])
+                    for scope_name, identity, config in checks
+                ],
+                now
+            )
 
-        except Exception as e:
-            logger.error(f"速率检查失败: {e}")
-            return {'allowed': True}  # 优雅降级
+        if not allowed:
+            scope_name, identity, config = checks[int(failed_index) - 1]
+            return {
+                'allowed': False,
+                'action': action,
+                'scope': scope_name,
+                'identity': identity,
+                'current_count': int(current_count),
+                'max_requests': config['requests'],
+                'window': config['window'],
+                'retry_after': int(retry_after)
+            }
+
+        return {'allowed': True}
+
+    async def _check_shadow_limit(self, checks: list, action: str):
+        """评估影子规则：独立计数，只记录会被拦截的请求（Redis不可用时跳过）"""
+        result = await self._evaluate_limits(checks, action, "rate_limit:shadow", fallback=False)
+        if not result['allowed']:
+            ProtectionMetrics.record(action, "shadow_limited")
+            logger.info(
+                f"👻 [影子规则] 将被限流: {result['scope']}={result['identity']} -> {action} "
+                f"({result['current_count']}/{result['max_requests']}，窗口{result['window']}秒)"
+            )
 
-    def _record_violation(self, ip: str, violation_type: str):
-        """记录违规行为"""
+    async def _record_violation(self, ip: str, violation_type: str, shadow: bool = False) -> int:
+        """
+        记录违规行为，返回窗口内的违规次数（一次Redis往返；Redis不可用时本地计数）
+        shadow: 影子模式下的违规，计入单独的键，不影响实际封禁判断
+        """
+        now = time.time()
+        prefix = "shadow_violations" if shadow else "violations"
         try:
-            redis_key = f"violations:{ip}"
-            violation_data = f"{violation_type}:{int(time.time())}"
-
-            # 添加违规记录
-            redis_client.lpush(redis_key, violation_data)
-            redis_client.expire(redis_key, self.auto_ban['violation_window'])
+            count = await guarded_call(
+                redis_breaker,
+                self._violation_script,
+                keys=[f"{prefix}_zset:{ip}"],
+                args=[
+                    now,
+                    f"{violation_type}:{now:.6f}",
+                    self.auto_ban['violation_window'],
+                    self.auto_ban['violation_threshold']
+                ]
+            )
+            return int(count)
 
-            # 限制列表长度
-            redis_client.ltrim(redis_key, 0, 99)
+        except RedisUnavailable:
+            return local_limiter.incr(f"{prefix}:{ip}", self.auto_ban['violation_window'], now)
 
-        except Exception as e:
-            logger.error(f"记录违规失败: {e}")
-
-    def _should_auto_ban(self, ip: str) -> bool:
+    def _should_auto_ban(self, violation_count: int) -> bool:
         """判断是否应该自动封禁"""
-        try:
-            redis_key = f"violations:{ip}"
-
-            # 获取最近的违规次数
-            violations = redis_client.lrange(redis_key, 0, -1)
-
-            if not violations:
-                return False
-
-            # 统计时间窗口内的违规
-            now = time.time()
-            window = self.auto_ban['violation_window']
-            recent_violations = 0
+        return violation_count >= self.auto_ban['violation_threshold']
 
-            for v in violations:
-                if isinstance(v, bytes):
-                    v = v.decode()
-                parts = v.split(':')
-                if len(parts) >= 2:
-                    timestamp = int(parts[1])
-                    if now - timestamp < window:
-                        recent_violations += 1
+    async def _auto_ban_ip(self, ip: str, reason: str):
+        """自动封禁IP（按配置前缀封禁整个网段，防止攻击者在网段内轮换地址）"""
+        try:
+            ip = ban_entry_for_ip(ip)
 
-            # 判断是否达到封禁阈值
-            return recent_violations >= self.auto_ban['violation_threshold']
+            # 立即加入Redis黑名单（各worker通过订阅同步本地快照）
+            await IPServiceOptimized.add_ip_to_blacklist_async(ip, self.auto_ban['ban_duration'])
 
-        except Exception as e:
-            logger.error(f"检查自动封禁失败: {e}")
-            return False
+            # 封禁记录入队，由AutoBanService后台线程批量写入数据库
+            await guarded_call(
+                redis_breaker,
+                AutoBanService.enqueue_ban_async,
+                ip, reason, self.auto_ban['ban_duration']
+            )
+            logger.warning(f"🔒 自动封禁IP: {ip} - {reason}")
 
-    def _auto_ban_ip(self, ip: str, reason: str):
-        """自动封禁IP"""
-        try:
-            # 添加到Redis黑名单
-            IPServiceOptimized.add_ip_to_blacklist_fast(ip)
-
-            # 添加到数据库黑名单
-            from models import IPBlacklist
-            db = next(get_db())
-            try:
-                # 检查是否已存在
-                existing = db.query(IPBlacklist).filter(
-                    IPBlacklist.ip_address == ip
-                ).first()
-
-                if not existing:
-                    from datetime import timedelta
-                    blacklist_entry = IPBlacklist(
-                        ip_address=ip,
-                        reason=f"自动封禁: {reason}",
-                        blocked_time=datetime.now(),
-                        expire_time=datetime.now() + timedelta(seconds=self.auto_ban['ban_duration']),
-                        is_active=1
-                    )
-                    db.add(blacklist_entry)
-                    db.commit()
-                    logger.warning(f"🔒 自动封禁IP: {ip} - {reason}")
-                else:
-                    # 更新过期时间
-                    existing.expire_time = datetime.now() + timedelta(seconds=self.auto_ban['ban_duration'])
-                    existing.is_active = 1
-                    db.commit()
-                    logger.warning(f"🔒 延长封禁IP: {ip} - {reason}")
-            finally:
-                db.close()
+        except RedisUnavailable:
+            # Redis不可用：封禁只在本worker的本地快照中生效，不落库
+            logger.warning(f"🔒 自动封禁IP(仅本地生效，Redis不可用): {ip} - {reason}")
 
         except Exception as e:
             logger.error(f"自动封禁失败: {e}")
@@ -1,18 +1,19 @@
 """
 优化的IP拦截中间件 - 减少日志、使用Redis缓存
+纯ASGI实现，黑名单检查走进程内快照/异步Redis，不阻塞事件循环
 """
-from fastapi import Request
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 from services.ip_service_optimized import IPServiceOptimized
-from database import get_db
+from services.client_ip import resolve_client_ip
 import logging
 import time
 
 logger = logging.getLogger(__name__)
 
 
-class OptimizedIPBlockMiddleware(BaseHTTPMiddleware):
+class OptimizedIPBlockMiddleware:
     """优化的IP黑名单拦截中间件"""
 
     # 白名单路径（不检查IP）
@@ -22,26 +23,39 @@ class OptimizedIPBlockMiddleware(BaseHTTPMiddleware):
     _blocked_cache = {}  # {ip: last_log_time}
     _cache_ttl = 60  # 60秒内不重复记录同一IP的拦截日志
 
-    def __init__(self, app, **options):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, **options):
+        self.app = app
         self.silent_mode = options.get('silent_mode', True)  # 静默模式，不记录日志
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response = await self._check_request(scope)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    async def _check_request(self, scope: Scope):
+        """检查黑名单，需要拦截时返回响应，放行时返回None"""
         # 白名单路径直接放行
-        path = request.url.path
+        path = scope["path"]
         if any(path.startswith(p) for p in self.WHITELIST_PATHS):
-            return await call_next(request)
+            return None
 
         # 管理后台路径放行
         if path.startswith("/vfjsadrhbadmin"):
-            return await call_next(request)
+            return None
 
         # 获取客户端IP
-        client_ip = self._get_client_ip(request)
+        client_ip = self._get_client_ip(scope)
 
         if client_ip:
-            # 使用优化的快速检查（纯Redis）
-            if IPServiceOptimized.is_ip_blocked_fast(client_ip):
+            # 使用优化的快速检查（本地快照/异步Redis）
+            if await IPServiceOptimized.is_ip_blocked_async(client_ip):
                 # 静默拦截（减少日志记录）
                 should_log = self._should_log_blocked_ip(client_ip)
 
@@ -58,19 +72,14 @@ class OptimizedIPBlockMiddleware(BaseHTTPMiddleware):
                     }
                 )
 
-        return await call_next(request)
+        return None
 
-    def _get_client_ip(self, request: Request) -> str:
+    def _get_client_ip(self, scope: Scope) -> str:
         """获取客户端真实IP"""
-        forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
-
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
-
-        return request.client.host if request.client else "unknown"
+        headers = Headers(scope=scope)
+        client = scope.get("client")
+        return resolve_client_ip(client[0] if client else None,
+                                 headers.get("X-Forwarded-For"), headers.get("X-Real-IP"))
 
     def _should_log_blocked_ip(self, ip: str) -> bool:
         """判断是否应该记录拦截日志（避免重复记录）"""
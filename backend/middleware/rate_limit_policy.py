@@ -0,0 +1,147 @@
+"""
+声明式限流策略
+路由通过 @rate_limit("ad_watch", per_user=True) 声明所属的限流类别，
+启动时从FastAPI路由表编译成按路径分段的查找树，中间件每个请求只需按段查表即可完成分类
+"""
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qs
+
+RATE_LIMIT_ATTR = "__rate_limit_policy__"
+
+# 查找树中的特殊键
+_PARAM = "{param}"          # 单段路径参数，如 {user_id}
+_CATCH_ALL = "{path}"       # 多段路径参数，如 {ip_address:path}
+_ENDPOINTS = "__endpoints__"
+
+DEFAULT_POLICY = {"action": "default", "per_user": False, "user_index": None}
+
+
+def rate_limit(action: str, per_user: bool = False):
+    """
+    声明路由的限流类别（装饰器放在 @router.xxx 之下）
+
+    Args:
+        action: 限流类别，对应中间件 limits / user_limits 中的键
+        per_user: 是否同时按 user_id（路径参数或查询参数）单独限流
+    """
+    def decorator(func):
+        setattr(func, RATE_LIMIT_ATTR, {"action": action, "per_user": per_user})
+        return func
+    return decorator
+
+
+class RateLimitPolicyTable:
+    """路由限流策略查找表（路径分段树，字面段优先于参数段）"""
+
+    def __init__(self):
+        self._root: Dict = {}
+        self.compiled = False
+
+    def compile(self, routes: Iterable):
+        """从路由表编译查找树，可重复调用（整体替换）"""
+        root: Dict = {}
+        for route in routes:
+            endpoint = getattr(route, "endpoint", None)
+            path = getattr(route, "path", None)
+            if endpoint is None or path is None:
+                continue
+
+            declared = getattr(endpoint, RATE_LIMIT_ATTR, None) or DEFAULT_POLICY
+            segments = [seg for seg in path.split("/") if seg]
+            user_index = None
+            node = root
+            for index, seg in enumerate(segments):
+                if seg.startswith("{") and seg.endswith("}"):
+                    name, _, convertor = seg[1:-1].partition(":")
+                    if name == "user_id":
+                        user_index = index
+                    key = _CATCH_ALL if convertor == "path" else _PARAM
+                else:
+                    key = seg
+                node = node.setdefault(key, {})
+                if key == _CATCH_ALL:
+                    break
+
+            policy = {
+                "action": declared["action"],
+                "per_user": declared.get("per_user", False),
+                "user_index": user_index
+            }
+            endpoints = node.setdefault(_ENDPOINTS, {})
+            for method in getattr(route, "methods", None) or ["*"]:
+                # 与路由匹配顺序一致：同一路径+方法以先注册的为准
+                endpoints.setdefault(method, policy)
+
+        self._root = root
+        self.compiled = True
+
+    def match(self, method: str, path: str) -> Dict:
+        """查找请求对应的限流策略，未匹配任何路由时返回默认策略"""
+        segments = [seg for seg in path.split("/") if seg]
+        endpoints = self._match_node(self._root, segments, 0)
+        if not endpoints:
+            return DEFAULT_POLICY
+        policy = endpoints.get(method) or endpoints.get("*")
+        if policy is None and method == "HEAD":
+            policy = endpoints.get("GET")
+        if policy is None:
+            # 方法不匹配（会返回405），按同路径的任一策略分类
+            policy = next(iter(endpoints.values()))
+        return policy
+
+    def _match_node(self, node: Dict, segments, index: int) -> Optional[Dict]:
+        if index == len(segments):
+            return node.get(_ENDPOINTS)
+
+        child = node.get(segments[index])
+        if child is not None:
+            found = self._match_node(child, segments, index + 1)
+            if found:
+                return found
+
+        child = node.get(_PARAM)
+        if child is not None:
+            found = self._match_node(child, segments, index + 1)
+            if found:
+                return found
+
+        child = node.get(_CATCH_ALL)
+        if child is not None:
+            return child.get(_ENDPOINTS)
+        return None
+
+    @staticmethod
+    def resolve_user_id(policy: Dict, path: str, query_string: bytes) -> Optional[str]:
+        """按策略提取user_id：优先取路径参数，其次取查询参数"""
+        if not policy["per_user"]:
+            return None
+        if policy["user_index"] is not None:
+            segments = [seg for seg in path.split("/") if seg]
+            if policy["user_index"] < len(segments):
+                return segments[policy["user_index"]]
+        if query_string:
+            values = parse_qs(query_string.decode("latin-1")).get("user_id")
+            if values:
+                return values[0]
+        return None
+
+
+# 全局策略表（应用启动时编译）
+policy_table = RateLimitPolicyTable()
+
+
+def compile_rate_limit_policies(app) -> RateLimitPolicyTable:
+    """从应用路由表编译全局策略表"""
+    policy_table.compile(app.routes)
+    return policy_table
+
+
+def match_policy(scope) -> Tuple[Dict, Optional[str]]:
+    """中间件入口：返回 (策略, user_id)；策略表未编译时从scope中的应用路由表即时编译"""
+    if not policy_table.compiled:
+        app = scope.get("app")
+        if app is not None and hasattr(app, "routes"):
+            policy_table.compile(app.routes)
+    policy = policy_table.match(scope.get("method", "GET"), scope["path"])
+    user_id = RateLimitPolicyTable.resolve_user_id(policy, scope["path"], scope.get("query_string", b""))
+    return policy, user_id
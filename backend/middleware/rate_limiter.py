@@ -5,6 +5,7 @@
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 from database import redis_client
+from services.client_ip import resolve_client_ip
 from datetime import datetime, timedelta
 import time
 
@@ -44,19 +45,9 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         return response
 
     def get_client_ip(self, request: Request) -> str:
-        """获取客户端IP"""
-        # 检查X-Forwarded-For头（代理情况）
-        forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
-
-        # 检查X-Real-IP头
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
-
-        # 返回直接连接IP
-        return request.client.host if request.client else "unknown"
+        """获取客户端IP（只信任受信代理添加的转发头）"""
+        return resolve_client_ip(request.client.host if request.client else None,
+                                 request.headers.get("X-Forwarded-For"), request.headers.get("X-Real-IP"))
 
     def get_limit_config(self, request: Request) -> dict:
         """根据路径获取限制配置"""
@@ -0,0 +1,101 @@
+-- 金额字段从 DECIMAL(元/金币，两位小数) 改为 BIGINT（整数分，1金币 = 100分，1元 = 100分）
+-- 新建库由 Base.metadata.create_all 自动创建；已有库在停服后执行本脚本一次，再启动新版本
+-- 每张表：先放宽精度避免乘100溢出，再乘以100，最后改为BIGINT（此时已全部为整数，不会发生取整）
+-- Redis中的每日广告计数改用新键名（ad_daily:v2:*），旧格式的键在当天零点自然过期，无需处理
+--
+-- 可重复执行：每张表的乘100只在以下条件同时满足时执行
+--   1. 执行前该表的金额列还不是BIGINT（新建库或已迁移完成的表跳过）
+--   2. system_configs 中没有该表的迁移标记（乘100与写入标记在同一事务中，
+--      在乘100之后、改为BIGINT之前中断的表，重新执行时不会再乘一次）
+
+USE game_db;
+
+-- 用户余额
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND COLUMN_NAME = 'coins')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:users');
+ALTER TABLE users
+    MODIFY COLUMN coins DECIMAL(14, 2) DEFAULT 0,
+    MODIFY COLUMN total_coins DECIMAL(14, 2) DEFAULT 0;
+START TRANSACTION;
+UPDATE users SET coins = coins * 100, total_coins = total_coins * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:users', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE users
+    MODIFY COLUMN coins BIGINT DEFAULT 0 COMMENT '金币余额（分）',
+    MODIFY COLUMN total_coins BIGINT DEFAULT 0 COMMENT '历史总金币（分）';
+
+-- 金币流水
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'coin_transactions' AND COLUMN_NAME = 'amount')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:coin_transactions');
+ALTER TABLE coin_transactions
+    MODIFY COLUMN amount DECIMAL(14, 2) NOT NULL,
+    MODIFY COLUMN balance_after DECIMAL(14, 2) NOT NULL;
+START TRANSACTION;
+UPDATE coin_transactions SET amount = amount * 100, balance_after = balance_after * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:coin_transactions', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE coin_transactions
+    MODIFY COLUMN amount BIGINT NOT NULL COMMENT '金币数量（分，正数为收入，负数为支出）',
+    MODIFY COLUMN balance_after BIGINT NOT NULL COMMENT '操作后余额（分）';
+
+-- 提现申请
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'withdraw_requests' AND COLUMN_NAME = 'amount')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:withdraw_requests');
+ALTER TABLE withdraw_requests
+    MODIFY COLUMN amount DECIMAL(14, 2) NOT NULL,
+    MODIFY COLUMN coins_used DECIMAL(14, 2) NOT NULL;
+START TRANSACTION;
+UPDATE withdraw_requests SET amount = amount * 100, coins_used = coins_used * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:withdraw_requests', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE withdraw_requests
+    MODIFY COLUMN amount BIGINT NOT NULL COMMENT '提现金额（人民币，分）',
+    MODIFY COLUMN coins_used BIGINT NOT NULL COMMENT '消耗金币数量（分）';
+
+-- 广告配置
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ad_configs' AND COLUMN_NAME = 'reward_coins')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:ad_configs');
+ALTER TABLE ad_configs MODIFY COLUMN reward_coins DECIMAL(14, 2) DEFAULT 0;
+START TRANSACTION;
+UPDATE ad_configs SET reward_coins = reward_coins * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:ad_configs', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE ad_configs MODIFY COLUMN reward_coins BIGINT DEFAULT 0 COMMENT '观看奖励金币（分）';
+
+-- 广告观看记录
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ad_watch_records' AND COLUMN_NAME = 'reward_coins')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:ad_watch_records');
+ALTER TABLE ad_watch_records MODIFY COLUMN reward_coins DECIMAL(14, 2) DEFAULT 0;
+START TRANSACTION;
+UPDATE ad_watch_records SET reward_coins = reward_coins * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:ad_watch_records', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE ad_watch_records MODIFY COLUMN reward_coins BIGINT DEFAULT 0 COMMENT '获得金币（分）';
+
+-- 游戏记录
+SET @convert = (SELECT DATA_TYPE <> 'bigint' FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'game_records' AND COLUMN_NAME = 'reward_coins')
+    AND NOT EXISTS (SELECT 1 FROM system_configs WHERE config_key = 'migrated_to_cents:game_records');
+ALTER TABLE game_records MODIFY COLUMN reward_coins DECIMAL(14, 2) DEFAULT 0;
+START TRANSACTION;
+UPDATE game_records SET reward_coins = reward_coins * 100 WHERE @convert;
+INSERT INTO system_configs (config_key, config_value, description)
+    SELECT 'migrated_to_cents:game_records', NOW(), '金额改为整数分的迁移已执行' FROM DUAL WHERE @convert;
+COMMIT;
+ALTER TABLE game_records MODIFY COLUMN reward_coins BIGINT DEFAULT 0 COMMENT '奖励金币（分）';
+
+-- 验证
+SELECT id, coins, total_coins FROM users ORDER BY id LIMIT 10;
+DESCRIBE users;
+DESCRIBE coin_transactions;
+DESCRIBE withdraw_requests;
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, DateTime, Text, Enum, ForeignKey, Index
+from sqlalchemy import Column, Integer, BigInteger, String, DECIMAL, Date, DateTime, Text, Enum, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -43,8 +43,8 @@ class User(Base):
     username = Column(String(50), unique=True, comment="用户名（可选）")
     nickname = Column(String(50), comment="昵称")
     avatar = Column(String(255), comment="头像URL")
-    coins = Column(DECIMAL(10, 2), default=0, comment="金币余额")
-    total_coins = Column(DECIMAL(10, 2), default=0, comment="历史总金币")
+    coins = Column(BigInteger, default=0, comment="金币余额（分）")
+    total_coins = Column(BigInteger, default=0, comment="历史总金币（分）")
     level = Column(Integer, default=1, comment="用户等级")
     experience = Column(Integer, default=0, comment="用户经验值")
     game_count = Column(Integer, default=0, comment="游戏次数")
@@ -69,7 +69,7 @@ class AdConfig(Base):
     webpage_url = Column(String(500), comment="网页跳转URL（网页广告用）")
     image_url = Column(String(500), comment="广告图片URL")
     duration = Column(Integer, nullable=False, comment="展示时长（秒）")
-    reward_coins = Column(DECIMAL(8, 2), default=0, comment="观看奖励金币")
+    reward_coins = Column(BigInteger, default=0, comment="观看奖励金币（分）")
     daily_limit = Column(Integer, default=10, comment="每日观看限制")
     min_watch_duration = Column(Integer, default=15, comment="最少观看时长（秒）")
     weight = Column(Integer, default=1, comment="权重（用于随机选择）")
@@ -89,11 +89,12 @@ class AdWatchRecord(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     ad_id = Column(Integer, ForeignKey("ad_configs.id"), nullable=False)
     watch_duration = Column(Integer, nullable=False, comment="实际观看时长（秒）")
-    reward_coins = Column(DECIMAL(8, 2), default=0, comment="获得金币")
+    reward_coins = Column(BigInteger, default=0, comment="获得金币（分）")
     is_completed = Column(Integer, default=0, comment="是否完整观看")
     ip_address = Column(String(45), comment="IP地址")
     device_info = Column(Text, comment="设备信息")
     watch_time = Column(DateTime, default=func.now())
+    watch_key = Column(String(32), unique=True, comment="观看记录关联键（金币流水的related_key，延迟写入时记录ID在落库前未知）")
     
     # 关系
     user = relationship("User", back_populates="ad_watch_records")
@@ -103,6 +104,8 @@ class AdWatchRecord(Base):
     __table_args__ = (
         Index('idx_user_date', 'user_id', func.date('watch_time')),
         Index('idx_ad_date', 'ad_id', func.date('watch_time')),
+        Index('idx_user_watch_time', 'user_id', 'watch_time'),  # 今日计数按时间范围查询
+        Index('idx_ad_watch_time', 'ad_id', 'watch_time'),
     )
 
 class SystemConfig(Base):
@@ -120,10 +123,11 @@ class CoinTransaction(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     type = Column(Enum(TransactionType), nullable=False)
-    amount = Column(DECIMAL(10, 2), nullable=False, comment="金币数量（正数为收入，负数为支出）")
-    balance_after = Column(DECIMAL(10, 2), nullable=False, comment="操作后余额")
+    amount = Column(BigInteger, nullable=False, comment="金币数量（分，正数为收入，负数为支出）")
+    balance_after = Column(BigInteger, nullable=False, comment="操作后余额（分）")
     description = Column(String(200), comment="描述")
     related_id = Column(Integer, comment="关联ID（如广告ID、游戏记录ID等）")
+    related_key = Column(String(32), comment="关联键（广告奖励：观看记录的watch_key）")
     created_time = Column(DateTime, default=func.now())
     
     # 关系
@@ -139,8 +143,8 @@ class WithdrawRequest(Base):
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    amount = Column(DECIMAL(8, 2), nullable=False, comment="提现金额（人民币）")
-    coins_used = Column(DECIMAL(10, 2), nullable=False, comment="消耗金币数量")
+    amount = Column(BigInteger, nullable=False, comment="提现金额（人民币，分）")
+    coins_used = Column(BigInteger, nullable=False, comment="消耗金币数量（分）")
     alipay_account = Column(String(100), comment="支付宝账号")
     real_name = Column(String(50), comment="真实姓名")
     status = Column(Enum(WithdrawStatus), default=WithdrawStatus.PENDING)
@@ -154,6 +158,7 @@ class WithdrawRequest(Base):
     # 索引
     __table_args__ = (
         Index('idx_user_status', 'user_id', 'status'),
+        Index('idx_user_request_time', 'user_id', 'request_time'),  # 提现记录按 (时间, id) 游标分页
     )
 
 class GameRecord(Base):
@@ -164,7 +169,7 @@ class GameRecord(Base):
     score = Column(Integer, nullable=False, comment="游戏得分")
     duration = Column(Integer, nullable=False, comment="游戏时长（秒）")
     needles_inserted = Column(Integer, default=0, comment="成功插入针数")
-    reward_coins = Column(DECIMAL(8, 2), default=0, comment="奖励金币")
+    reward_coins = Column(BigInteger, default=0, comment="奖励金币（分）")
     play_time = Column(DateTime, default=func.now())
     
     # 关系
@@ -174,8 +179,34 @@ class GameRecord(Base):
     __table_args__ = (
         Index('idx_user_score', 'user_id', 'score'),
         Index('idx_score_time', 'score', 'play_time'),
+        Index('idx_user_play_time', 'user_id', 'play_time'),  # 游戏历史按 (时间, id) 游标分页
     )
 
+class GameDailyStats(Base):
+    """每日游戏统计汇总（提交游戏时增量更新；每天按 user_id % 分片数 分为多行，避免单行热点）"""
+    __tablename__ = "game_daily_stats"
+    
+    stat_date = Column(Date, primary_key=True, comment="统计日期")
+    slot = Column(Integer, primary_key=True, autoincrement=False, comment="分片（user_id % 分片数）")
+    games = Column(Integer, nullable=False, default=0, comment="游戏局数")
+    players = Column(Integer, nullable=False, default=0, comment="游戏人数（去重）")
+    score_sum = Column(BigInteger, nullable=False, default=0, comment="得分合计")
+    max_score = Column(Integer, nullable=False, default=0, comment="最高得分")
+    total_coins = Column(BigInteger, nullable=False, default=0, comment="奖励金币合计（分）")
+    updated_time = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class GameDailyPlayer(Base):
+    """
+    用户每日游戏计数（提交游戏时在事务开始处 upsert 并持有行锁，同一用户的并发提交在此排队）
+    用于判断当天第一局（游戏人数去重）和每日奖励次数上限；不设外键，避免外键检查对用户行加共享锁
+    """
+    __tablename__ = "game_daily_players"
+    
+    stat_date = Column(Date, primary_key=True, comment="统计日期")
+    user_id = Column(Integer, primary_key=True, autoincrement=False, comment="用户ID")
+    games = Column(Integer, nullable=False, default=0, comment="当天游戏局数")
+    rewarded_games = Column(Integer, nullable=False, default=0, comment="当天获得奖励的局数")
+
 class UserLevelConfig(Base):
     __tablename__ = "user_level_configs"
     
@@ -239,7 +270,7 @@ class IPBlacklist(Base):
     __tablename__ = "ip_blacklist"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    ip_address = Column(String(45), unique=True, nullable=False, comment="IP地址")
+    ip_address = Column(String(45), unique=True, nullable=False, comment="IP地址或CIDR网段（如1.2.3.0/24）")
     reason = Column(String(500), comment="封禁原因")
     block_type = Column(String(20), default="manual", comment="封禁类型：manual=手动, auto=自动")
     related_user_ids = Column(Text, comment="关联的用户ID列表，逗号分隔")
@@ -252,6 +283,7 @@ class IPBlacklist(Base):
 
     __table_args__ = (
         Index('idx_ip_active', 'ip_address', 'is_active'),
+        Index('idx_ip_updated_time', 'updated_time'),  # 黑名单增量同步
     )
 
 
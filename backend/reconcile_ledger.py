@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+金币账本对账 - 核对用户余额与金币流水合计，报告或修复差异（建议每晚定时运行）
+使用方法:
+  python reconcile_ledger.py                 # 只报告差异（有未完成的检查点时从检查点继续）
+  python reconcile_ledger.py --repair        # 报告并写入调整流水修复差异
+  python reconcile_ledger.py --restart       # 忽略检查点，从头开始
+  python reconcile_ledger.py --budget 0.1    # 对账查询耗时不超过运行时间的10%
+
+crontab示例（每天凌晨3点）:
+  0 3 * * * cd /path/to/backend && python reconcile_ledger.py >> reconcile_ledger.log 2>&1
+"""
+import sys
+import argparse
+from config import settings
+from services.ledger_reconciler import LedgerReconciler
+from services.money import format_cents
+
+
+def print_drift(drift):
+    print(f"⚠️  用户{drift.user_id}: 余额{format_cents(drift.balance)} "
+          f"流水合计{format_cents(drift.ledger_total)} 差额{format_cents(drift.difference)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='金币账本对账')
+    parser.add_argument('--repair', action='store_true', help='写入调整流水修复差异（默认只报告）')
+    parser.add_argument('--restart', action='store_true', help='忽略检查点，从头开始')
+    parser.add_argument('--chunk-size', type=int, default=settings.LEDGER_RECONCILE_CHUNK_SIZE,
+                        help=f'每批核对的用户数，默认{settings.LEDGER_RECONCILE_CHUNK_SIZE}')
+    parser.add_argument('--budget', type=float, default=settings.LEDGER_RECONCILE_DB_BUDGET,
+                        help=f'数据库负载预算（0~1，1表示不限速），默认{settings.LEDGER_RECONCILE_DB_BUDGET}')
+    parser.add_argument('--max-chunks', type=int, default=None, help='本次最多处理的批数（未完成的部分下次继续）')
+
+    args = parser.parse_args()
+
+    print(f"🔍 开始对账（{'修复' if args.repair else '只报告'}模式，每批{args.chunk_size}个用户，负载预算{args.budget}）")
+    try:
+        result = LedgerReconciler.run(
+            repair=args.repair,
+            resume=not args.restart,
+            chunk_size=args.chunk_size,
+            db_budget=args.budget,
+            max_chunks=args.max_chunks,
+            on_drift=print_drift
+        )
+    except KeyboardInterrupt:
+        print("\n✋ 已中断，下次运行将从检查点继续")
+        sys.exit(130)
+
+    status = "✅ 对账完成" if result["finished"] else f"⏸️  已处理到用户ID {result['last_user_id']}，下次运行将继续"
+    print(f"{status}: 核对{result['checked']}个用户，差异{result['drifted']}个"
+          f"（合计{format_cents(result['drift_total'])}金币），修复{result['repaired']}个，"
+          f"无对应用户的流水{result['orphans']}个用户")
+    sys.exit(1 if result["drifted"] > result["repaired"] else 0)
+
+
+if __name__ == "__main__":
+    main()
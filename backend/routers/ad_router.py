@@ -5,14 +5,20 @@ from schemas import *
 from models import AdWatchRecord, AdConfig
 from services.ad_service import AdService
 from services.user_service import UserService
+from services.ad_daily_counter import AdDailyCounter
+from services.money import CENTS_PER_UNIT, apply_multiplier, from_cents
+from services.pagination import paginate
+from middleware.rate_limit_policy import rate_limit
+from typing import Optional
 
 router = APIRouter()
 
 @router.get("/random/{user_id}", response_model=BaseResponse)
+@rate_limit("ad_random", per_user=True)
 async def get_random_ad(user_id: str, db: Session = Depends(get_db)):
     """获取随机广告"""
     # 验证用户存在
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
 
@@ -31,11 +37,11 @@ async def get_random_ad(user_id: str, db: Session = Depends(get_db)):
     # 优化：一次性获取等级配置
     from services.level_service import LevelService
     level_config = LevelService.get_user_level_config(db, user.level)
-    multiplier = float(level_config.ad_coin_multiplier) if level_config else 1.0
+    multiplier = level_config.ad_coin_multiplier if level_config else 1
 
-    base_coins = float(ad.reward_coins) if ad.reward_coins > 0 else 100.0
-    actual_reward = round(base_coins * multiplier, 2)
-    ad_data['reward_coins'] = int(actual_reward)
+    base_coins = ad.reward_coins if ad.reward_coins > 0 else 10000
+    actual_reward = apply_multiplier(base_coins, multiplier)
+    ad_data['reward_coins'] = actual_reward // CENTS_PER_UNIT  # 客户端显示整数金币
 
     return BaseResponse(
         message="获取成功",
@@ -43,6 +49,7 @@ async def get_random_ad(user_id: str, db: Session = Depends(get_db)):
     )
 
 @router.post("/watch/{user_id}", response_model=BaseResponse)
+@rate_limit("ad_watch", per_user=True)
 async def watch_ad(
     user_id: str,
     watch_request: AdWatchRequest,
@@ -51,7 +58,7 @@ async def watch_ad(
 ):
     """观看广告并获得奖励"""
     # 验证用户存在
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -59,26 +66,25 @@ async def watch_ad(
     client_ip = request.client.host
     
     # 处理广告观看
-    result = AdService.watch_ad(db, user_id, watch_request, client_ip)
+    result = AdService.watch_ad(db, user_id, watch_request, client_ip, user=user)
     
     if result["success"]:
-        # 获取用户最新金币余额
-        updated_user = UserService.get_user_by_id(db, user_id)
         return BaseResponse(
             message=result["message"],
             data={
-                "reward_coins": float(result["reward_coins"]),
+                "reward_coins": from_cents(result["reward_coins"]),
                 "is_completed": result["is_completed"],
-                "user_coins": float(updated_user.coins) if updated_user else 0
+                "user_coins": from_cents(result["user_coins"])
             }
         )
     else:
         raise HTTPException(status_code=400, detail=result["message"])
 
 @router.get("/stats/{user_id}", response_model=BaseResponse)
+@rate_limit("ad_query")
 async def get_user_ad_stats(user_id: str, db: Session = Depends(get_db)):
     """获取用户广告观看统计"""
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -90,23 +96,28 @@ async def get_user_ad_stats(user_id: str, db: Session = Depends(get_db)):
     )
 
 @router.get("/history/{user_id}")
+@rate_limit("ad_query")
 async def get_user_ad_history(
     user_id: str,
     page: int = 1,
     size: int = 20,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
     db: Session = Depends(get_db)
 ):
-    """获取用户广告观看历史"""
-    user = UserService.get_user_by_id(db, user_id)
+    """获取用户广告观看历史（传cursor时按游标分页，不传时按页码分页）"""
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    skip = (page - 1) * size
-    records = db.query(AdWatchRecord).filter(
-        AdWatchRecord.user_id == user_id
-    ).order_by(AdWatchRecord.watch_time.desc()).offset(skip).limit(size).all()
-    
-    total = db.query(AdWatchRecord).filter(AdWatchRecord.user_id == user_id).count()
+    try:
+        records, page_info = paginate(
+            db.query(AdWatchRecord).filter(AdWatchRecord.user_id == user_id),
+            AdWatchRecord.watch_time, AdWatchRecord.id,
+            size, page=page, cursor=cursor, include_total=include_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # 获取广告信息
     ad_ids = [r.ad_id for r in records]
@@ -122,29 +133,24 @@ async def get_user_ad_history(
             "ad_id": record.ad_id,
             "ad_name": ad_info.name if ad_info else "已删除广告",
             "watch_duration": record.watch_duration,
-            "reward_coins": float(record.reward_coins),
+            "reward_coins": from_cents(record.reward_coins),
             "is_completed": record.is_completed,
             "watch_time": record.watch_time
         })
     
     return BaseResponse(
         message="获取成功",
-        data={
-            "items": items,
-            "total": total,
-            "page": page,
-            "size": size,
-            "pages": (total + size - 1) // size
-        }
+        data={"items": items, **page_info}
     )
 
 @router.get("/available/{user_id}")
+@rate_limit("ad_query")
 async def get_available_ads(user_id: str, db: Session = Depends(get_db)):
     """获取用户可观看的广告列表"""
-    from datetime import date, datetime
-    from sqlalchemy import func, or_
+    from datetime import datetime
+    from sqlalchemy import or_
 
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
 
@@ -156,24 +162,13 @@ async def get_available_ads(user_id: str, db: Session = Depends(get_db)):
         or_(AdConfig.end_time.is_(None), AdConfig.end_time >= now)
     ).all()
 
-    today = date.today()
-
-    # 优化：一次性查询用户今日所有广告的观看次数（避免N+1查询）
-    watch_counts = db.query(
-        AdWatchRecord.ad_id,
-        func.count(AdWatchRecord.id).label('count')
-    ).filter(
-        AdWatchRecord.user_id == user_id,
-        func.date(AdWatchRecord.watch_time) == today
-    ).group_by(AdWatchRecord.ad_id).all()
-
-    # 转换为字典方便查找
-    watch_count_dict = {wc.ad_id: wc.count for wc in watch_counts}
+    # 用户今日各广告观看次数（Redis每日计数，一次往返；不可用时回退数据库）
+    watch_count_dict = AdDailyCounter.get_today(db, user_id)["ads"]
 
     # 优化：一次性获取等级配置（避免每个广告都查询一次）
     from services.level_service import LevelService
     level_config = LevelService.get_user_level_config(db, user.level)
-    multiplier = float(level_config.ad_coin_multiplier) if level_config else 1.0
+    multiplier = level_config.ad_coin_multiplier if level_config else 1
 
     available_ads = []
     for ad in all_ads:
@@ -184,8 +179,7 @@ async def get_available_ads(user_id: str, db: Session = Depends(get_db)):
         remaining_today = max(0, (ad.daily_limit or 10) - watched_today)
 
         # 直接使用已查询的倍率计算金币
-        base_coins = float(ad.reward_coins or 0)
-        actual_coins = round(base_coins * multiplier, 2)
+        actual_coins = apply_multiplier(ad.reward_coins or 0, multiplier)
 
         ad_data = {
             "id": ad.id,
@@ -195,8 +189,8 @@ async def get_available_ads(user_id: str, db: Session = Depends(get_db)):
             "webpage_url": ad.webpage_url,
             "image_url": ad.image_url,
             "duration": ad.duration,
-            "reward_coins": float(ad.reward_coins or 0),  # 基础金币
-            "actual_reward_coins": actual_coins,  # 用户实际能获得的金币
+            "reward_coins": from_cents(ad.reward_coins),  # 基础金币
+            "actual_reward_coins": from_cents(actual_coins),  # 用户实际能获得的金币
             "daily_limit": ad.daily_limit or 10,
             "min_watch_duration": ad.min_watch_duration or 15,
             "weight": ad.weight or 1,
@@ -14,6 +14,8 @@ from services.user_service import UserService
 from services.ad_service import AdService
 from services.config_service import ConfigService
 from services.version_service import VersionService
+from services.game_stats_service import GameDailyStatsService
+from services.money import to_cents, from_cents, format_cents
 from models import *
 from typing import List, Optional
 import os
@@ -241,12 +243,9 @@ async def admin_dashboard(request: Request, db: Session = Depends(get_db)):
         User.last_login_time <= today_end
     ).scalar() or 0
     
-    # 游戏统计
-    total_games = db.query(func.count(GameRecord.id)).scalar() or 0
-    today_games = db.query(func.count(GameRecord.id)).filter(
-        GameRecord.play_time >= today_start,
-        GameRecord.play_time <= today_end
-    ).scalar() or 0
+    # 游戏统计（每日游戏统计汇总表）
+    total_games = GameDailyStatsService.get_totals(db)["games"]
+    today_games = GameDailyStatsService.get_day(db, today)["games"]
     
     # 广告统计
     total_ads_watched = db.query(func.count(AdWatchRecord.id)).scalar() or 0
@@ -282,10 +281,10 @@ async def admin_dashboard(request: Request, db: Session = Depends(get_db)):
         "games": {"total": total_games, "today": today_games},
         "ads": {"total": total_ads_watched, "today": today_ads},
         "coins": {
-            "total": float(total_coins), 
-            "today": float(today_coins),
-            "ad_total": float(total_ad_coins),  # 广告金币总计
-            "ad_today": float(today_ad_coins)   # 今日广告金币
+            "total": from_cents(total_coins), 
+            "today": from_cents(today_coins),
+            "ad_total": from_cents(total_ad_coins),  # 广告金币总计
+            "ad_today": from_cents(today_ad_coins)   # 今日广告金币
         },
         "withdraws": {"pending": pending_withdraws}
     }
@@ -326,6 +325,8 @@ async def get_admin_stats(request: Request, db: Session = Depends(get_db)):
     
     today = date.today()
     
+    game_totals = GameDailyStatsService.get_totals(db)
+    
     # 详细统计数据
     stats = {
         "users": {
@@ -336,22 +337,20 @@ async def get_admin_stats(request: Request, db: Session = Depends(get_db)):
             "today_active": db.query(func.count(User.id)).filter(
                 func.date(User.last_login_time) == today
             ).scalar() or 0,
-            "total_coins": db.query(func.sum(User.coins)).scalar() or 0
+            "total_coins": from_cents(db.query(func.sum(User.coins)).scalar())
         },
         "games": {
-            "total": db.query(func.count(GameRecord.id)).scalar() or 0,
-            "today": db.query(func.count(GameRecord.id)).filter(
-                func.date(GameRecord.play_time) == today
-            ).scalar() or 0,
-            "avg_score": db.query(func.avg(GameRecord.score)).scalar() or 0,
-            "max_score": db.query(func.max(GameRecord.score)).scalar() or 0
+            "total": game_totals["games"],
+            "today": GameDailyStatsService.get_day(db, today)["games"],
+            "avg_score": round(game_totals["score_sum"] / game_totals["games"], 2) if game_totals["games"] else 0,
+            "max_score": game_totals["max_score"]
         },
         "ads": {
             "total_views": db.query(func.count(AdWatchRecord.id)).scalar() or 0,
             "today_views": db.query(func.count(AdWatchRecord.id)).filter(
                 func.date(AdWatchRecord.watch_time) == today
             ).scalar() or 0,
-            "total_rewards": db.query(func.sum(AdWatchRecord.reward_coins)).scalar() or 0,
+            "total_rewards": from_cents(db.query(func.sum(AdWatchRecord.reward_coins)).scalar()),
             "active_ads": db.query(func.count(AdConfig.id)).filter(
                 AdConfig.status == AdStatus.ACTIVE
             ).scalar() or 0
@@ -360,15 +359,15 @@ async def get_admin_stats(request: Request, db: Session = Depends(get_db)):
             "pending": db.query(func.count(WithdrawRequest.id)).filter(
                 WithdrawRequest.status == WithdrawStatus.PENDING
             ).scalar() or 0,
-            "pending_amount": db.query(func.sum(WithdrawRequest.amount)).filter(
+            "pending_amount": from_cents(db.query(func.sum(WithdrawRequest.amount)).filter(
                 WithdrawRequest.status == WithdrawStatus.PENDING
-            ).scalar() or 0,
+            ).scalar()),
             "completed": db.query(func.count(WithdrawRequest.id)).filter(
                 WithdrawRequest.status == WithdrawStatus.COMPLETED
             ).scalar() or 0,
-            "completed_amount": db.query(func.sum(WithdrawRequest.amount)).filter(
+            "completed_amount": from_cents(db.query(func.sum(WithdrawRequest.amount)).filter(
                 WithdrawRequest.status == WithdrawStatus.COMPLETED
-            ).scalar() or 0
+            ).scalar())
         }
     }
     
@@ -430,8 +429,8 @@ async def get_users_list(
             "username": user.username,
             "nickname": user.nickname,
             "avatar": user.avatar,
-            "coins": float(user.coins or 0),
-            "total_coins": float(user.total_coins or 0),
+            "coins": from_cents(user.coins),
+            "total_coins": from_cents(user.total_coins),
             "level": user.level or 1,
             "experience": user.experience or 0,
             "game_count": user.game_count or 0,
@@ -605,7 +604,7 @@ async def update_user(
     if "nickname" in user_data:
         user.nickname = user_data["nickname"]
     if "coins" in user_data:
-        user.coins = float(user_data["coins"])
+        user.coins = to_cents(user_data["coins"])
     if "level" in user_data:
         user.level = int(user_data["level"])
     if "experience" in user_data:
@@ -645,7 +644,7 @@ async def get_ads_list(request: Request, db: Session = Depends(get_db)):
             "webpage_url": ad.webpage_url,
             "image_url": ad.image_url,
             "duration": ad.duration,
-            "reward_coins": float(ad.reward_coins or 0),
+            "reward_coins": from_cents(ad.reward_coins),
             "weight": ad.weight or 1,
             "status": 1 if is_active else 0
         }
@@ -699,7 +698,7 @@ async def update_ad(request: Request, ad_id: int, ad_data: AdConfigUpdate, db: S
             "webpage_url": ad.webpage_url,
             "image_url": ad.image_url,
             "duration": ad.duration,
-            "reward_coins": str(ad.reward_coins),  # 转换为字符串避免Decimal序列化问题
+            "reward_coins": format_cents(ad.reward_coins),  # 字符串形式（与原接口保持一致）
             "daily_limit": ad.daily_limit,
             "min_watch_duration": ad.min_watch_duration,
             "weight": ad.weight,
@@ -981,10 +980,10 @@ async def get_withdraw_requests(
     
     # 金额范围筛选
     if min_amount is not None:
-        query = query.filter(WithdrawRequest.amount >= min_amount)
+        query = query.filter(WithdrawRequest.amount >= to_cents(min_amount))
     
     if max_amount is not None:
-        query = query.filter(WithdrawRequest.amount <= max_amount)
+        query = query.filter(WithdrawRequest.amount <= to_cents(max_amount))
     
     # 用户ID筛选
     if user_id:
@@ -1025,7 +1024,7 @@ async def get_withdraw_requests(
             "size": size,
             "pages": (total + size - 1) // size,
             "statistics": {
-                "current_page_amount": float(total_amount),
+                "current_page_amount": from_cents(total_amount),
                 "current_page_count": len(items)
             }
         }
@@ -1192,8 +1191,8 @@ async def get_withdraw_detail(
     detail_info = {
         "withdraw_info": {
             "id": withdraw.id,
-            "amount": float(withdraw.amount),
-            "coins_used": float(withdraw.coins_used),
+            "amount": from_cents(withdraw.amount),
+            "coins_used": from_cents(withdraw.coins_used),
             "alipay_account": withdraw.alipay_account,
             "real_name": withdraw.real_name,
             "status": withdraw.status.value if hasattr(withdraw.status, 'value') else str(withdraw.status),
@@ -1206,21 +1205,21 @@ async def get_withdraw_detail(
             "nickname": user.nickname,
             "device_id": user.device_id,
             "device_name": user.device_name,
-            "current_coins": float(user.coins),
-            "total_coins": float(user.total_coins),
+            "current_coins": from_cents(user.coins),
+            "total_coins": from_cents(user.total_coins),
             "level": user.level,
             "register_time": user.register_time.isoformat() if user.register_time else None,
             "last_login_time": user.last_login_time.isoformat() if user.last_login_time else None
         },
         "user_statistics": {
             "total_withdraws": total_withdraws,
-            "total_withdraw_amount": float(total_withdraw_amount),
-            "avg_withdraw_amount": float(total_withdraw_amount / total_withdraws) if total_withdraws > 0 else 0
+            "total_withdraw_amount": from_cents(total_withdraw_amount),
+            "avg_withdraw_amount": round(from_cents(total_withdraw_amount) / total_withdraws, 2) if total_withdraws > 0 else 0
         },
         "recent_withdraws": [
             {
                 "id": w.id,
-                "amount": float(w.amount),
+                "amount": from_cents(w.amount),
                 "status": w.status.value if hasattr(w.status, 'value') else str(w.status),
                 "request_time": w.request_time.isoformat() if w.request_time else None
             } for w in user_withdraw_history[:5]
@@ -1229,7 +1228,7 @@ async def get_withdraw_detail(
             {
                 "id": t.id,
                 "type": t.type.value if hasattr(t.type, 'value') else str(t.type),
-                "amount": float(t.amount),
+                "amount": from_cents(t.amount),
                 "description": t.description,
                 "created_time": t.created_time.isoformat() if t.created_time else None
             } for t in coin_transactions[:5]
@@ -1740,6 +1739,32 @@ async def auto_detect_ips(request: Request, db: Session = Depends(get_db)):
     )
 
 
+@router.get("/api/protection/metrics")
+async def get_protection_metrics(request: Request):
+    """获取防护层指标（各限流类别的放行/限流/封禁次数、中间件与Redis耗时分布）"""
+    if not verify_admin(request):
+        return RedirectResponse(url=admin_login_url(), status_code=302)
+
+    from services.protection_metrics import ProtectionMetrics
+
+    return BaseResponse(
+        message="获取成功",
+        data=ProtectionMetrics.snapshot()
+    )
+
+
+@router.post("/api/protection/metrics/reset")
+async def reset_protection_metrics(request: Request):
+    """清空防护层指标（调整限流配置后重新观察）"""
+    if not verify_admin(request):
+        return RedirectResponse(url=admin_login_url(), status_code=302)
+
+    from services.protection_metrics import ProtectionMetrics
+    ProtectionMetrics.reset()
+
+    return BaseResponse(message="指标已清空")
+
+
 @router.put("/api/users/{user_id}/status")
 async def update_user_status(
     request: Request,
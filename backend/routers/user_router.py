@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from database import get_db
@@ -9,7 +9,11 @@ from services.ad_service import AdService
 from services.config_service import ConfigService
 from services.withdraw_service import WithdrawService
 from services.ip_service import IPService
-from typing import List
+from services.money import CENTS_PER_UNIT, from_cents
+from services.pagination import paginate
+from services.client_ip import resolve_client_ip
+from middleware.rate_limit_policy import rate_limit
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,14 +21,9 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 def get_client_ip(request: Request) -> str:
-    """获取客户端真实IP"""
-    forwarded_for = request.headers.get("X-Forwarded-For")
-    if forwarded_for:
-        return forwarded_for.split(",")[0].strip()
-    real_ip = request.headers.get("X-Real-IP")
-    if real_ip:
-        return real_ip
-    return request.client.host if request.client else "unknown"
+    """获取客户端真实IP（只信任受信代理添加的转发头）"""
+    return resolve_client_ip(request.client.host if request.client else None,
+                             request.headers.get("X-Forwarded-For"), request.headers.get("X-Real-IP"))
 
 def check_registration_limit(db: Session, ip_address: str) -> bool:
     """检查IP注册限制（1小时内最多5个）"""
@@ -46,6 +45,7 @@ def check_registration_limit(db: Session, ip_address: str) -> bool:
     return count < 5  # 允许1小时内最多5个注册
 
 @router.post("/register", response_model=BaseResponse)
+@rate_limit("register")
 async def register_user(user_data: UserRegister, request: Request, db: Session = Depends(get_db)):
     """用户注册（如果用户已存在则直接返回用户信息）"""
     try:
@@ -78,7 +78,7 @@ async def register_user(user_data: UserRegister, request: Request, db: Session =
                     "user_id": existing_user.id,
                     "device_id": existing_user.device_id,
                     "nickname": existing_user.nickname,
-                    "coins": int(existing_user.coins),
+                    "coins": existing_user.coins // CENTS_PER_UNIT,
                     "level": existing_user.level,
                     "experience": existing_user.experience
                 }
@@ -93,7 +93,7 @@ async def register_user(user_data: UserRegister, request: Request, db: Session =
                 "user_id": user.id,
                 "device_id": user.device_id,
                 "nickname": user.nickname,
-                "coins": int(user.coins),
+                "coins": user.coins // CENTS_PER_UNIT,
                 "level": user.level,
                 "experience": user.experience
             }
@@ -104,6 +104,7 @@ async def register_user(user_data: UserRegister, request: Request, db: Session =
         raise HTTPException(status_code=500, detail="注册失败")
 
 @router.post("/login", response_model=BaseResponse)
+@rate_limit("login")
 async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
     """用户登录"""
     user = UserService.get_user_by_device_id(db, login_data.device_id)
@@ -120,7 +121,7 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
             "user_id": user.id,
             "device_id": user.device_id,
             "nickname": user.nickname,
-            "coins": int(user.coins),
+            "coins": user.coins // CENTS_PER_UNIT,
             "level": user.level,
             "experience": user.experience
         }
@@ -128,14 +129,15 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
 
 
 @router.get("/info/{user_id}", response_model=BaseResponse)
+@rate_limit("user_info", per_user=True)
 async def get_user_info(user_id: int, db: Session = Depends(get_db)):
     """获取用户详细信息"""
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
     # 获取用户统计信息
-    stats = UserService.get_user_stats(db, user_id)
+    stats = UserService.get_user_stats(db, user_id, user=user)
     
     return BaseResponse(
         message="获取成功",
@@ -162,20 +164,24 @@ async def get_coin_history(
     user_id: int, 
     page: int = 1, 
     size: int = 20,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
     db: Session = Depends(get_db)
 ):
-    """获取金币流水记录"""
-    user = UserService.get_user_by_id(db, user_id)
+    """获取金币流水记录（传cursor时按游标分页，不传时按页码分页）"""
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
     # 分页查询金币流水
-    skip = (page - 1) * size
-    transactions = db.query(CoinTransactionModel).filter(
-        CoinTransactionModel.user_id == user_id
-    ).order_by(CoinTransactionModel.created_time.desc()).offset(skip).limit(size).all()
-    
-    total = db.query(CoinTransactionModel).filter(CoinTransactionModel.user_id == user_id).count()
+    try:
+        transactions, page_info = paginate(
+            db.query(CoinTransactionModel).filter(CoinTransactionModel.user_id == user_id),
+            CoinTransactionModel.created_time, CoinTransactionModel.id,
+            size, page=page, cursor=cursor, include_total=include_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # 手动构建响应数据
     transaction_data = []
@@ -184,8 +190,8 @@ async def get_coin_history(
             "id": t.id,
             "user_id": t.user_id,
             "type": t.type.value if hasattr(t.type, 'value') else str(t.type),
-            "amount": float(t.amount),
-            "balance_after": float(t.balance_after),
+            "amount": from_cents(t.amount),
+            "balance_after": from_cents(t.balance_after),
             "description": t.description,
             "created_time": t.created_time.isoformat() if t.created_time else None
         }
@@ -193,19 +199,13 @@ async def get_coin_history(
     
     return BaseResponse(
         message="获取成功",
-        data={
-            "items": transaction_data,
-            "total": total,
-            "page": page,
-            "size": size,
-            "pages": (total + size - 1) // size
-        }
+        data={"items": transaction_data, **page_info}
     )
 
 @router.get("/ads/stats/{user_id}")
 async def get_user_ad_stats(user_id: int, db: Session = Depends(get_db)):
     """获取用户广告观看统计"""
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -217,6 +217,7 @@ async def get_user_ad_stats(user_id: int, db: Session = Depends(get_db)):
     )
 
 @router.post("/withdraw", response_model=BaseResponse)
+@rate_limit("withdraw", per_user=True)
 async def submit_withdraw_request(
     user_id: int,
     withdraw_data: WithdrawRequest,
@@ -238,33 +239,32 @@ async def submit_withdraw_request(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/withdraw/history/{user_id}")
+@rate_limit("withdraw_query", per_user=True)
 async def get_withdraw_history(
     user_id: int,
     page: int = 1,
     size: int = 20,
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
     db: Session = Depends(get_db)
 ):
-    """获取提现记录"""
-    user = UserService.get_user_by_id(db, user_id)
+    """获取提现记录（传cursor时按游标分页，不传时按页码分页）"""
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    skip = (page - 1) * size
-    withdraws = db.query(WithdrawRequestModel).filter(
-        WithdrawRequestModel.user_id == user_id
-    ).order_by(WithdrawRequestModel.request_time.desc()).offset(skip).limit(size).all()
-    
-    total = db.query(WithdrawRequestModel).filter(WithdrawRequestModel.user_id == user_id).count()
+    try:
+        withdraws, page_info = paginate(
+            db.query(WithdrawRequestModel).filter(WithdrawRequestModel.user_id == user_id),
+            WithdrawRequestModel.request_time, WithdrawRequestModel.id,
+            size, page=page, cursor=cursor, include_total=include_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return BaseResponse(
         message="获取成功",
-        data={
-            "items": [WithdrawInfo.from_orm(w).dict() for w in withdraws],
-            "total": total,
-            "page": page,
-            "size": size,
-            "pages": (total + size - 1) // size
-        }
+        data={"items": [WithdrawInfo.from_orm(w).dict() for w in withdraws], **page_info}
     )
 
 @router.get("/{user_id}/stats", response_model=BaseResponse)
@@ -272,7 +272,7 @@ async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
     """获取用户统计信息"""
     try:
         # 验证用户是否存在
-        user = UserService.get_user_by_id(db, user_id)
+        user = UserService.get_user_profile(db, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
@@ -296,8 +296,8 @@ async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
             "best_score": int(best_score_result or 0),
             "average_score": int(avg_score_result or 0),
             "ads_watched": ads_watched or 0,
-            "total_coins": float(total_coins_earned or 0),
-            "current_coins": float(user.coins or 0),
+            "total_coins": from_cents(total_coins_earned),
+            "current_coins": from_cents(user.coins),
             "level": user.level or 1,
             "total_score": int(best_score_result or 0)  # 与best_score相同，保持兼容性
         }
@@ -310,31 +310,40 @@ async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取用户统计失败")
 
 @router.get("/{user_id}/withdraws", response_model=BaseResponse)
+@rate_limit("withdraw_query", per_user=True)
 async def get_user_withdraw_history(
     user_id: int, 
+    response: Response,
     page: int = Query(1, ge=1),
     size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="分页游标（传入时按游标分页，下一页游标在响应头X-Next-Cursor中）"),
     db: Session = Depends(get_db)
 ):
     """获取用户提现历史（移动端使用）"""
     try:
         # 验证用户是否存在
-        user = UserService.get_user_by_id(db, user_id)
+        user = UserService.get_user_profile(db, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
         # 获取提现记录
-        skip = (page - 1) * size
-        withdraws = db.query(WithdrawRequestModel).filter(
-            WithdrawRequestModel.user_id == user_id
-        ).order_by(WithdrawRequestModel.request_time.desc()).offset(skip).limit(size).all()
+        try:
+            withdraws, page_info = paginate(
+                db.query(WithdrawRequestModel).filter(WithdrawRequestModel.user_id == user_id),
+                WithdrawRequestModel.request_time, WithdrawRequestModel.id,
+                size, page=page, cursor=cursor, include_total=False
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if page_info["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page_info["next_cursor"]
         
         # 手动构建提现记录数据
         withdraw_data = []
         for withdraw in withdraws:
             record = {
                 "id": withdraw.id,
-                "amount": float(withdraw.amount),
+                "amount": from_cents(withdraw.amount),
                 "status": withdraw.status.value if hasattr(withdraw.status, 'value') else str(withdraw.status),
                 "request_time": withdraw.request_time.isoformat() if withdraw.request_time else None,
                 "process_time": withdraw.process_time.isoformat() if withdraw.process_time else None,
@@ -344,8 +353,6 @@ async def get_user_withdraw_history(
             }
             withdraw_data.append(record)
         
-        total = db.query(WithdrawRequestModel).filter(WithdrawRequestModel.user_id == user_id).count()
-        
         return BaseResponse(
             message="获取成功",
             data=withdraw_data  # 直接返回列表，而不是嵌套对象
@@ -361,8 +368,8 @@ async def get_app_config(db: Session = Depends(get_db)):
     """获取应用配置信息（供客户端使用）"""
     try:
         config_data = {
-            "min_withdraw_amount": ConfigService.get_min_withdraw_amount(db),
-            "max_withdraw_amount": ConfigService.get_max_withdraw_amount(db),
+            "min_withdraw_amount": from_cents(ConfigService.get_min_withdraw_amount(db)),
+            "max_withdraw_amount": from_cents(ConfigService.get_max_withdraw_amount(db)),
             "coin_to_rmb_rate": ConfigService.get_coin_to_rmb_rate(db),
             "withdrawal_fee_rate": ConfigService.get_withdrawal_fee_rate(db),
             "daily_withdraw_limit": ConfigService.get_daily_withdraw_limit(db),
@@ -380,30 +387,40 @@ async def get_app_config(db: Session = Depends(get_db)):
 @router.get("/{user_id}/coin-records", response_model=BaseResponse)
 async def get_coin_records(
     user_id: int,
+    response: Response,
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（传入时按游标分页，下一页游标在响应头X-Next-Cursor中）"),
     db: Session = Depends(get_db)
 ):
     """获取用户金币获取记录"""
     try:
         # 检查用户是否存在
-        user = UserService.get_user_by_id(db, user_id)
+        user = UserService.get_user_profile(db, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
         # 获取广告观看记录
-        skip = (page - 1) * size
-        ad_records = db.query(AdWatchRecord).filter(
-            AdWatchRecord.user_id == user_id,
-            AdWatchRecord.is_completed == True
-        ).order_by(AdWatchRecord.watch_time.desc()).offset(skip).limit(size).all()
+        try:
+            ad_records, page_info = paginate(
+                db.query(AdWatchRecord).filter(
+                    AdWatchRecord.user_id == user_id,
+                    AdWatchRecord.is_completed == True
+                ),
+                AdWatchRecord.watch_time, AdWatchRecord.id,
+                size, page=page, cursor=cursor, include_total=False
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if page_info["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page_info["next_cursor"]
         
         # 构建金币记录数据
         coin_records = []
         for record in ad_records:
             coin_record = {
                 "id": record.id,
-                "amount": int(record.reward_coins),
+                "amount": record.reward_coins // CENTS_PER_UNIT,
                 "type": "ad_watch",
                 "description": f"观看广告获得金币",
                 "created_at": record.watch_time.isoformat() if record.watch_time else None
@@ -421,9 +438,10 @@ async def get_coin_records(
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
 
 @router.get("/{user_id}", response_model=BaseResponse)
+@rate_limit("user_info", per_user=True)
 async def get_user_basic_info(user_id: int, db: Session = Depends(get_db)):
     """获取用户基本信息（用于刷新）"""
-    user = UserService.get_user_by_id(db, user_id)
+    user = UserService.get_user_profile(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
@@ -434,7 +452,7 @@ async def get_user_basic_info(user_id: int, db: Session = Depends(get_db)):
             "user_id": user.id,  # 添加user_id字段，确保Android端可以正确解析
             "device_id": user.device_id,
             "nickname": user.nickname,
-            "coins": int(user.coins),
+            "coins": user.coins // CENTS_PER_UNIT,
             "level": user.level,
             "experience": user.experience
         }
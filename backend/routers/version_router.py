@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from schemas import *
 from services.version_service import VersionService
+from middleware.rate_limit_policy import rate_limit
 from models import *
 import os
 from datetime import datetime
@@ -262,6 +263,7 @@ async def upload_apk(file: UploadFile = File(...)):
 # ==================== 客户端版本检查API ====================
 
 @router.post("/api/check-update")
+@rate_limit("version_check")
 async def check_version_update(request: VersionCheckRequest, db: Session = Depends(get_db)):
     """检查版本更新"""
     try:
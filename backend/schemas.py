@@ -1,7 +1,13 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, BeforeValidator
 from typing import Optional, List, Union, Any
+from typing_extensions import Annotated
 from datetime import datetime
 from decimal import Decimal
+from services.money import to_cents, from_cents
+
+# 金额字段：数据库和服务层为整数分，接口上为金币/元（小数）
+CentsInput = Annotated[int, BeforeValidator(to_cents)]       # 请求参数：小数金额解析为整数分
+CoinsOutput = Annotated[float, BeforeValidator(from_cents)]  # 响应数据：整数分输出为小数金额
 
 # 基础响应模型
 class BaseResponse(BaseModel):
@@ -25,8 +31,8 @@ class UserInfo(BaseModel):
     username: Optional[str]
     nickname: Optional[str]
     avatar: Optional[str]
-    coins: Decimal
-    total_coins: Decimal
+    coins: CoinsOutput
+    total_coins: CoinsOutput
     level: int
     experience: int
     game_count: int
@@ -49,7 +55,7 @@ class AdConfigCreate(BaseModel):
     webpage_url: Optional[str] = Field(None, max_length=500) 
     image_url: Optional[str] = Field(None, max_length=500)
     duration: int = Field(..., gt=0)
-    reward_coins: Decimal = Field(default=0, ge=0)
+    reward_coins: CentsInput = Field(default=0, ge=0)
     daily_limit: int = Field(default=10, ge=1)
     min_watch_duration: int = Field(default=15, ge=1)
     weight: int = Field(default=1, ge=1)
@@ -63,7 +69,7 @@ class AdConfigUpdate(BaseModel):
     webpage_url: Optional[str] = Field(None, max_length=500)
     image_url: Optional[str] = Field(None, max_length=500)
     duration: Optional[int] = Field(None, gt=0)
-    reward_coins: Optional[Decimal] = Field(None, ge=0)
+    reward_coins: Optional[CentsInput] = Field(None, ge=0)
     daily_limit: Optional[int] = Field(None, ge=1)
     min_watch_duration: Optional[int] = Field(None, ge=1)
     weight: Optional[int] = Field(None, ge=1)
@@ -79,7 +85,7 @@ class AdConfigInfo(BaseModel):
     webpage_url: Optional[str] = None
     image_url: Optional[str] = None
     duration: int
-    reward_coins: Decimal
+    reward_coins: CoinsOutput
     daily_limit: int
     min_watch_duration: int
     weight: int
@@ -106,7 +112,7 @@ class AdWatchRecord(BaseModel):
     user_id: int
     ad_id: int
     watch_duration: int
-    reward_coins: Decimal
+    reward_coins: CoinsOutput
     is_completed: int
     watch_time: datetime
     
@@ -125,7 +131,7 @@ class GameRecord(BaseModel):
     score: int
     duration: int
     needles_inserted: int
-    reward_coins: Decimal
+    reward_coins: CoinsOutput
     play_time: datetime
     
     class Config:
@@ -136,8 +142,8 @@ class CoinTransaction(BaseModel):
     id: int
     user_id: int
     type: str
-    amount: Decimal
-    balance_after: Decimal
+    amount: CoinsOutput
+    balance_after: CoinsOutput
     description: Optional[str]
     created_time: datetime
     
@@ -145,15 +151,15 @@ class CoinTransaction(BaseModel):
         from_attributes = True
 
 class WithdrawRequest(BaseModel):
-    amount: Decimal = Field(..., gt=0)
+    amount: CentsInput = Field(..., gt=0)
     alipay_account: str = Field(..., min_length=1, max_length=100)
     real_name: str = Field(..., min_length=1, max_length=50)
 
 class WithdrawInfo(BaseModel):
     id: int
     user_id: int
-    amount: Decimal
-    coins_used: Decimal
+    amount: CoinsOutput
+    coins_used: CoinsOutput
     alipay_account: str
     real_name: str
     status: str
@@ -194,12 +200,12 @@ class UserStats(BaseModel):
     active_users_today: int
     total_games: int
     total_ads_watched: int
-    total_coins_distributed: Decimal
+    total_coins_distributed: CoinsOutput
 
 class AdminStats(BaseModel):
     user_stats: UserStats
     pending_withdraws: int
-    total_withdraw_amount: Decimal
+    total_withdraw_amount: CoinsOutput
     active_ads: int
 
 # 管理员相关模型
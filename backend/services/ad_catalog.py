@@ -0,0 +1,227 @@
+"""
+广告目录快照 - 每个worker在内存中保存当前有效广告的不可变快照和Walker/Vose别名表
+加权随机选择为O(1)；后台修改广告配置时递增Redis版本号，各worker检测到版本变化后重建快照；
+快照在最近的广告开始/结束时间点过期重建，排期之间无需定时刷新
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from models import AdConfig, AdStatus
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CatalogAd:
+    """广告配置的只读副本（脱离数据库会话，可在请求间共享）"""
+    id: int
+    name: str
+    ad_type: str
+    video_url: Optional[str]
+    webpage_url: Optional[str]
+    image_url: Optional[str]
+    duration: int
+    reward_coins: int              # 分
+    daily_limit: int
+    min_watch_duration: int
+    weight: int
+    status: AdStatus
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    created_time: datetime
+    updated_time: datetime
+
+    @classmethod
+    def from_model(cls, ad: AdConfig) -> "CatalogAd":
+        return cls(**{name: getattr(ad, name) for name in cls.__dataclass_fields__})
+
+
+class AliasTable:
+    """Walker/Vose别名表: O(n)构建，O(1)按权重抽样"""
+
+    __slots__ = ("prob", "alias")
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        total = float(sum(weights))
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        if n == 0 or total <= 0:
+            return
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 浮点误差留下的剩余项概率视为1
+        for i in large + small:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+
+    def sample(self) -> int:
+        column = random.randrange(len(self.prob))
+        return column if random.random() < self.prob[column] else self.alias[column]
+
+
+class AdCatalogSnapshot:
+    """不可变的广告目录快照"""
+
+    # 别名表抽中不可观看的广告时重抽的次数，超过后对剩余广告按权重选择
+    MAX_REJECTIONS = 8
+
+    __slots__ = ("ads", "by_id", "alias", "version", "built_at", "expires_at")
+
+    def __init__(self, ads: List[CatalogAd], version: Optional[str], expires_at: Optional[float] = None):
+        # 权重为0的广告不参与随机选择
+        self.ads: Tuple[CatalogAd, ...] = tuple(ad for ad in ads if (ad.weight or 0) > 0)
+        self.by_id: Dict[int, CatalogAd] = {ad.id: ad for ad in ads}
+        self.alias = AliasTable([ad.weight for ad in self.ads])
+        self.version = version
+        self.built_at = time.monotonic()
+        self.expires_at = expires_at    # 下一个排期时间点（时间戳），None表示没有待生效/待结束的广告
+
+    def get(self, ad_id: int) -> Optional[CatalogAd]:
+        return self.by_id.get(ad_id)
+
+    def choose(self, is_eligible: Callable[[CatalogAd], bool] = None) -> Optional[CatalogAd]:
+        """
+        按权重随机选择一个广告
+        is_eligible: 过滤条件（如用户今日该广告未达上限）；抽中不符合的广告时重抽，
+        多数广告可看时期望O(1)，连续多次未抽中再对符合条件的广告按权重选择
+        """
+        if not self.ads:
+            return None
+        if is_eligible is None:
+            return self.ads[self.alias.sample()]
+
+        for _ in range(self.MAX_REJECTIONS):
+            ad = self.ads[self.alias.sample()]
+            if is_eligible(ad):
+                return ad
+
+        eligible = [ad for ad in self.ads if is_eligible(ad)]
+        if not eligible:
+            return None
+        return random.choices(eligible, weights=[ad.weight for ad in eligible], k=1)[0]
+
+
+class AdCatalog:
+    """广告目录（每个worker一份快照）"""
+
+    VERSION_KEY = "ad_catalog:version"
+    VERSION_CHECK_INTERVAL = 1.0    # 检查Redis版本号的最小间隔（秒）
+    MAX_AGE_WITHOUT_REDIS = 300     # Redis不可用时收不到版本变更，快照最长使用时间（秒）
+
+    _snapshot: Optional[AdCatalogSnapshot] = None
+    _checked_at = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _current_version() -> Optional[str]:
+        redis = AdCatalog._get_redis()
+        if redis:
+            try:
+                return redis.get(AdCatalog.VERSION_KEY) or "0"
+            except Exception:
+                pass
+        return None
+
+    @staticmethod
+    def _is_expired(snapshot: AdCatalogSnapshot, now: float) -> bool:
+        """快照是否已过期（到达排期时间点，或Redis不可用时超过最长使用时间）"""
+        if snapshot.expires_at is not None and time.time() >= snapshot.expires_at:
+            return True
+        return snapshot.version is None and now - snapshot.built_at >= AdCatalog.MAX_AGE_WITHOUT_REDIS
+
+    @staticmethod
+    def _is_fresh(snapshot: Optional[AdCatalogSnapshot], now: float) -> bool:
+        return (
+            snapshot is not None
+            and now - AdCatalog._checked_at < AdCatalog.VERSION_CHECK_INTERVAL
+            and not AdCatalog._is_expired(snapshot, now)
+        )
+
+    @staticmethod
+    def _build(db: Session, version: Optional[str]) -> AdCatalogSnapshot:
+        now = datetime.now()
+        # 同时加载尚未开始的广告，用于计算下一个排期时间点
+        ads = db.query(AdConfig).filter(
+            AdConfig.status == AdStatus.ACTIVE,
+            or_(AdConfig.end_time.is_(None), AdConfig.end_time >= now)
+        ).all()
+
+        active = []
+        boundaries = []
+        for ad in ads:
+            if ad.start_time is not None and ad.start_time > now:
+                boundaries.append(ad.start_time)
+                continue
+            active.append(CatalogAd.from_model(ad))
+            if ad.end_time is not None:
+                # end_time当刻仍有效，之后失效
+                boundaries.append(ad.end_time + timedelta(microseconds=1))
+
+        next_boundary = min(boundaries) if boundaries else None
+        snapshot = AdCatalogSnapshot(
+            active, version,
+            expires_at=next_boundary.timestamp() if next_boundary else None
+        )
+        logger.info(
+            f"📦 广告目录已重建: {len(snapshot.by_id)}个有效广告 (版本 {version}，"
+            f"下次排期变化 {next_boundary.strftime('%Y-%m-%d %H:%M:%S') if next_boundary else '无'})"
+        )
+        return snapshot
+
+    @staticmethod
+    def get(db: Session) -> AdCatalogSnapshot:
+        """
+        获取当前广告目录快照
+        快照有效时不访问数据库，每秒最多检查一次Redis版本号；到达下一个排期时间点时立即重建
+        """
+        snapshot = AdCatalog._snapshot
+        if AdCatalog._is_fresh(snapshot, time.monotonic()):
+            return snapshot
+
+        with AdCatalog._lock:
+            now = time.monotonic()
+            snapshot = AdCatalog._snapshot
+            if AdCatalog._is_fresh(snapshot, now):
+                return snapshot
+
+            version = AdCatalog._current_version()
+            if snapshot is None or snapshot.version != version or AdCatalog._is_expired(snapshot, now):
+                snapshot = AdCatalog._build(db, version)
+                AdCatalog._snapshot = snapshot
+            AdCatalog._checked_at = now
+            return snapshot
+
+    @staticmethod
+    def invalidate():
+        """广告配置变更后调用: 递增版本号通知所有worker，并立即丢弃本worker的快照"""
+        AdCatalog._snapshot = None
+        redis = AdCatalog._get_redis()
+        if redis:
+            try:
+                redis.incr(AdCatalog.VERSION_KEY)
+            except Exception as e:
+                logger.warning(f"递增广告目录版本号失败: {e}")
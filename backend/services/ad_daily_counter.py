@@ -0,0 +1,232 @@
+"""
+用户每日广告计数 - Redis哈希按用户按天记录观看次数（总数 + 各广告）和获得金币（整数分）
+键在本地零点过期；键不存在时从数据库按时间范围统计后回填，Redis不可用时直接查数据库
+延迟写入模式下，回填时把队列中尚未落库的观看记录一并计入；Redis不可用时只能统计已落库的记录
+（此时新的观看记录同步写库，少计的只有Redis故障前已入队的记录）
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from models import AdWatchRecord
+from services.ad_watch_writer import AdWatchWriter
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 检查限额并预占一次观看（原子执行，并发请求不会同时越过限额）
+# KEYS[1]: 计数哈希  ARGV[1]: 广告字段  ARGV[2]: 每日总限额  ARGV[3]: 该广告每日限额
+# 返回: 1=预占成功 0=计数未加载 -1=超过每日总限额 -2=超过该广告限额
+RESERVE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local total = tonumber(redis.call('HGET', KEYS[1], 'total') or '0')
+if total >= tonumber(ARGV[2]) then
+    return -1
+end
+local watched = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if watched >= tonumber(ARGV[3]) then
+    return -2
+end
+redis.call('HINCRBY', KEYS[1], 'total', 1)
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+return 1
+"""
+
+# 回填计数（键已存在时不覆盖，避免冲掉并发写入的增量）
+# KEYS[1]: 计数哈希  ARGV[1]: 过期时间戳（本地零点）  ARGV[2..]: 字段, 值, ...
+SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+return 1
+"""
+
+# 键存在时调整计数（键已过期则忽略，不产生无过期时间的残留键）
+# KEYS[1]: 计数哈希  ARGV: 字段, 增量, ...
+ADJUST_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+class AdDailyCounter:
+    """用户每日广告计数"""
+
+    KEY_PREFIX = "ad_daily:v2"  # ad_daily:v2:{YYYYMMDD}:{user_id}（v2：金币按整数分计数）
+
+    _scripts = None
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _get_scripts(redis):
+        if AdDailyCounter._scripts is None:
+            AdDailyCounter._scripts = {
+                "reserve": redis.register_script(RESERVE_LUA),
+                "seed": redis.register_script(SEED_LUA),
+                "adjust": redis.register_script(ADJUST_LUA),
+            }
+        return AdDailyCounter._scripts
+
+    @staticmethod
+    def _key(user_id, day: date) -> str:
+        return f"{AdDailyCounter.KEY_PREFIX}:{day.strftime('%Y%m%d')}:{user_id}"
+
+    @staticmethod
+    def _ad_field(ad_id) -> str:
+        return f"ad:{ad_id}"
+
+    @staticmethod
+    def day_range(day: date) -> Tuple[datetime, datetime]:
+        """某天的时间范围 [当天0点, 次日0点)，按范围过滤可以使用 (user_id, watch_time) 索引"""
+        start = datetime.combine(day, dt_time.min)
+        return start, start + timedelta(days=1)
+
+    @staticmethod
+    def load_from_db(db: Session, user_id, day: date = None, include_pending: bool = False) -> Dict:
+        """
+        从数据库统计用户某天的观看次数和金币（按广告分组，一次查询）
+        include_pending: 同时计入延迟写入队列中尚未落库的记录（回填Redis计数时使用，需要Redis可用）
+        """
+        day = day or date.today()
+        start, end = AdDailyCounter.day_range(day)
+        rows = db.query(
+            AdWatchRecord.ad_id,
+            func.count(AdWatchRecord.id),
+            func.sum(AdWatchRecord.reward_coins)
+        ).filter(
+            AdWatchRecord.user_id == user_id,
+            AdWatchRecord.watch_time >= start,
+            AdWatchRecord.watch_time < end
+        ).group_by(AdWatchRecord.ad_id).all()
+
+        ads = {int(ad_id): int(count) for ad_id, count, _ in rows}
+        coins = int(sum(coins or 0 for _, _, coins in rows))
+
+        if include_pending:
+            pending = AdWatchWriter.pending_records(user_id, start, end)
+            keys = [row["watch_key"] for row in pending if row["watch_key"]]
+            # 已落库但尚未从队列删除的记录已经统计过
+            written = {key for key, in db.query(AdWatchRecord.watch_key).filter(
+                AdWatchRecord.watch_key.in_(keys)
+            )} if keys else set()
+            for row in pending:
+                if row["watch_key"] in written:
+                    continue
+                ad_id = int(row["ad_id"])
+                ads[ad_id] = ads.get(ad_id, 0) + 1
+                coins += int(row["reward_coins"] or 0)
+
+        return {
+            "total": sum(ads.values()),
+            "coins": coins,
+            "ads": ads
+        }
+
+    @staticmethod
+    def _parse(raw: Dict[str, str]) -> Dict:
+        ads = {}
+        for field, value in raw.items():
+            if field.startswith("ad:"):
+                ads[int(field[3:])] = int(value)
+        return {
+            "total": int(raw.get("total", 0)),
+            "coins": int(raw.get("coins", 0)),
+            "ads": ads
+        }
+
+    @staticmethod
+    def _seed(redis, user_id, day: date, counts: Dict):
+        """把数据库统计结果写入Redis（键在次日零点过期）"""
+        _, expire_at = AdDailyCounter.day_range(day)
+        args = [int(expire_at.timestamp()), "total", counts["total"], "coins", counts["coins"]]
+        for ad_id, count in counts["ads"].items():
+            args.extend([AdDailyCounter._ad_field(ad_id), count])
+        AdDailyCounter._get_scripts(redis)["seed"](keys=[AdDailyCounter._key(user_id, day)], args=args)
+
+    @staticmethod
+    def get_today(db: Session, user_id) -> Dict:
+        """
+        获取用户今日广告计数（一次Redis往返）
+        返回: {"total": 今日观看次数, "coins": 今日获得金币（分）, "ads": {广告ID: 今日观看次数}}
+        """
+        today = date.today()
+        redis = AdDailyCounter._get_redis()
+        if redis:
+            try:
+                raw = redis.hgetall(AdDailyCounter._key(user_id, today))
+                if raw:
+                    return AdDailyCounter._parse(raw)
+                counts = AdDailyCounter.load_from_db(db, user_id, today, include_pending=True)
+                AdDailyCounter._seed(redis, user_id, today, counts)
+                return counts
+            except Exception as e:
+                logger.warning(f"读取每日广告计数失败，降级到数据库: {e}")
+
+        return AdDailyCounter.load_from_db(db, user_id, today)
+
+    @staticmethod
+    def try_reserve(db: Session, user_id, ad_id, daily_limit: int, ad_limit: int) -> Optional[int]:
+        """
+        检查每日限额并预占一次观看
+        返回: 1=成功 -1=超过每日总限额 -2=超过该广告限额；Redis不可用时返回None（调用方改用数据库检查）
+        """
+        redis = AdDailyCounter._get_redis()
+        if not redis:
+            return None
+
+        today = date.today()
+        key = AdDailyCounter._key(user_id, today)
+        try:
+            reserve = AdDailyCounter._get_scripts(redis)["reserve"]
+            args = [AdDailyCounter._ad_field(ad_id), daily_limit, ad_limit]
+            result = int(reserve(keys=[key], args=args))
+            if result == 0:
+                # 今日计数尚未加载，先从数据库回填再重试一次
+                AdDailyCounter._seed(redis, user_id, today,
+                                     AdDailyCounter.load_from_db(db, user_id, today, include_pending=True))
+                result = int(reserve(keys=[key], args=args))
+            return result if result != 0 else None
+        except Exception as e:
+            logger.warning(f"每日广告计数预占失败，降级到数据库: {e}")
+            return None
+
+    @staticmethod
+    def _adjust(user_id, *field_deltas):
+        redis = AdDailyCounter._get_redis()
+        if not redis:
+            return
+        try:
+            AdDailyCounter._get_scripts(redis)["adjust"](
+                keys=[AdDailyCounter._key(user_id, date.today())],
+                args=list(field_deltas)
+            )
+        except Exception as e:
+            logger.warning(f"更新每日广告计数失败: {e}")
+
+    @staticmethod
+    def release(user_id, ad_id):
+        """撤销一次预占（观看记录写入失败时调用）"""
+        AdDailyCounter._adjust(user_id, "total", -1, AdDailyCounter._ad_field(ad_id), -1)
+
+    @staticmethod
+    def add_coins(user_id, coins: int):
+        """累加今日获得的金币（分）"""
+        if coins:
+            AdDailyCounter._adjust(user_id, "coins", int(coins))
@@ -1,21 +1,20 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_
 from models import AdConfig, AdWatchRecord, User, AdStatus, TransactionType
 from schemas import AdConfigCreate, AdConfigUpdate, AdWatchRequest
 from services.user_service import UserService
 from services.config_service import ConfigService
+from services.ad_daily_counter import AdDailyCounter
+from services.ad_catalog import AdCatalog, CatalogAd
+from services.ad_watch_writer import AdWatchWriter
+from services.money import from_cents
 from typing import List, Optional
 from datetime import datetime, date
 import random
-import json
+import uuid
 
 class AdService:
 
-    # Redis缓存TTL配置（秒）
-    CACHE_TTL = {
-        "active_ads": 300,  # 活跃广告列表缓存5分钟
-    }
-
     @staticmethod
     def _get_redis():
         """获取Redis客户端"""
@@ -27,107 +26,55 @@ class AdService:
 
     @staticmethod
     def _clear_ads_cache():
-        """清除广告相关缓存"""
-        redis = AdService._get_redis()
-        if redis:
-            try:
-                redis.delete("active_ads")
-            except Exception:
-                pass
+        """清除广告相关缓存（递增广告目录版本号，各worker重建快照）"""
+        AdCatalog.invalidate()
 
     @staticmethod
-    def _get_active_ads_cached(db: Session) -> List[AdConfig]:
-        """获取活跃广告列表（带缓存）"""
-        redis = AdService._get_redis()
-        cache_key = "active_ads"
-
-        # 尝试从Redis获取缓存
-        if redis:
-            try:
-                cached = redis.get(cache_key)
-                if cached:
-                    # 从缓存反序列化广告ID列表
-                    ad_ids = json.loads(cached)
-                    if ad_ids:
-                        # 根据ID查询广告对象
-                        ads = db.query(AdConfig).filter(AdConfig.id.in_(ad_ids)).all()
-                        # 按原始顺序排序
-                        ads_dict = {ad.id: ad for ad in ads}
-                        return [ads_dict[aid] for aid in ad_ids if aid in ads_dict]
-            except Exception:
-                pass
-
-        # 缓存未命中，查询数据库
-        now = datetime.now()
-        available_ads = db.query(AdConfig).filter(
-            AdConfig.status == AdStatus.ACTIVE,
-            or_(AdConfig.start_time.is_(None), AdConfig.start_time <= now),
-            or_(AdConfig.end_time.is_(None), AdConfig.end_time >= now)
-        ).all()
-
-        # 写入Redis缓存（只缓存ID列表，减少内存占用）
-        if redis and available_ads:
-            try:
-                ad_ids = [ad.id for ad in available_ads]
-                redis.setex(
-                    cache_key,
-                    AdService.CACHE_TTL["active_ads"],
-                    json.dumps(ad_ids)
-                )
-            except Exception:
-                pass
-
-        return available_ads
+    def _get_active_ads_cached(db: Session) -> List[CatalogAd]:
+        """获取活跃广告列表（内存中的广告目录快照）"""
+        return list(AdCatalog.get(db).by_id.values())
     
     @staticmethod
-    def get_random_ad(db: Session, user_id) -> Optional[AdConfig]:
+    def get_random_ad(db: Session, user_id) -> Optional[CatalogAd]:
         """获取随机广告（考虑权重和用户今日观看限制）"""
-        # 获取今日观看记录
-        today = date.today()
-        today_watches = db.query(AdWatchRecord).filter(
-            AdWatchRecord.user_id == user_id,
-            func.date(AdWatchRecord.watch_time) == today
-        ).all()
+        # 获取今日观看计数（Redis每日计数，一次往返）
+        today_counts = AdDailyCounter.get_today(db, user_id)
 
         # 获取系统每日广告总限制（使用缓存）
         daily_limit = int(ConfigService.get_config(db, "daily_ad_limit", "20"))
-        if len(today_watches) >= daily_limit:
+        if today_counts["total"] >= daily_limit:
             return None
 
-        # 统计每个广告今日观看次数
-        ad_watch_count = {}
-        for watch in today_watches:
-            ad_watch_count[watch.ad_id] = ad_watch_count.get(watch.ad_id, 0) + 1
-
-        # 获取当前有效的广告（使用缓存）
-        available_ads = AdService._get_active_ads_cached(db)
-
-        # 过滤掉已达到每日限制的广告
-        eligible_ads = []
-        for ad in available_ads:
-            watched_today = ad_watch_count.get(ad.id, 0)
-            if watched_today < ad.daily_limit:
-                eligible_ads.append(ad)
-
-        if not eligible_ads:
-            return None
+        # 每个广告今日观看次数
+        ad_watch_count = today_counts["ads"]
 
-        # 根据权重随机选择
-        weights = [ad.weight for ad in eligible_ads]
-        return random.choices(eligible_ads, weights=weights, k=1)[0]
+        # 从广告目录快照中按权重随机选择（别名表抽样），跳过已达到每日限制的广告
+        catalog = AdCatalog.get(db)
+        return catalog.choose(lambda ad: ad_watch_count.get(ad.id, 0) < ad.daily_limit)
     
     @staticmethod
-    def watch_ad(db: Session, user_id, watch_request: AdWatchRequest, ip_address: str = None) -> dict:
-        """处理广告观看"""
+    def watch_ad(db: Session, user_id, watch_request: AdWatchRequest, ip_address: str = None,
+                 user: User = None) -> dict:
+        """
+        处理广告观看
+        观看记录、金币增加（SQL内累加）和金币流水在同一个事务中提交，不会出现有记录没金币的情况
+        user: 调用方已查询的用户对象（避免重复查询）
+        """
         # 获取广告配置 - 将字符串ID转换为整数
         try:
             ad_id = int(watch_request.ad_id)
         except ValueError:
             return {"success": False, "message": "无效的广告ID格式"}
-            
-        ad = db.query(AdConfig).filter(AdConfig.id == ad_id).first()
+
+        # 优先使用内存中的广告目录快照，不在快照中（如不在投放时段）再查数据库
+        ad = AdCatalog.get(db).get(ad_id)
+        if ad is None:
+            ad = db.query(AdConfig).filter(AdConfig.id == ad_id).first()
         if not ad or ad.status != AdStatus.ACTIVE:
             return {"success": False, "message": "广告不存在或已下线"}
+
+        if user is None:
+            user = db.query(User).filter(User.id == user_id).first()
         
         # 获取最小观看时长（根据广告类型）
         if ad.ad_type == "video":
@@ -138,20 +85,18 @@ class AdService:
         # 检查观看时长是否达标（只依赖服务端验证的观看时长，不信任客户端的is_completed标志）
         is_completed = watch_request.watch_duration >= min_duration
         
-        # 计算奖励金币（使用配置的动态奖励范围）
+        # 计算奖励金币（整数分，使用配置的动态奖励范围）
         if is_completed:
             # 如果广告本身设置了奖励金币，优先使用广告设置
             if ad.reward_coins > 0:
-                base_reward_coins = float(ad.reward_coins)
+                base_reward_coins = ad.reward_coins
             else:
-                # 使用系统配置的奖励范围随机生成
+                # 使用系统配置的奖励范围随机生成（精确到分）
                 min_coins, max_coins = ConfigService.get_ad_reward_coins_range(db)
-                base_reward_coins = random.uniform(min_coins, max_coins)
-                base_reward_coins = round(base_reward_coins, 2)
+                base_reward_coins = random.randint(min_coins, max(min_coins, max_coins))
             
             # 根据用户等级计算最终奖励
             from services.level_service import LevelService
-            user = db.query(User).filter(User.id == user_id).first()
             if user:
                 reward_coins = LevelService.calculate_ad_coins(db, user.level, base_reward_coins)
             else:
@@ -159,74 +104,85 @@ class AdService:
         else:
             reward_coins = 0
         
-        # 检查今日观看限制
-        today = date.today()
-        today_count = db.query(func.count(AdWatchRecord.id)).filter(
-            AdWatchRecord.user_id == user_id,
-            AdWatchRecord.ad_id == ad_id,
-            func.date(AdWatchRecord.watch_time) == today
-        ).scalar()
-        
-        if today_count >= ad.daily_limit:
-            return {"success": False, "message": "今日该广告观看次数已达上限"}
-        
-        # 检查系统每日总限制
+        # 检查今日观看限制（Redis计数原子预占，Redis不可用时按时间范围查数据库）
         daily_limit = int(ConfigService.get_config(db, "daily_ad_limit", "20"))
-        total_today = db.query(func.count(AdWatchRecord.id)).filter(
-            AdWatchRecord.user_id == user_id,
-            func.date(AdWatchRecord.watch_time) == today
-        ).scalar()
-        
-        if total_today >= daily_limit:
+        reserved = AdDailyCounter.try_reserve(db, user_id, ad_id, daily_limit, ad.daily_limit)
+        if reserved is None:
+            today_counts = AdDailyCounter.load_from_db(db, user_id)
+            if today_counts["ads"].get(ad_id, 0) >= ad.daily_limit:
+                reserved = -2
+            elif today_counts["total"] >= daily_limit:
+                reserved = -1
+
+        if reserved == -2:
+            return {"success": False, "message": "今日该广告观看次数已达上限"}
+        if reserved == -1:
             return {"success": False, "message": "今日广告观看次数已达上限"}
         
-        # 记录观看记录
-        watch_record = AdWatchRecord(
+        # 观看记录
+        record_data = dict(
             user_id=user_id,
             ad_id=ad_id,
             watch_duration=watch_request.watch_duration,
             reward_coins=reward_coins,
             is_completed=1 if is_completed else 0,
             ip_address=ip_address,
-            device_info=watch_request.device_info
+            device_info=watch_request.device_info,
+            watch_key=uuid.uuid4().hex
         )
+        # 延迟写入模式：观看记录在提交前入队，不在本事务中写入，金币流水通过 related_key（watch_key）关联记录；
+        # 入队失败时在本事务中同步写入，记录和金币一起提交或回滚
+        message_id = AdWatchWriter.enqueue(record_data) if AdWatchWriter.is_enabled() else None
         
-        db.add(watch_record)
-        db.commit()
-        db.refresh(watch_record)
-        
-        # 发放奖励金币
+        try:
+            if message_id:
+                record_id = None
+            else:
+                watch_record = AdWatchRecord(**record_data)
+                db.add(watch_record)
+                db.flush()  # 获取记录ID作为金币流水的关联ID
+                record_id = watch_record.id
+
+            # 发放奖励金币（同一事务内）
+            if reward_coins > 0:
+                user_coins = UserService.apply_coins(
+                    db, user_id, reward_coins,
+                    TransactionType.AD_REWARD,
+                    f"观看广告奖励: {ad.name}",
+                    record_id,
+                    related_key=record_data["watch_key"]
+                )
+            else:
+                user_coins = user.coins if user else 0
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 记录未写入，撤回已入队的记录并撤销计数预占
+            if message_id:
+                AdWatchWriter.discard(message_id, record_data["watch_key"])
+            if reserved == 1:
+                AdDailyCounter.release(user_id, ad_id)
+            raise
+
         if reward_coins > 0:
-            UserService.add_coins(
-                db, user_id, float(reward_coins),
-                TransactionType.AD_REWARD,
-                f"观看广告奖励: {ad.name}",
-                watch_record.id
-            )
+            AdDailyCounter.add_coins(user_id, reward_coins)
         
         return {
             "success": True,
             "message": "广告观看完成",
             "reward_coins": reward_coins,
-            "is_completed": is_completed
+            "is_completed": is_completed,
+            "user_coins": user_coins or 0
         }
     
     @staticmethod
     def get_user_ad_stats(db: Session, user_id) -> dict:
         """获取用户广告观看统计"""
-        today = date.today()
-        
-        # 今日观看次数
-        today_count = db.query(func.count(AdWatchRecord.id)).filter(
-            AdWatchRecord.user_id == user_id,
-            func.date(AdWatchRecord.watch_time) == today
-        ).scalar() or 0
-        
-        # 今日获得金币
-        today_coins = db.query(func.sum(AdWatchRecord.reward_coins)).filter(
-            AdWatchRecord.user_id == user_id,
-            func.date(AdWatchRecord.watch_time) == today
-        ).scalar() or 0
+        # 今日观看次数和获得金币（Redis每日计数）
+        today_counts = AdDailyCounter.get_today(db, user_id)
+        today_count = today_counts["total"]
+        today_coins = today_counts["coins"]
         
         # 总观看次数
         total_count = db.query(func.count(AdWatchRecord.id)).filter(
@@ -243,9 +199,9 @@ class AdService:
         
         return {
             "today_count": today_count,
-            "today_coins": float(today_coins),
+            "today_coins": from_cents(today_coins),
             "total_count": total_count,
-            "total_coins": float(total_coins),
+            "total_coins": from_cents(total_coins),
             "daily_limit": daily_limit,
             "remaining_today": max(0, daily_limit - today_count)
         }
@@ -325,15 +281,17 @@ class AdService:
     @staticmethod
     def get_ad_stats(db: Session, ad_id: int = None) -> dict:
         """获取广告统计数据"""
-        today = date.today()
+        # 按时间范围过滤今日记录（可以使用watch_time索引）
+        today_start, today_end = AdDailyCounter.day_range(date.today())
+        is_today = and_(AdWatchRecord.watch_time >= today_start, AdWatchRecord.watch_time < today_end)
         
         if ad_id:
             # 单个广告统计
             query = db.query(AdWatchRecord).filter(AdWatchRecord.ad_id == ad_id)
             
-            today_views = query.filter(func.date(AdWatchRecord.watch_time) == today).count()
+            today_views = query.filter(is_today).count()
             total_views = query.count()
-            today_coins = query.filter(func.date(AdWatchRecord.watch_time) == today).with_entities(
+            today_coins = query.filter(is_today).with_entities(
                 func.sum(AdWatchRecord.reward_coins)).scalar() or 0
             total_coins = query.with_entities(func.sum(AdWatchRecord.reward_coins)).scalar() or 0
             
@@ -341,23 +299,21 @@ class AdService:
                 "ad_id": ad_id,
                 "today_views": today_views,
                 "total_views": total_views,
-                "today_coins": float(today_coins),
-                "total_coins": float(total_coins)
+                "today_coins": from_cents(today_coins),
+                "total_coins": from_cents(total_coins)
             }
         else:
             # 全部广告统计
-            today_views = db.query(func.count(AdWatchRecord.id)).filter(
-                func.date(AdWatchRecord.watch_time) == today).scalar() or 0
+            today_views = db.query(func.count(AdWatchRecord.id)).filter(is_today).scalar() or 0
             total_views = db.query(func.count(AdWatchRecord.id)).scalar() or 0
-            today_coins = db.query(func.sum(AdWatchRecord.reward_coins)).filter(
-                func.date(AdWatchRecord.watch_time) == today).scalar() or 0
+            today_coins = db.query(func.sum(AdWatchRecord.reward_coins)).filter(is_today).scalar() or 0
             total_coins = db.query(func.sum(AdWatchRecord.reward_coins)).scalar() or 0
             
             return {
                 "today_views": today_views,
                 "total_views": total_views,
-                "today_coins": float(today_coins),
-                "total_coins": float(total_coins)
+                "today_coins": from_cents(today_coins),
+                "total_coins": from_cents(total_coins)
             }
     
     @staticmethod
@@ -379,7 +335,7 @@ class AdService:
                 "ad_type": "video",
                 "video_url": "https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4",
                 "duration": 30,
-                "reward_coins": 36,  # 30-40双数
+                "reward_coins": 3600,  # 36金币（30-40双数）
                 "daily_limit": 5,
                 "min_watch_duration": ConfigService.get_video_ad_min_duration(db),
                 "weight": 3,
@@ -390,7 +346,7 @@ class AdService:
                 "ad_type": "video",
                 "video_url": "https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/ElephantsDream.mp4",
                 "duration": 25,
-                "reward_coins": 40,  # 30-40双数
+                "reward_coins": 4000,  # 40金币（30-40双数）
                 "daily_limit": 3,
                 "min_watch_duration": ConfigService.get_video_ad_min_duration(db),
                 "weight": 2,
@@ -401,7 +357,7 @@ class AdService:
                 "ad_type": "video",
                 "video_url": "https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/ForBiggerBlazes.mp4",
                 "duration": 15,
-                "reward_coins": 32,  # 30-40双数
+                "reward_coins": 3200,  # 32金币（30-40双数）
                 "daily_limit": 10,
                 "min_watch_duration": 10,
                 "weight": 5,
@@ -412,7 +368,7 @@ class AdService:
                 "ad_type": "video",
                 "video_url": "https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/ForBiggerEscapes.mp4",
                 "duration": 20,
-                "reward_coins": 38,  # 30-40双数
+                "reward_coins": 3800,  # 38金币（30-40双数）
                 "daily_limit": 4,
                 "min_watch_duration": 15,
                 "weight": 3,
@@ -0,0 +1,366 @@
+"""
+广告观看记录延迟写入（write-behind）- 请求路径上只把观看记录追加到Redis Stream，
+由后台线程按批多行INSERT写入ad_watch_records，应用关闭时把队列写空
+
+观看计数（Redis每日计数）和金币余额仍在请求内同步更新，观看记录只是明细落库延后；
+Stream使用消费组，记录在写库成功后才确认删除，写库失败或进程崩溃后会重新投递
+- 观看记录在金币事务提交前入队，入队失败时在同一事务中同步写库；金币事务回滚时撤回已入队的记录
+- Stream不裁剪（裁剪会丢掉未确认的记录）：积压超过 AD_WATCH_QUEUE_MAX_PENDING 时报警并改为同步写库
+- 每条记录带 watch_key，金币流水的 related_key 指向它；重新投递的记录按 watch_key 去重
+- 整批因外键、数据超长等错误写入失败时逐条重写，仍然失败的记录转入死信Stream并报错，不阻塞后续记录
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import DataError, IntegrityError
+from models import AdWatchRecord
+from config import settings
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdWatchWriter:
+    """观看记录队列 + 批量落库"""
+
+    # Redis键名
+    REDIS_KEYS = {
+        "stream": "ad_watch:pending",        # 待落库的观看记录（XADD入队）
+        "group": "ad_watch_writers",         # 消费组（多个worker进程共同消费）
+        "dead": "ad_watch:dead",             # 无法写入的观看记录（含错误信息，需人工处理）
+    }
+
+    # 批量写入配置
+    BATCH_SIZE = 500          # 每批最多写入条数
+    POLL_TIMEOUT_MS = 1000    # 队列空时阻塞等待时间（毫秒）
+    RETRY_DELAY = 5           # 落库失败后的重试间隔（秒）
+    CLAIM_IDLE_MS = 60000     # 其他消费者超过该时长未确认的记录视为遗留（进程已退出），由本进程接管
+    BACKLOG_CHECK_INTERVAL = 1.0  # 队列积压检查间隔（秒）
+
+    _consumer = f"{socket.gethostname()}-{os.getpid()}"
+    _worker_thread: Optional[threading.Thread] = None
+    _worker_lock = threading.Lock()
+    _stop_event = threading.Event()
+    _group_ready = False
+    _backlog_checked_at = 0.0
+    _backlog_full = False
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _backlog_exceeded() -> bool:
+        """
+        队列积压是否超过上限（每个进程每秒最多检查一次XLEN）
+        超过时报警，新的观看记录改为同步写库（数据库不可用时请求失败，而不是丢弃已入队的记录）
+        """
+        now = time.monotonic()
+        if now - AdWatchWriter._backlog_checked_at < AdWatchWriter.BACKLOG_CHECK_INTERVAL:
+            return AdWatchWriter._backlog_full
+        AdWatchWriter._backlog_checked_at = now
+
+        redis = AdWatchWriter._get_redis()
+        try:
+            length = redis.xlen(AdWatchWriter.REDIS_KEYS["stream"])
+        except Exception as e:
+            logger.warning(f"检查观看记录队列长度失败: {e}")
+            return AdWatchWriter._backlog_full
+
+        full = length >= settings.AD_WATCH_QUEUE_MAX_PENDING
+        if full and not AdWatchWriter._backlog_full:
+            logger.error(f"🚨 观看记录队列积压{length}条（上限{settings.AD_WATCH_QUEUE_MAX_PENDING}），"
+                         f"后台落库可能失败，新的观看记录改为同步写库")
+        elif AdWatchWriter._backlog_full and not full:
+            logger.warning(f"观看记录队列积压已降到{length}条，恢复延迟写入")
+        AdWatchWriter._backlog_full = full
+        return full
+
+    @staticmethod
+    def is_enabled() -> bool:
+        """是否处于延迟写入模式（后台线程在运行、未在关闭且队列积压未超过上限）"""
+        thread = AdWatchWriter._worker_thread
+        return (thread is not None and thread.is_alive() and not AdWatchWriter._stop_event.is_set()
+                and not AdWatchWriter._backlog_exceeded())
+
+    @staticmethod
+    def enqueue(record: Dict) -> Optional[str]:
+        """
+        追加一条观看记录（一次Redis往返），在金币事务提交前调用
+        返回消息ID（金币事务失败时用于 discard 撤回）；返回None表示入队失败，调用方应在事务内同步写库
+        """
+        redis = AdWatchWriter._get_redis()
+        if not redis:
+            return None
+        fields = dict(record)
+        fields["watch_time"] = fields.get("watch_time") or datetime.now()
+        try:
+            return redis.xadd(AdWatchWriter.REDIS_KEYS["stream"], {"data": json.dumps(fields, default=str)})
+        except Exception as e:
+            logger.error(f"观看记录入队失败，改为同步写入: {e}")
+            return None
+
+    @staticmethod
+    def discard(message_id: str, watch_key: str = None):
+        """
+        撤回已入队的观看记录（金币事务回滚时调用）
+        后台线程写库成功后才删除消息，消息已不存在说明记录已落库，记录错误以便人工核对
+        """
+        try:
+            if AdWatchWriter._get_redis().xdel(AdWatchWriter.REDIS_KEYS["stream"], message_id):
+                return
+            error = "记录已落库"
+        except Exception as e:
+            error = str(e)
+        logger.error(f"🚨 撤回观看记录失败，该记录没有对应的金币流水: watch_key={watch_key}: {error}")
+
+    @staticmethod
+    def _decode(raw: str) -> Optional[Dict]:
+        try:
+            item = json.loads(raw)
+            item["watch_time"] = datetime.fromisoformat(item["watch_time"])
+            return {column: item.get(column) for column in (
+                "user_id", "ad_id", "watch_duration", "reward_coins",
+                "is_completed", "ip_address", "device_info", "watch_time", "watch_key"
+            )}
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def pending_records(user_id, start: datetime, end: datetime) -> List[Dict]:
+        """
+        队列中尚未确认删除的某用户观看记录（watch_time在 [start, end) 内）
+        遍历整个Stream（正常情况下队列接近为空，积压时代价与积压量成正比），Redis失败时抛出异常
+        """
+        redis = AdWatchWriter._get_redis()
+        if not redis:
+            return []
+        stream = AdWatchWriter.REDIS_KEYS["stream"]
+        records = []
+        cursor = "-"
+        while True:
+            entries = redis.xrange(stream, min=cursor, count=AdWatchWriter.BATCH_SIZE)
+            for _, fields in entries:
+                row = AdWatchWriter._decode(fields.get("data"))
+                if row and str(row["user_id"]) == str(user_id) and start <= row["watch_time"] < end:
+                    records.append(row)
+            if len(entries) < AdWatchWriter.BATCH_SIZE:
+                return records
+            cursor = f"({entries[-1][0]}"
+
+    @staticmethod
+    def write_records(db: Session, rows: List[Dict]) -> int:
+        """
+        批量写入观看记录：一条多行INSERT，一次提交；返回实际插入的条数
+        watch_key已存在的记录跳过（写库成功但确认前进程退出，记录会被重新投递）；
+        只容忍唯一键冲突，外键、超长等其他错误照常抛出，整批留在队列中重试
+        """
+        # 先排除已落库的记录：MySQL连接启用了FOUND_ROWS，ON DUPLICATE KEY UPDATE未改变的行也计入影响行数
+        keys = [row["watch_key"] for row in rows if row.get("watch_key")]
+        if keys:
+            existing = {key for key, in db.query(AdWatchRecord.watch_key).filter(AdWatchRecord.watch_key.in_(keys))}
+            rows = [row for row in rows if row.get("watch_key") not in existing]
+        if not rows:
+            db.rollback()
+            return 0
+        table = AdWatchRecord.__table__
+        if db.get_bind().dialect.name == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+            # 并发重复投递时只容忍唯一键冲突（赋回原值，该行不变），不使用IGNORE以免吞掉其他错误
+            stmt = insert(table).on_duplicate_key_update(watch_key=table.c.watch_key)
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).on_conflict_do_nothing(index_elements=["watch_key"])
+        result = db.execute(stmt, rows)
+        db.commit()
+        return result.rowcount
+
+    @staticmethod
+    def _write_one_by_one(redis, db: Session, rows: List[Dict]) -> int:
+        """整批写入失败后逐条写入，仍然失败的记录转入死信Stream；返回写入条数"""
+        inserted = 0
+        for row in rows:
+            try:
+                inserted += AdWatchWriter.write_records(db, [row])
+            except (IntegrityError, DataError) as e:
+                db.rollback()
+                redis.xadd(AdWatchWriter.REDIS_KEYS["dead"], {
+                    "data": json.dumps(row, default=str),
+                    "error": str(e.orig if e.orig is not None else e)[:500]
+                })
+                logger.error(f"🚨 观看记录无法写入，已转入{AdWatchWriter.REDIS_KEYS['dead']}: "
+                             f"watch_key={row.get('watch_key')} 用户{row.get('user_id')} 广告{row.get('ad_id')}: {e.orig}")
+        return inserted
+
+    @staticmethod
+    def _ensure_group(redis):
+        if AdWatchWriter._group_ready:
+            return
+        try:
+            redis.xgroup_create(
+                AdWatchWriter.REDIS_KEYS["stream"], AdWatchWriter.REDIS_KEYS["group"],
+                id="0", mkstream=True
+            )
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        AdWatchWriter._group_ready = True
+
+    @staticmethod
+    def _read_batch(redis, pending: bool, block: bool) -> List[Tuple[str, str]]:
+        """
+        读取一批记录，返回[(消息ID, 数据)]
+        pending=True时读取本消费者已领取但未确认的记录（写库失败后重试），
+        并接管其他已退出消费者遗留的记录
+        """
+        stream = AdWatchWriter.REDIS_KEYS["stream"]
+        group = AdWatchWriter.REDIS_KEYS["group"]
+        consumer = AdWatchWriter._consumer
+
+        if pending:
+            entries = []
+            try:
+                _, claimed, *_ = redis.xautoclaim(
+                    stream, group, consumer, AdWatchWriter.CLAIM_IDLE_MS,
+                    start_id="0-0", count=AdWatchWriter.BATCH_SIZE
+                )
+                entries.extend(claimed)
+            except Exception as e:
+                logger.debug(f"接管遗留观看记录失败（Redis版本过低？）: {e}")
+            response = redis.xreadgroup(group, consumer, {stream: "0"}, count=AdWatchWriter.BATCH_SIZE)
+        else:
+            response = redis.xreadgroup(
+                group, consumer, {stream: ">"}, count=AdWatchWriter.BATCH_SIZE,
+                block=AdWatchWriter.POLL_TIMEOUT_MS if block else None
+            )
+            entries = []
+
+        for _, messages in response or []:
+            entries.extend(messages)
+
+        seen = set()
+        batch = []
+        for message_id, fields in entries:
+            if fields is None or message_id in seen:
+                continue
+            seen.add(message_id)
+            batch.append((message_id, fields.get("data")))
+        return batch
+
+    @staticmethod
+    def _flush_once(redis, pending: bool, block: bool) -> int:
+        """
+        读取并写入一批记录，写库成功后确认并删除
+        返回处理的消息条数（0表示队列已空）
+        """
+        from database import SessionLocal
+
+        batch = AdWatchWriter._read_batch(redis, pending, block)
+        if not batch:
+            return 0
+
+        rows = []
+        for message_id, raw in batch:
+            row = AdWatchWriter._decode(raw)
+            if row is None:
+                logger.error(f"丢弃无效的观看记录: {raw}")
+            else:
+                rows.append(row)
+
+        db = SessionLocal()
+        try:
+            try:
+                inserted = AdWatchWriter.write_records(db, rows)
+            except (IntegrityError, DataError):
+                db.rollback()
+                inserted = AdWatchWriter._write_one_by_one(redis, db, rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if inserted < len(rows):
+            logger.info(f"观看记录{len(rows) - inserted}条已落库（重新投递），跳过")
+
+        message_ids = [message_id for message_id, _ in batch]
+        pipe = redis.pipeline(transaction=False)
+        pipe.xack(AdWatchWriter.REDIS_KEYS["stream"], AdWatchWriter.REDIS_KEYS["group"], *message_ids)
+        pipe.xdel(AdWatchWriter.REDIS_KEYS["stream"], *message_ids)
+        pipe.execute()
+        return len(batch)
+
+    @staticmethod
+    def _run_worker():
+        """后台线程：持续消费观看记录队列并批量落库；失败时记录保留在待确认列表，稍后重试"""
+        # 启动时先处理上次未确认的记录
+        pending = True
+        while not AdWatchWriter._stop_event.is_set():
+            redis = AdWatchWriter._get_redis()
+            try:
+                AdWatchWriter._ensure_group(redis)
+                written = AdWatchWriter._flush_once(redis, pending, block=True)
+                if pending and not written:
+                    pending = False
+            except Exception as e:
+                logger.error(f"观看记录落库失败，稍后重试: {e}")
+                pending = True
+                AdWatchWriter._group_ready = False  # Redis被清空时重新创建消费组
+                AdWatchWriter._stop_event.wait(AdWatchWriter.RETRY_DELAY)
+
+    @staticmethod
+    def start_worker():
+        """启动后台落库线程（每个进程只启动一次）"""
+        with AdWatchWriter._worker_lock:
+            thread = AdWatchWriter._worker_thread
+            if thread is not None and thread.is_alive():
+                return
+            if not AdWatchWriter._get_redis():
+                return
+            AdWatchWriter._stop_event.clear()
+            thread = threading.Thread(
+                target=AdWatchWriter._run_worker,
+                name="ad-watch-writer",
+                daemon=True
+            )
+            thread.start()
+            AdWatchWriter._worker_thread = thread
+
+    @staticmethod
+    def stop_worker(timeout: float = 30):
+        """
+        停止后台线程并把队列写空（应用关闭时调用）
+        停止后新的观看记录改为同步写库；超时或写库失败时剩余记录留在Stream中，下次启动时继续写入
+        """
+        with AdWatchWriter._worker_lock:
+            thread = AdWatchWriter._worker_thread
+            if thread is None:
+                return
+            AdWatchWriter._stop_event.set()
+            thread.join(AdWatchWriter.POLL_TIMEOUT_MS / 1000 + 5)
+            AdWatchWriter._worker_thread = None
+
+        redis = AdWatchWriter._get_redis()
+        deadline = time.monotonic() + timeout
+        drained = 0
+        try:
+            AdWatchWriter._ensure_group(redis)
+            for pending in (True, False):
+                while time.monotonic() < deadline:
+                    written = AdWatchWriter._flush_once(redis, pending, block=False)
+                    if not written:
+                        break
+                    drained += written
+        except Exception as e:
+            logger.error(f"关闭时写入观看记录失败，剩余记录将在下次启动时写入: {e}")
+        if drained:
+            logger.info(f"关闭时写入观看记录{drained}条")
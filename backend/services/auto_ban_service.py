@@ -0,0 +1,166 @@
+"""
+自动封禁落库服务 - 中间件只负责把封禁决定写入Redis队列，
+由后台线程批量写入IPBlacklist，请求路径上不访问数据库
+"""
+from sqlalchemy.orm import Session
+from models import IPBlacklist
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AutoBanService:
+    """自动封禁队列 + 批量落库"""
+
+    # Redis键名
+    REDIS_KEYS = {
+        "pending_bans": "ip_blacklist:pending_bans",   # 待落库的封禁记录（LPUSH入队，RPOP出队）
+    }
+
+    # 批量写入配置
+    BATCH_SIZE = 200          # 每批最多写入条数
+    POLL_TIMEOUT = 1          # 队列空时阻塞等待时间（秒）
+    RETRY_DELAY = 5           # 落库失败后的重试间隔（秒）
+
+    _worker_thread: Optional[threading.Thread] = None
+    _worker_lock = threading.Lock()
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _build_item(ip_address: str, reason: str, ban_duration: int) -> str:
+        return json.dumps({
+            "ip_address": ip_address,
+            "reason": reason,
+            "blocked_at": time.time(),
+            "ban_duration": ban_duration
+        })
+
+    @staticmethod
+    async def enqueue_ban_async(ip_address: str, reason: str, ban_duration: int):
+        """异步入队一条封禁记录（供ASGI中间件使用，一次Redis往返）"""
+        from database import async_redis_client
+        await async_redis_client.lpush(
+            AutoBanService.REDIS_KEYS["pending_bans"],
+            AutoBanService._build_item(ip_address, reason, ban_duration)
+        )
+
+    @staticmethod
+    def write_bans(db: Session, items: List[Dict]) -> int:
+        """
+        批量写入封禁记录：一次IN查询已有记录，更新过期时间或新增，一次提交
+        返回：写入的IP数量
+        """
+        # 同一IP只保留最新一条
+        latest: Dict[str, Dict] = {}
+        for item in items:
+            ip = item.get("ip_address")
+            if ip and (ip not in latest or item["blocked_at"] >= latest[ip]["blocked_at"]):
+                latest[ip] = item
+
+        if not latest:
+            return 0
+
+        existing = {
+            row.ip_address: row
+            for row in db.query(IPBlacklist).filter(IPBlacklist.ip_address.in_(list(latest))).all()
+        }
+
+        for ip, item in latest.items():
+            blocked_time = datetime.fromtimestamp(item["blocked_at"])
+            expire_time = blocked_time + timedelta(seconds=item["ban_duration"])
+            row = existing.get(ip)
+            if row:
+                row.expire_time = expire_time
+                row.is_active = 1
+            else:
+                db.add(IPBlacklist(
+                    ip_address=ip,
+                    reason=f"自动封禁: {item['reason']}",
+                    block_type="auto",
+                    blocked_time=blocked_time,
+                    expire_time=expire_time,
+                    is_active=1
+                ))
+
+        db.commit()
+        logger.warning(f"🔒 批量落库自动封禁: 新增{len(latest) - len(existing)}个, 延长{len(existing)}个")
+        return len(latest)
+
+    @staticmethod
+    def _pop_batch(redis) -> List[str]:
+        """阻塞取出第一条，再用一次pipeline取出其余（最多BATCH_SIZE条）"""
+        key = AutoBanService.REDIS_KEYS["pending_bans"]
+        first = redis.brpop(key, timeout=AutoBanService.POLL_TIMEOUT)
+        if not first:
+            return []
+
+        pipe = redis.pipeline(transaction=False)
+        for _ in range(AutoBanService.BATCH_SIZE - 1):
+            pipe.rpop(key)
+        return [first[1]] + [raw for raw in pipe.execute() if raw is not None]
+
+    @staticmethod
+    def _run_worker():
+        """后台线程：持续消费封禁队列并批量落库；落库失败时放回队尾，稍后重试"""
+        from database import SessionLocal
+
+        while True:
+            redis = AutoBanService._get_redis()
+            raw_items: List[str] = []
+            try:
+                raw_items = AutoBanService._pop_batch(redis)
+                if not raw_items:
+                    continue
+
+                items = []
+                for raw in raw_items:
+                    try:
+                        items.append(json.loads(raw))
+                    except (TypeError, ValueError):
+                        logger.error(f"丢弃无效的封禁记录: {raw}")
+
+                db = SessionLocal()
+                try:
+                    AutoBanService.write_bans(db, items)
+                finally:
+                    db.close()
+
+            except Exception as e:
+                logger.error(f"自动封禁落库失败，稍后重试: {e}")
+                if raw_items:
+                    try:
+                        # 放回出队的一端，下次优先处理
+                        redis.rpush(AutoBanService.REDIS_KEYS["pending_bans"], *reversed(raw_items))
+                    except Exception as push_error:
+                        logger.error(f"封禁记录放回队列失败，丢失{len(raw_items)}条: {push_error}")
+                time.sleep(AutoBanService.RETRY_DELAY)
+
+    @staticmethod
+    def start_worker():
+        """启动后台落库线程（每个进程只启动一次）"""
+        with AutoBanService._worker_lock:
+            thread = AutoBanService._worker_thread
+            if thread is not None and thread.is_alive():
+                return
+            if not AutoBanService._get_redis():
+                return
+            thread = threading.Thread(
+                target=AutoBanService._run_worker,
+                name="auto-ban-writer",
+                daemon=True
+            )
+            thread.start()
+            AutoBanService._worker_thread = thread
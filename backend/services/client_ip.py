@@ -0,0 +1,48 @@
+"""
+客户端IP解析 - 只有直连地址属于受信代理（settings.TRUSTED_PROXIES，如本机nginx）时才读取转发头
+- X-Forwarded-For 从右往左跳过受信代理，取第一个不受信的地址（左侧的值由客户端填写，不可信）
+- 直连地址不是受信代理时直接使用直连地址，客户端伪造的转发头被忽略
+自动封禁按网段封禁，客户端能伪造IP就能让任意网段被封，限流、封禁、注册限制都必须使用这里解析的地址
+"""
+from typing import Optional
+
+from config import settings
+from services.ip_prefix_trie import IPPrefixTrie, normalize_ip
+
+_trusted = None
+_trusted_source = None
+
+
+def _trusted_proxies() -> IPPrefixTrie:
+    """受信代理的前缀树（配置变化时重建）"""
+    global _trusted, _trusted_source
+    if _trusted is None or _trusted_source != settings.TRUSTED_PROXIES:
+        _trusted_source = settings.TRUSTED_PROXIES
+        _trusted = IPPrefixTrie(entry.strip() for entry in _trusted_source.split(",") if entry.strip())
+    return _trusted
+
+
+def resolve_client_ip(peer: Optional[str], forwarded_for: Optional[str] = None,
+                      real_ip: Optional[str] = None) -> str:
+    """
+    解析客户端IP
+    peer: 直连地址（ASGI scope["client"][0]）
+    forwarded_for / real_ip: X-Forwarded-For / X-Real-IP 请求头
+    """
+    if not peer:
+        return "unknown"
+    trusted = _trusted_proxies()
+    if peer not in trusted:
+        return normalize_ip(peer)
+
+    if forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in trusted:
+                return normalize_ip(hop)
+        if hops:
+            return normalize_ip(hops[0])
+
+    if real_ip and real_ip.strip():
+        return normalize_ip(real_ip.strip())
+    return normalize_ip(peer)
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from models import SystemConfig
 from schemas import SystemConfigUpdate
+from services.money import to_cents, coin_to_rmb_cents, rmb_to_coin_cents
 from typing import Optional, Dict, List
 
 class ConfigService:
@@ -173,14 +174,14 @@ class ConfigService:
         return float(ConfigService.get_config(db, "coin_to_rmb_rate", "33000"))
     
     @staticmethod
-    def get_min_withdraw_amount(db: Session) -> float:
-        """获取最小提现金额"""
-        return float(ConfigService.get_config(db, "min_withdraw_amount", "10"))
+    def get_min_withdraw_amount(db: Session) -> int:
+        """获取最小提现金额（人民币，分）"""
+        return to_cents(ConfigService.get_config(db, "min_withdraw_amount", "10"))
     
     @staticmethod
-    def get_max_withdraw_amount(db: Session) -> float:
-        """获取最大提现金额"""
-        return float(ConfigService.get_config(db, "max_withdraw_amount", "500"))
+    def get_max_withdraw_amount(db: Session) -> int:
+        """获取最大提现金额（人民币，分）"""
+        return to_cents(ConfigService.get_config(db, "max_withdraw_amount", "500"))
     
     @staticmethod
     def get_daily_withdraw_limit(db: Session) -> int:
@@ -193,27 +194,32 @@ class ConfigService:
         return int(ConfigService.get_config(db, "daily_ad_limit", "20"))
     
     @staticmethod
-    def get_game_reward_coins(db: Session) -> float:
-        """获取游戏奖励金币"""
-        return float(ConfigService.get_config(db, "game_reward_coins", "5"))
+    def get_max_daily_game_rewards(db: Session) -> int:
+        """获取每日最大游戏奖励次数"""
+        return int(ConfigService.get_config(db, "max_daily_game_rewards", "10"))
     
     @staticmethod
-    def get_register_reward_coins(db: Session) -> float:
-        """获取注册奖励金币"""
-        return float(ConfigService.get_config(db, "register_reward_coins", "100"))
+    def get_game_reward_coins(db: Session) -> int:
+        """获取游戏奖励金币（分）"""
+        return to_cents(ConfigService.get_config(db, "game_reward_coins", "5"))
+    
+    @staticmethod
+    def get_register_reward_coins(db: Session) -> int:
+        """获取注册奖励金币（分）"""
+        return to_cents(ConfigService.get_config(db, "register_reward_coins", "100"))
     
     # 新增广告奖励相关配置方法
     @staticmethod
     def get_ad_reward_coins_range(db: Session) -> tuple:
-        """获取广告奖励金币范围"""
-        min_coins = float(ConfigService.get_config(db, "ad_reward_coins_min", "30"))
-        max_coins = float(ConfigService.get_config(db, "ad_reward_coins_max", "40"))
+        """获取广告奖励金币范围（分）"""
+        min_coins = to_cents(ConfigService.get_config(db, "ad_reward_coins_min", "30"))
+        max_coins = to_cents(ConfigService.get_config(db, "ad_reward_coins_max", "40"))
         return min_coins, max_coins
     
     @staticmethod
-    def get_ad_reward_coins_default(db: Session) -> float:
-        """获取默认广告奖励金币"""
-        return float(ConfigService.get_config(db, "ad_reward_coins_default", "36"))
+    def get_ad_reward_coins_default(db: Session) -> int:
+        """获取默认广告奖励金币（分）"""
+        return to_cents(ConfigService.get_config(db, "ad_reward_coins_default", "36"))
     
     @staticmethod
     def get_video_ad_min_duration(db: Session) -> int:
@@ -232,9 +238,9 @@ class ConfigService:
         return float(ConfigService.get_config(db, "withdrawal_fee_rate", "0"))
     
     @staticmethod
-    def get_withdrawal_min_coins(db: Session) -> float:
-        """获取提现最小金币数量"""
-        return float(ConfigService.get_config(db, "withdrawal_min_coins", "1000"))
+    def get_withdrawal_min_coins(db: Session) -> int:
+        """获取提现最小金币数量（分）"""
+        return to_cents(ConfigService.get_config(db, "withdrawal_min_coins", "1000"))
     
     @staticmethod
     def is_exchange_rate_enabled(db: Session) -> bool:
@@ -247,13 +253,11 @@ class ConfigService:
         return int(ConfigService.get_config(db, "exchange_rate_update_interval", "3600"))
     
     @staticmethod
-    def calculate_rmb_amount(db: Session, coins: float) -> float:
-        """根据配置计算金币对应的人民币金额"""
-        rate = ConfigService.get_coin_to_rmb_rate(db)
-        return round(coins / rate, 2)
+    def calculate_rmb_amount(db: Session, coins: int) -> int:
+        """根据配置计算金币（分）对应的人民币金额（分，向下取整）"""
+        return coin_to_rmb_cents(coins, ConfigService.get_coin_to_rmb_rate(db))
     
     @staticmethod
-    def calculate_coins_needed(db: Session, rmb_amount: float) -> float:
-        """根据配置计算人民币对应需要的金币数量"""
-        rate = ConfigService.get_coin_to_rmb_rate(db)
-        return round(rmb_amount * rate, 2) 
\ No newline at end of file
+    def calculate_coins_needed(db: Session, rmb_amount: int) -> int:
+        """根据配置计算人民币（分）对应需要的金币数量（分，向上取整）"""
+        return rmb_to_coin_cents(rmb_amount, ConfigService.get_coin_to_rmb_rate(db))
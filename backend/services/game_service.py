@@ -0,0 +1,127 @@
+"""
+游戏结果提交 - 一次用户读取（资料缓存）、一个事务：登记用户当天的局数并锁定计数行（判断每日奖励次数）、
+写入游戏记录、在SQL中累加游戏次数/最高分/经验并重算等级、记账发放奖励、累加每日游戏统计汇总，最后一次提交；
+提交后更新Redis排行榜
+各阶段耗时计入进程内指标（game_submit.*），并随结果返回供接口输出Server-Timing
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import update, case
+from models import User, GameRecord, TransactionType
+from services.user_service import UserService, CoinEntry
+from services.user_profile_cache import UserProfile, UserProfileCache
+from services.config_service import ConfigService
+from services.leaderboard_service import LeaderboardService
+from services.game_stats_service import GameDailyStatsService
+from services.protection_metrics import ProtectionMetrics
+from services.money import CENTS_PER_UNIT
+from datetime import datetime
+from typing import Dict
+import time
+
+
+class StageTimer:
+    """按阶段记录耗时（毫秒）"""
+
+    __slots__ = ("timings", "_last")
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.timings[stage] = round(elapsed * 1000, 3)
+        ProtectionMetrics.observe(f"game_submit.{stage}", elapsed)
+
+
+class GameService:
+    """游戏结果提交"""
+
+    # 每1000经验升一级
+    EXPERIENCE_PER_LEVEL = 1000
+
+    @staticmethod
+    def calculate_reward(db: Session, score: int) -> int:
+        """计算本局奖励金币（分）：基础奖励 + 每100分额外1金币，最多10金币"""
+        score_bonus = min(score // 100, 10) * CENTS_PER_UNIT
+        return ConfigService.get_game_reward_coins(db) + score_bonus
+
+    @staticmethod
+    def submit_result(db: Session, user: UserProfile, score: int, duration: int, needles_inserted: int,
+                      timer: StageTimer = None) -> Dict:
+        """
+        提交一局游戏结果（一个事务，一次提交）
+        user: 调用方已获取的用户资料（本次提交不再查询用户）
+        timer: 调用方的阶段计时器（已记录获取用户等阶段时传入）
+        返回：{"game_id", "score", "reward_coins"（分）, "is_new_record", "remaining_rewards_today", "timings"}
+        """
+        timer = timer or StageTimer()
+        user_id = user.id
+        play_time = datetime.now()
+
+        max_daily_rewards = ConfigService.get_max_daily_game_rewards(db)
+        reward_if_eligible = GameService.calculate_reward(db, score)
+        timer.mark("config")
+
+        try:
+            # 当天计数行加锁后才判断奖励次数：同一用户的并发提交依次执行，不会超过每日上限或重复计入游戏人数
+            games_today, today_rewards = GameDailyStatsService.record_player(db, user_id, play_time.date())
+            reward_coins = reward_if_eligible if today_rewards < max_daily_rewards else 0
+            if reward_coins > 0:
+                GameDailyStatsService.record_reward(db, user_id, play_time.date())
+            timer.mark("counter")
+
+            game_record = GameRecord(
+                user_id=user_id,
+                score=score,
+                duration=duration,
+                needles_inserted=needles_inserted,
+                reward_coins=reward_coins,
+                play_time=play_time
+            )
+            db.add(game_record)
+            db.flush()  # 获取记录ID作为金币流水的关联ID
+
+            # 游戏统计在SQL中累加（并发提交不会互相覆盖）；
+            # level写在experience之前：MySQL按顺序求值SET，此时引用的仍是更新前的经验值
+            experience_gain = max(1, score // 10)
+            db.execute(
+                update(User).where(User.id == user_id).ordered_values(
+                    (User.level, (User.experience + experience_gain) // GameService.EXPERIENCE_PER_LEVEL + 1),
+                    (User.experience, User.experience + experience_gain),
+                    (User.game_count, User.game_count + 1),
+                    (User.best_score, case((User.best_score < score, score), else_=User.best_score)),
+                ).execution_options(synchronize_session=False)
+            )
+            UserProfileCache.mark_dirty(db, user_id)
+
+            if reward_coins > 0:
+                UserService.post_coins(db, [CoinEntry(
+                    user_id, reward_coins, TransactionType.GAME_REWARD,
+                    f"游戏奖励 - 得分: {score}", game_record.id
+                )])
+            GameDailyStatsService.record_game(
+                db, user_id, play_time.date(), score, reward_coins, first_game_today=games_today == 1
+            )
+            game_id = game_record.id
+            timer.mark("write")
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        timer.mark("commit")
+
+        LeaderboardService.record_score(user_id, score)
+        timer.mark("leaderboard")
+
+        return {
+            "game_id": game_id,
+            "score": score,
+            "reward_coins": reward_coins,
+            "is_new_record": score > (user.best_score or 0),
+            "remaining_rewards_today": max(0, max_daily_rewards - today_rewards - (1 if reward_coins > 0 else 0)),
+            "timings": timer.timings
+        }
@@ -0,0 +1,284 @@
+"""
+每日游戏统计汇总（game_daily_stats）- 图表和管理后台读取汇总表，不再扫描 game_records
+
+- 增量更新：提交游戏时在同一事务中先 upsert 用户当天的计数行（game_daily_players，持有行锁），
+  再对当天的汇总行做一次 upsert（局数、得分合计/最高分、奖励金币累加；计数行显示为当天第一局时游戏人数+1）
+- 同一用户的并发提交在计数行锁上排队，第一局判断和每日奖励次数上限都不会因并发重复
+- 每天按 user_id % SLOTS 分为多行：不同用户的并发提交分散到不同行，不会在同一行锁上排队；
+  同一用户总在同一分片，各分片的游戏人数相加即为当天去重人数
+- 回填：按天从历史记录重算汇总行和计数行（按ID二分定位每天的记录范围，逐天主键范围扫描），
+  重算前按与提交相同的顺序锁定当天的计数行和汇总行，与并发的增量更新互不丢失；
+  上线时和发现偏差时运行 backfill_game_stats.py
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, update
+from models import GameRecord, GameDailyStats, GameDailyPlayer
+from config import settings
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Callable, Dict, Optional, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class GameDailyStatsService:
+    """每日游戏统计汇总"""
+
+    # 每天的分片行数（修改后需重新回填）
+    SLOTS = 16
+
+    @staticmethod
+    def _empty() -> Dict:
+        return {"games": 0, "players": 0, "score_sum": 0, "max_score": 0, "total_coins": 0}
+
+    @staticmethod
+    def _upsert(db: Session, model, values: Dict, merge: Callable):
+        """
+        插入一行，主键已存在时按 merge(当前列, 新值列) 返回的赋值更新
+        （MySQL: ON DUPLICATE KEY UPDATE，已存在的行直接加排他锁；SQLite: ON CONFLICT DO UPDATE）
+        """
+        table = model.__table__
+        if db.get_bind().dialect.name == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table).values(**values)
+            stmt = stmt.on_duplicate_key_update(**merge(table.c, stmt.inserted))
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table).values(**values)
+            stmt = stmt.on_conflict_do_update(index_elements=[column.name for column in table.primary_key],
+                                              set_=merge(table.c, stmt.excluded))
+        db.execute(stmt)
+
+    @staticmethod
+    def record_player(db: Session, user_id: int, day: date) -> Tuple[int, int]:
+        """
+        登记用户当天的一局游戏（在调用方事务中执行，应作为事务的第一条写入）
+        计数行加排他锁直到事务结束，同一用户的并发提交依次执行，读到的计数包含之前已提交的所有局
+        返回：(当天局数（含本局）, 当天已获得奖励的局数（不含本局）)
+        """
+        GameDailyStatsService._upsert(
+            db, GameDailyPlayer,
+            {"stat_date": day, "user_id": user_id, "games": 1, "rewarded_games": 0},
+            lambda current, new: {"games": current.games + 1}
+        )
+        games, rewarded_games = db.query(GameDailyPlayer.games, GameDailyPlayer.rewarded_games).filter(
+            GameDailyPlayer.stat_date == day,
+            GameDailyPlayer.user_id == user_id
+        ).one()
+        return int(games), int(rewarded_games)
+
+    @staticmethod
+    def record_reward(db: Session, user_id: int, day: date):
+        """本局发放了奖励（在 record_player 之后、同一事务中调用）"""
+        db.execute(
+            update(GameDailyPlayer).where(
+                GameDailyPlayer.stat_date == day,
+                GameDailyPlayer.user_id == user_id
+            ).values(rewarded_games=GameDailyPlayer.rewarded_games + 1).execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def record_game(db: Session, user_id: int, day: date, score: int, reward_coins: int, first_game_today: bool):
+        """
+        记录一局游戏（在调用方事务中执行，不提交）
+        first_game_today: 该用户当天的第一局（由 record_player 返回的局数判断，游戏人数+1）
+        """
+        GameDailyStatsService._upsert(db, GameDailyStats, {
+            "stat_date": day,
+            "slot": user_id % GameDailyStatsService.SLOTS,
+            "games": 1,
+            "players": 1 if first_game_today else 0,
+            "score_sum": score,
+            "max_score": score,
+            "total_coins": reward_coins,
+        }, lambda current, new: {
+            "games": current.games + new.games,
+            "players": current.players + new.players,
+            "score_sum": current.score_sum + new.score_sum,
+            "max_score": case((current.max_score < new.max_score, new.max_score), else_=current.max_score),
+            "total_coins": current.total_coins + new.total_coins,
+            "updated_time": func.now(),
+        })
+
+    @staticmethod
+    def get_range(db: Session, start: date, end: date) -> Dict[date, Dict]:
+        """按天汇总 [start, end] 的统计（只读取 天数×分片数 行）；没有游戏的日期不在结果中"""
+        rows = db.query(
+            GameDailyStats.stat_date,
+            func.sum(GameDailyStats.games),
+            func.sum(GameDailyStats.players),
+            func.sum(GameDailyStats.score_sum),
+            func.max(GameDailyStats.max_score),
+            func.sum(GameDailyStats.total_coins)
+        ).filter(
+            GameDailyStats.stat_date >= start,
+            GameDailyStats.stat_date <= end
+        ).group_by(GameDailyStats.stat_date).all()
+        return {
+            stat_date: {
+                "games": int(games or 0),
+                "players": int(players or 0),
+                "score_sum": int(score_sum or 0),
+                "max_score": int(max_score or 0),
+                "total_coins": int(total_coins or 0)
+            }
+            for stat_date, games, players, score_sum, max_score, total_coins in rows
+        }
+
+    @staticmethod
+    def get_day(db: Session, day: date) -> Dict:
+        """某一天的统计"""
+        return GameDailyStatsService.get_range(db, day, day).get(day) or GameDailyStatsService._empty()
+
+    @staticmethod
+    def get_totals(db: Session) -> Dict:
+        """全部历史合计：{"games", "score_sum", "max_score", "total_coins"}"""
+        games, score_sum, max_score, total_coins = db.query(
+            func.sum(GameDailyStats.games),
+            func.sum(GameDailyStats.score_sum),
+            func.max(GameDailyStats.max_score),
+            func.sum(GameDailyStats.total_coins)
+        ).one()
+        return {
+            "games": int(games or 0),
+            "score_sum": int(score_sum or 0),
+            "max_score": int(max_score or 0),
+            "total_coins": int(total_coins or 0)
+        }
+
+    @staticmethod
+    def _first_id_at(db: Session, moment: datetime, lo: int, hi: int) -> int:
+        """
+        二分查找ID在 [lo, hi] 内第一条 play_time >= moment 的记录ID（游戏记录ID随时间递增）
+        都早于moment时返回 hi + 1
+        """
+        hi += 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            play_time = db.query(GameRecord.play_time).filter(
+                GameRecord.id >= mid
+            ).order_by(GameRecord.id).limit(1).scalar()
+            if play_time is None or play_time >= moment:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    @staticmethod
+    def rebuild_day(db: Session, day: date, first_id: int, end_id: Optional[int] = None) -> Dict:
+        """
+        从游戏记录重算某一天的计数行和汇总行并提交
+        first_id / end_id: 当天记录的ID范围 [first_id, end_id)，end_id为None表示不限
+        按与提交相同的顺序先锁定当天的计数行、再锁定汇总行（没有行时锁定间隙），
+        并发提交等待本事务提交后再累加；锁定后的统计查询能看到锁定前已提交的全部记录
+        返回当天合计
+        """
+        day_start = datetime.combine(day, dt_time.min)
+        try:
+            db.query(GameDailyPlayer.user_id).filter(
+                GameDailyPlayer.stat_date == day
+            ).with_for_update().all()
+            db.query(GameDailyStats.slot).filter(
+                GameDailyStats.stat_date == day
+            ).with_for_update().all()
+
+            query = db.query(
+                GameRecord.user_id,
+                func.count(GameRecord.id),
+                func.coalesce(func.sum(case((GameRecord.reward_coins > 0, 1), else_=0)), 0),
+                func.coalesce(func.sum(GameRecord.score), 0),
+                func.coalesce(func.max(GameRecord.score), 0),
+                func.coalesce(func.sum(GameRecord.reward_coins), 0)
+            ).filter(
+                GameRecord.id >= first_id,
+                GameRecord.play_time >= day_start,
+                GameRecord.play_time < day_start + timedelta(days=1)
+            )
+            if end_id is not None:
+                query = query.filter(GameRecord.id < end_id)
+            rows = query.group_by(GameRecord.user_id).all()
+
+            players = []
+            slots: Dict[int, Dict] = {}
+            for user_id, games, rewarded_games, score_sum, max_score, total_coins in rows:
+                players.append({"stat_date": day, "user_id": user_id,
+                                "games": int(games), "rewarded_games": int(rewarded_games)})
+                stats = slots.setdefault(user_id % GameDailyStatsService.SLOTS, GameDailyStatsService._empty())
+                stats["games"] += int(games)
+                stats["players"] += 1
+                stats["score_sum"] += int(score_sum)
+                stats["max_score"] = max(stats["max_score"], int(max_score))
+                stats["total_coins"] += int(total_coins)
+
+            db.query(GameDailyPlayer).filter(GameDailyPlayer.stat_date == day).delete(synchronize_session=False)
+            db.query(GameDailyStats).filter(GameDailyStats.stat_date == day).delete(synchronize_session=False)
+            if players:
+                db.execute(GameDailyPlayer.__table__.insert(), players)
+                db.execute(GameDailyStats.__table__.insert(), [
+                    dict(stats, stat_date=day, slot=slot_value) for slot_value, stats in slots.items()
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        totals = GameDailyStatsService._empty()
+        for stats in slots.values():
+            for name in ("games", "players", "score_sum", "total_coins"):
+                totals[name] += stats[name]
+            totals["max_score"] = max(totals["max_score"], stats["max_score"])
+        return totals
+
+    @staticmethod
+    def backfill(start: date = None, end: date = None, db_budget: float = None,
+                 on_day: Callable[[date, Dict], None] = None) -> Dict:
+        """
+        从历史游戏记录回填汇总表（逐天重算，每天一个事务）
+        start / end: 回填的日期范围，默认从第一条游戏记录到今天
+        db_budget: 数据库负载预算（0~1），每天的查询耗时t后休眠 t*(1/预算-1) 秒；≥1表示不休眠
+        on_day: 每天完成后的回调（用于输出进度）
+        返回：{"days", "games", "start", "end"}
+        """
+        from database import SessionLocal
+
+        db_budget = settings.GAME_STATS_BACKFILL_DB_BUDGET if db_budget is None else db_budget
+        progress = {"days": 0, "games": 0, "start": None, "end": None}
+
+        db = SessionLocal()
+        try:
+            min_id, max_id = db.query(func.min(GameRecord.id), func.max(GameRecord.id)).one()
+            if min_id is None:
+                return progress
+            if start is None:
+                start = db.query(GameRecord.play_time).filter(GameRecord.id == min_id).scalar().date()
+            end = end or date.today()
+            progress["start"], progress["end"] = start.isoformat(), end.isoformat()
+
+            first_id = GameDailyStatsService._first_id_at(db, datetime.combine(start, dt_time.min), min_id, max_id)
+            day = start
+            while day <= end:
+                started = time.perf_counter()
+                end_id = GameDailyStatsService._first_id_at(
+                    db, datetime.combine(day + timedelta(days=1), dt_time.min), first_id, max_id
+                )
+                # 结束二分查找所在的读事务，重算的一致性快照须在锁定汇总行之后建立
+                db.rollback()
+                totals = GameDailyStatsService.rebuild_day(
+                    db, day, first_id, end_id if end_id <= max_id else None
+                )
+                progress["days"] += 1
+                progress["games"] += totals["games"]
+                if on_day:
+                    on_day(day, totals)
+
+                first_id = end_id
+                day += timedelta(days=1)
+                elapsed = time.perf_counter() - started
+                if 0 < db_budget < 1:
+                    time.sleep(elapsed * (1 / db_budget - 1))
+        finally:
+            db.close()
+
+        logger.info(f"每日游戏统计回填完成: {progress}")
+        return progress
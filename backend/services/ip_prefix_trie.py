@@ -0,0 +1,178 @@
+"""
+IP前缀匹配 - 二进制基数树（radix trie）
+支持IPv4/IPv6单个地址和CIDR网段混合存储，查询代价为O(前缀长度)，与封禁条目数量无关
+"""
+import ipaddress
+from typing import Iterable, List, Optional, Union
+
+from config import settings
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# 节点结构: [0分支, 1分支, 是否为封禁终点]
+_ZERO, _ONE, _TERMINAL = 0, 1, 2
+
+
+def _new_node() -> list:
+    return [None, None, False]
+
+
+def _parse_address(ip: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    """解析IP地址；IPv4映射的IPv6地址（::ffff:1.2.3.4）还原为IPv4"""
+    try:
+        address = ipaddress.ip_address(ip.strip().split("%", 1)[0])
+    except (ValueError, AttributeError):
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+def parse_network(entry: str) -> Optional[IPNetwork]:
+    """解析黑名单条目（单个IP或CIDR），无效条目返回None"""
+    if not entry:
+        return None
+    if "/" not in entry:
+        address = _parse_address(entry)
+        if address is None:
+            return None
+        return ipaddress.ip_network(address)
+    try:
+        network = ipaddress.ip_network(entry.strip(), strict=False)
+    except ValueError:
+        return None
+    if network.version == 6 and network.network_address.ipv4_mapped is not None and network.prefixlen >= 96:
+        mapped = network.network_address.ipv4_mapped
+        return ipaddress.ip_network(f"{mapped}/{network.prefixlen - 96}", strict=False)
+    return network
+
+
+def normalize_ip(ip: str) -> str:
+    """规范化IP地址文本（IPv6压缩格式、去除zone id、还原IPv4映射地址），无效输入原样返回"""
+    address = _parse_address(ip) if ip else None
+    return str(address) if address is not None else ip
+
+
+def normalize_entry(entry: str) -> str:
+    """规范化黑名单条目：单个地址保持地址格式，网段统一为 network/prefix 格式"""
+    network = parse_network(entry)
+    if network is None:
+        return entry
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def ban_entry_for_ip(ip: str) -> str:
+    """
+    根据配置的封禁前缀长度，把单个IP转换为封禁条目
+    例如IPv4 /24: 112.82.180.220 -> 112.82.180.0/24；IPv6 /64: 2001:db8::1 -> 2001:db8::/64
+    """
+    address = _parse_address(ip)
+    if address is None:
+        return ip
+    prefix = settings.IP_BAN_PREFIX_V4 if address.version == 4 else settings.IP_BAN_PREFIX_V6
+    return normalize_entry(f"{address}/{prefix}")
+
+
+def candidate_entries(ip: str) -> List[str]:
+    """IP可能命中的黑名单条目（精确地址 + 配置前缀的网段），用于无前缀树时的精确查询"""
+    address = _parse_address(ip)
+    if address is None:
+        return [ip]
+    candidates = [str(address)]
+    subnet_entry = ban_entry_for_ip(str(address))
+    if subnet_entry not in candidates:
+        candidates.append(subnet_entry)
+    if ip not in candidates:
+        candidates.append(ip)
+    return candidates
+
+
+class IPPrefixTrie:
+    """IP前缀树：按位存储网段，查询时沿地址位向下走，遇到封禁终点即命中"""
+
+    __slots__ = ("_roots", "_size")
+
+    def __init__(self, entries: Iterable[str] = ()):
+        self._roots = {4: _new_node(), 6: _new_node()}
+        self._size = 0
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, ip: str) -> bool:
+        return self.contains(ip)
+
+    def add(self, entry: str) -> bool:
+        """添加单个IP或CIDR网段，无效条目返回False"""
+        network = parse_network(entry)
+        if network is None:
+            return False
+
+        node = self._roots[network.version]
+        value = int(network.network_address)
+        bits = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = _new_node()
+            node = child
+
+        if not node[_TERMINAL]:
+            node[_TERMINAL] = True
+            self._size += 1
+        return True
+
+    def remove(self, entry: str) -> bool:
+        """移除单个IP或CIDR网段（仅移除完全相同的条目，不影响包含它的更大网段）"""
+        network = parse_network(entry)
+        if network is None:
+            return False
+
+        node = self._roots[network.version]
+        path = []
+        value = int(network.network_address)
+        bits = network.max_prefixlen
+        for i in range(network.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            path.append((node, bit))
+            node = node[bit]
+            if node is None:
+                return False
+
+        if not node[_TERMINAL]:
+            return False
+        node[_TERMINAL] = False
+        self._size -= 1
+
+        # 回收不再使用的分支
+        for parent, bit in reversed(path):
+            child = parent[bit]
+            if child[_ZERO] is None and child[_ONE] is None and not child[_TERMINAL]:
+                parent[bit] = None
+            else:
+                break
+        return True
+
+    def contains(self, ip: str) -> bool:
+        """判断IP是否落在任一封禁条目内"""
+        address = _parse_address(ip) if ip else None
+        if address is None:
+            return False
+
+        node = self._roots[address.version]
+        if node[_TERMINAL]:
+            return True
+        value = int(address)
+        bits = address.max_prefixlen
+        for i in range(bits):
+            node = node[(value >> (bits - 1 - i)) & 1]
+            if node is None:
+                return False
+            if node[_TERMINAL]:
+                return True
+        return False
@@ -1,6 +1,8 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from models import IPBlacklist, IPAccessLog, AdWatchRecord, User
+from services.money import from_cents
+from services.ip_prefix_trie import candidate_entries, normalize_entry
 from datetime import datetime, date, timedelta
 from typing import List, Optional, Dict
 import json
@@ -45,7 +47,7 @@ class IPService:
 
     @staticmethod
     def is_ip_blocked(db: Session, ip_address: str) -> bool:
-        """检查IP是否被封禁（带Redis缓存）"""
+        """检查IP是否被封禁（带Redis缓存，同时匹配该IP所在的封禁网段）"""
         redis = IPService._get_redis()
         cache_key = f"ip_blocked:{ip_address}"
 
@@ -61,7 +63,7 @@ class IPService:
         # 缓存未命中，查询数据库
         now = datetime.now()
         blocked = db.query(IPBlacklist).filter(
-            IPBlacklist.ip_address == ip_address,
+            IPBlacklist.ip_address.in_(candidate_entries(ip_address)),
             IPBlacklist.is_active == 1,
             or_(
                 IPBlacklist.expire_time.is_(None),
@@ -139,7 +141,9 @@ class IPService:
     def block_ip(db: Session, ip_address: str, reason: str,
                  block_type: str = "manual", duration_hours: int = None,
                  related_user_ids: List[int] = None) -> Dict:
-        """封禁IP"""
+        """封禁IP（支持CIDR网段，如 1.2.3.0/24、2001:db8::/64）"""
+        ip_address = normalize_entry(ip_address)
+
         # 检查是否已存在
         existing = db.query(IPBlacklist).filter(
             IPBlacklist.ip_address == ip_address
@@ -181,6 +185,7 @@ class IPService:
     @staticmethod
     def unblock_ip(db: Session, ip_address: str) -> Dict:
         """解封IP"""
+        ip_address = normalize_entry(ip_address)
         blocked = db.query(IPBlacklist).filter(
             IPBlacklist.ip_address == ip_address
         ).first()
@@ -215,7 +220,7 @@ class IPService:
                 "nickname": u.nickname,
                 "device_id": u.device_id,
                 "device_name": u.device_name,
-                "coins": float(u.coins),
+                "coins": from_cents(u.coins),
                 "register_time": u.register_time.isoformat() if u.register_time else None
             }
             for u in users
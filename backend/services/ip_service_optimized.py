@@ -1,24 +1,36 @@
 """
-IP服务优化版本 - 使用Redis Set存储黑名单，避免数据库查询
+IP服务优化版本 - 使用Redis有序集合存储黑名单（score为过期时间），避免数据库查询
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from models import IPBlacklist, IPAccessLog, AdWatchRecord, User
+from services.ip_prefix_trie import IPPrefixTrie, candidate_entries, normalize_entry
+from services.redis_fallback import RedisUnavailable, guarded_call, redis_breaker
 from datetime import datetime, date, timedelta
 from typing import List, Optional, Dict, Set
+import heapq
 import json
 import logging
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# 永久封禁在有序集合中的score
+PERMANENT = float("inf")
+
 
 class IPServiceOptimized:
     """IP管理服务 - 优化版"""
 
     # Redis键名
     REDIS_KEYS = {
-        "blocked_ips_set": "ip_blacklist:blocked_set",  # 被封禁IP的集合
-        "blocked_ips_sync": "ip_blacklist:last_sync",   # 最后同步时间
+        "blocked_ips_zset": "ip_blacklist:blocked_zset",    # 被封禁IP（score为过期时间戳，永久封禁为+inf）
+        "legacy_blocked_set": "ip_blacklist:blocked_set",   # 旧版Set（全量同步时删除）
+        "blocked_ips_sync": "ip_blacklist:last_sync",       # 最后同步时间
+        "sync_watermark": "ip_blacklist:sync_watermark",    # 增量同步水位（已同步到的最大updated_time）
+        "blocked_ips_channel": "ip_blacklist:events",       # 黑名单变更通知频道
     }
 
     # 缓存TTL配置
@@ -27,6 +39,21 @@ class IPServiceOptimized:
         "sync_interval": 60,    # 黑名单同步间隔60秒
     }
 
+    # 同步配置
+    SYNC_BATCH_SIZE = 1000          # 全量同步每批写入条数
+    BUILD_KEY_TTL = 600             # 全量同步临时键的过期时间（同步中断时自动清理）
+    DELTA_OVERLAP_SECONDS = 5       # 增量同步回看时间，容忍事务提交与时间戳的先后偏差
+    DELTA_RELOAD_THRESHOLD = 200    # 增量变更超过该数量时通知全量重载，而不是逐条广播
+
+    # 进程内黑名单快照（每个worker一份，由订阅线程维护；前缀树支持CIDR网段匹配）
+    _local_blocked: IPPrefixTrie = IPPrefixTrie()
+    _local_expiry: Dict[str, float] = {}     # 条目 -> 过期时间戳（仅有期限的封禁）
+    _local_expiry_heap: List = []            # (过期时间戳, 条目)，按到期先后弹出
+    _local_lock = threading.Lock()           # 保护快照的写操作（读操作无需加锁）
+    _local_ready = False          # 快照是否可用（订阅断开时置为False，回退到Redis）
+    _listener_thread: Optional[threading.Thread] = None
+    _listener_lock = threading.Lock()
+
     @staticmethod
     def _get_redis():
         """获取Redis客户端"""
@@ -36,76 +63,347 @@ class IPServiceOptimized:
         except Exception:
             return None
 
+    @staticmethod
+    def _expire_score(expire_time: Optional[datetime]) -> float:
+        """过期时间转换为有序集合score"""
+        return expire_time.timestamp() if expire_time else PERMANENT
+
+    @staticmethod
+    def _ban_score(ban_duration: Optional[int]) -> float:
+        """封禁时长（秒）转换为有序集合score，None表示永久"""
+        return time.time() + ban_duration if ban_duration else PERMANENT
+
+    @staticmethod
+    def _is_blocked_by_scores(scores) -> bool:
+        """候选条目的score中任一未过期即为封禁"""
+        now = time.time()
+        return any(score is not None and float(score) > now for score in scores)
+
+    @staticmethod
+    def _change_message(action: str, ip_address: str = "", score: float = PERMANENT) -> str:
+        """变更通知格式: add:<条目> <过期时间戳> / remove:<条目> / reload:"""
+        if action == "add" and score != PERMANENT:
+            return f"add:{ip_address} {score}"
+        return f"{action}:{ip_address}"
+
+    @staticmethod
+    def _publish_change(redis, action: str, ip_address: str = "", score: float = PERMANENT):
+        """广播黑名单变更（add/remove/reload），各worker据此更新本地快照"""
+        try:
+            redis.publish(
+                IPServiceOptimized.REDIS_KEYS["blocked_ips_channel"],
+                IPServiceOptimized._change_message(action, ip_address, score)
+            )
+        except Exception as e:
+            logger.warning(f"广播黑名单变更失败: {e}")
+
+    @staticmethod
+    def _local_add(ip_address: str, score: float = PERMANENT):
+        """本地快照添加条目，有期限的封禁同时登记到期时间"""
+        with IPServiceOptimized._local_lock:
+            IPServiceOptimized._local_blocked.add(ip_address)
+            if score == PERMANENT:
+                IPServiceOptimized._local_expiry.pop(ip_address, None)
+            else:
+                IPServiceOptimized._local_expiry[ip_address] = score
+                heapq.heappush(IPServiceOptimized._local_expiry_heap, (score, ip_address))
+
+    @staticmethod
+    def _local_remove(ip_address: str):
+        """本地快照移除条目"""
+        with IPServiceOptimized._local_lock:
+            IPServiceOptimized._local_blocked.remove(ip_address)
+            IPServiceOptimized._local_expiry.pop(ip_address, None)
+
+    @staticmethod
+    def _expire_local_entries(now: float = None) -> int:
+        """按到期顺序移除本地快照中已过期的条目，返回移除数量"""
+        now = time.time() if now is None else now
+        heap = IPServiceOptimized._local_expiry_heap
+        removed = 0
+        if not heap or heap[0][0] > now:
+            return 0
+        with IPServiceOptimized._local_lock:
+            while heap and heap[0][0] <= now:
+                score, entry = heapq.heappop(heap)
+                # 条目被续期或改为永久后，旧的到期记录作废
+                if IPServiceOptimized._local_expiry.get(entry) == score:
+                    del IPServiceOptimized._local_expiry[entry]
+                    IPServiceOptimized._local_blocked.remove(entry)
+                    removed += 1
+        return removed
+
+    @staticmethod
+    def _reload_local_snapshot(redis):
+        """从Redis有序集合全量加载未过期条目到本地快照（整体替换引用，读取方无需加锁）"""
+        now = time.time()
+        members = redis.zrangebyscore(
+            IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"], now, "+inf", withscores=True
+        )
+        trie = IPPrefixTrie()
+        expiry = {}
+        for member, score in members:
+            if isinstance(member, bytes):
+                member = member.decode()
+            trie.add(member)
+            if score != PERMANENT:
+                expiry[member] = score
+        heap = [(score, member) for member, score in expiry.items()]
+        heapq.heapify(heap)
+
+        with IPServiceOptimized._local_lock:
+            IPServiceOptimized._local_blocked = trie
+            IPServiceOptimized._local_expiry = expiry
+            IPServiceOptimized._local_expiry_heap = heap
+        IPServiceOptimized._local_ready = True
+
+    @staticmethod
+    def _apply_change(message: str, redis):
+        """应用一条变更通知到本地快照"""
+        action, _, payload = message.partition(":")
+        ip_address, _, score = payload.partition(" ")
+        if action == "add" and ip_address:
+            IPServiceOptimized._local_add(ip_address, float(score) if score else PERMANENT)
+        elif action == "remove" and ip_address:
+            IPServiceOptimized._local_remove(ip_address)
+        else:
+            IPServiceOptimized._reload_local_snapshot(redis)
+
+    @staticmethod
+    def _listen_blacklist_changes():
+        """订阅线程：先订阅再全量加载，之后按通知增量更新、按到期时间移除；断线后自动重连"""
+        channel = IPServiceOptimized.REDIS_KEYS["blocked_ips_channel"]
+        interval = IPServiceOptimized.CACHE_TTL["sync_interval"]
+
+        while True:
+            redis = IPServiceOptimized._get_redis()
+            pubsub = None
+            try:
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                IPServiceOptimized._reload_local_snapshot(redis)
+                last_reload = time.time()
+                logger.info(f"✅ 本地黑名单快照已加载: {len(IPServiceOptimized._local_blocked)}个IP")
+
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        data = message["data"]
+                        if isinstance(data, bytes):
+                            data = data.decode()
+                        IPServiceOptimized._apply_change(data, redis)
+
+                    # 到期的封禁按时移除（最多延迟1秒）
+                    IPServiceOptimized._expire_local_entries()
+
+                    # 兜底：定期全量校准，防止丢失通知导致快照漂移
+                    if time.time() - last_reload > interval:
+                        IPServiceOptimized._reload_local_snapshot(redis)
+                        last_reload = time.time()
+
+            except Exception as e:
+                IPServiceOptimized._local_ready = False
+                logger.warning(f"黑名单订阅中断，回退到Redis查询: {e}")
+                time.sleep(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    @staticmethod
+    def start_blacklist_listener():
+        """启动本地黑名单快照的订阅线程（每个进程只启动一次）"""
+        with IPServiceOptimized._listener_lock:
+            thread = IPServiceOptimized._listener_thread
+            if thread is not None and thread.is_alive():
+                return
+            if not IPServiceOptimized._get_redis():
+                return
+            thread = threading.Thread(
+                target=IPServiceOptimized._listen_blacklist_changes,
+                name="ip-blacklist-listener",
+                daemon=True
+            )
+            thread.start()
+            IPServiceOptimized._listener_thread = thread
+
     @staticmethod
     def sync_blocked_ips_to_redis(db: Session) -> int:
         """
-        从数据库同步被封禁IP到Redis Set
+        从数据库全量同步被封禁IP到Redis有序集合
+        先分批写入临时键，再用RENAME原子替换正式键，替换前后都有完整的黑名单，不存在放行窗口
         返回：同步的IP数量
         """
         redis = IPServiceOptimized._get_redis()
         if not redis:
             return 0
 
+        zset_key = IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"]
+        build_key = f"{zset_key}:building:{uuid.uuid4().hex}"
+
         try:
-            # 查询所有活跃的封禁IP
+            # 先取水位再读数据：读取期间发生的变更会在下次增量同步中补上
+            watermark = db.query(func.max(IPBlacklist.updated_time)).scalar()
+
+            # 查询所有活跃的封禁IP（同一网段多条记录取最晚的过期时间）
             now = datetime.now()
-            blocked_ips = db.query(IPBlacklist.ip_address).filter(
+            query = db.query(IPBlacklist.ip_address, IPBlacklist.expire_time).filter(
                 IPBlacklist.is_active == 1,
                 or_(
                     IPBlacklist.expire_time.is_(None),
                     IPBlacklist.expire_time > now
                 )
-            ).all()
-
-            # 提取IP地址列表
-            ip_list = [ip[0] for ip in blocked_ips]
+            )
+            entries: Dict[str, float] = {}
+            for ip_address, expire_time in query.yield_per(IPServiceOptimized.SYNC_BATCH_SIZE):
+                entry = normalize_entry(ip_address)
+                entries[entry] = max(entries.get(entry, 0), IPServiceOptimized._expire_score(expire_time))
 
-            # 清空旧的集合
-            redis.delete(IPServiceOptimized.REDIS_KEYS["blocked_ips_set"])
+            # 分批写入临时键（每批一次往返，避免单条超大命令阻塞Redis）
+            items = list(entries.items())
+            batch_size = IPServiceOptimized.SYNC_BATCH_SIZE
+            for start in range(0, len(items), batch_size):
+                pipe = redis.pipeline(transaction=False)
+                pipe.zadd(build_key, dict(items[start:start + batch_size]))
+                pipe.expire(build_key, IPServiceOptimized.BUILD_KEY_TTL)
+                pipe.execute()
 
-            # 批量添加到Redis Set
-            if ip_list:
-                redis.sadd(IPServiceOptimized.REDIS_KEYS["blocked_ips_set"], *ip_list)
+            # 原子替换正式键，同时更新水位和同步时间
+            pipe = redis.pipeline(transaction=True)
+            if items:
+                pipe.rename(build_key, zset_key)
+                pipe.persist(zset_key)
+            else:
+                pipe.delete(zset_key)
+            pipe.delete(IPServiceOptimized.REDIS_KEYS["legacy_blocked_set"])
+            if watermark:
+                pipe.set(IPServiceOptimized.REDIS_KEYS["sync_watermark"], watermark.isoformat())
+            pipe.set(IPServiceOptimized.REDIS_KEYS["blocked_ips_sync"], datetime.now().isoformat())
+            pipe.execute()
 
-            # 记录最后同步时间
-            redis.set(
-                IPServiceOptimized.REDIS_KEYS["blocked_ips_sync"],
-                datetime.now().isoformat()
-            )
+            # 通知各worker重新加载本地快照
+            IPServiceOptimized._publish_change(redis, "reload")
 
-            logger.info(f"✅ 同步{len(ip_list)}个封禁IP到Redis")
-            return len(ip_list)
+            logger.info(f"✅ 全量同步{len(items)}个封禁IP到Redis")
+            return len(items)
 
         except Exception as e:
             logger.error(f"❌ 同步封禁IP到Redis失败: {e}")
+            try:
+                redis.delete(build_key)
+            except Exception:
+                pass
+            return 0
+
+    @staticmethod
+    def sync_blacklist_delta(db: Session) -> int:
+        """
+        增量同步：只读取updated_time晚于上次水位的记录，逐条更新Redis有序集合，并清理已过期的条目
+        多条记录可能规范化为同一条目（如 1.2.3.4/24 与 1.2.3.0/24），某条记录失效时，
+        先重新查询仍然有效的记录（取最晚的过期时间），该条目还有有效记录时更新而不移除
+        尚无水位（从未全量同步）时执行一次全量同步
+        返回：变更的条目数量
+        """
+        redis = IPServiceOptimized._get_redis()
+        if not redis:
+            return 0
+
+        watermark = redis.get(IPServiceOptimized.REDIS_KEYS["sync_watermark"])
+        if not watermark:
+            return IPServiceOptimized.sync_blocked_ips_to_redis(db)
+
+        try:
+            since = datetime.fromisoformat(watermark) - timedelta(seconds=IPServiceOptimized.DELTA_OVERLAP_SECONDS)
+            rows = db.query(
+                IPBlacklist.ip_address,
+                IPBlacklist.is_active,
+                IPBlacklist.expire_time,
+                IPBlacklist.updated_time
+            ).filter(
+                IPBlacklist.updated_time >= since
+            ).order_by(IPBlacklist.updated_time).all()
+
+            now = datetime.now()
+            adds: Dict[str, float] = {}
+            removes: Set[str] = set()
+            new_watermark = None
+            for ip_address, is_active, expire_time, updated_time in rows:
+                entry = normalize_entry(ip_address)
+                if is_active == 1 and (expire_time is None or expire_time > now):
+                    adds[entry] = max(adds.get(entry, 0), IPServiceOptimized._expire_score(expire_time))
+                    removes.discard(entry)
+                else:
+                    removes.add(entry)
+                    adds.pop(entry, None)
+                new_watermark = updated_time
+
+            if removes:
+                # 要移除的条目可能还有其他有效记录（原始文本不同，规范化后相同），改为按这些记录更新
+                active = db.query(IPBlacklist.ip_address, IPBlacklist.expire_time).filter(
+                    IPBlacklist.is_active == 1,
+                    or_(
+                        IPBlacklist.expire_time.is_(None),
+                        IPBlacklist.expire_time > now
+                    )
+                )
+                for ip_address, expire_time in active.yield_per(IPServiceOptimized.SYNC_BATCH_SIZE):
+                    entry = normalize_entry(ip_address)
+                    if entry in removes or entry in adds:
+                        adds[entry] = max(adds.get(entry, 0), IPServiceOptimized._expire_score(expire_time))
+                removes.difference_update(adds)
+
+            zset_key = IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"]
+            channel = IPServiceOptimized.REDIS_KEYS["blocked_ips_channel"]
+            broadcast_each = len(adds) + len(removes) <= IPServiceOptimized.DELTA_RELOAD_THRESHOLD
+
+            pipe = redis.pipeline(transaction=True)
+            if adds:
+                pipe.zadd(zset_key, adds)
+            if removes:
+                pipe.zrem(zset_key, *removes)
+            pipe.zremrangebyscore(zset_key, "-inf", time.time())
+            if new_watermark:
+                pipe.set(IPServiceOptimized.REDIS_KEYS["sync_watermark"], new_watermark.isoformat())
+            pipe.set(IPServiceOptimized.REDIS_KEYS["blocked_ips_sync"], datetime.now().isoformat())
+            if broadcast_each:
+                for entry, score in adds.items():
+                    pipe.publish(channel, IPServiceOptimized._change_message("add", entry, score))
+                for entry in removes:
+                    pipe.publish(channel, IPServiceOptimized._change_message("remove", entry))
+            elif adds or removes:
+                pipe.publish(channel, IPServiceOptimized._change_message("reload"))
+            pipe.execute()
+
+            if adds or removes:
+                logger.info(f"✅ 增量同步黑名单: 新增/更新{len(adds)}个, 移除{len(removes)}个")
+            return len(adds) + len(removes)
+
+        except Exception as e:
+            logger.error(f"❌ 增量同步黑名单失败: {e}")
             return 0
 
     @staticmethod
     def is_ip_blocked_fast(ip_address: str, db: Session = None) -> bool:
         """
-        快速检查IP是否被封禁（纯Redis，不查数据库）
-        如果Redis不可用，降级到数据库查询
+        快速检查IP是否被封禁（支持CIDR网段条目）
+        优先查进程内前缀树快照（零网络往返）；快照不可用时查Redis有序集合；
+        Redis也不可用时降级到数据库查询
         """
+        if IPServiceOptimized._local_ready:
+            return IPServiceOptimized._local_blocked.contains(ip_address)
+
         redis = IPServiceOptimized._get_redis()
+        candidates = candidate_entries(ip_address)
 
-        # 如果Redis可用，直接查Redis Set
+        # 快照未就绪（订阅线程未启动或断线），查Redis（精确地址 + 配置前缀网段，一次往返，score未过期才算封禁）
         if redis:
             try:
-                # 检查是否需要同步（每60秒同步一次）
-                last_sync = redis.get(IPServiceOptimized.REDIS_KEYS["blocked_ips_sync"])
-                if not last_sync or (
-                    datetime.now() - datetime.fromisoformat(last_sync.decode() if isinstance(last_sync, bytes) else last_sync)
-                ).total_seconds() > IPServiceOptimized.CACHE_TTL["sync_interval"]:
-                    # 需要同步，但不在这里执行（避免阻塞）
-                    # 可以用后台任务或启动时同步
-                    pass
-
-                # 检查IP是否在黑名单集合中
-                is_blocked = redis.sismember(
-                    IPServiceOptimized.REDIS_KEYS["blocked_ips_set"],
-                    ip_address
-                )
-                return bool(is_blocked)
+                pipe = redis.pipeline(transaction=False)
+                for entry in candidates:
+                    pipe.zscore(IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"], entry)
+                return IPServiceOptimized._is_blocked_by_scores(pipe.execute())
 
             except Exception as e:
                 logger.warning(f"Redis检查IP失败，降级到数据库: {e}")
@@ -114,7 +412,7 @@ class IPServiceOptimized:
         if db:
             now = datetime.now()
             blocked = db.query(IPBlacklist).filter(
-                IPBlacklist.ip_address == ip_address,
+                IPBlacklist.ip_address.in_(candidates),
                 IPBlacklist.is_active == 1,
                 or_(
                     IPBlacklist.expire_time.is_(None),
@@ -126,40 +424,92 @@ class IPServiceOptimized:
         return False
 
     @staticmethod
-    def add_ip_to_blacklist_fast(ip_address: str):
-        """快速添加IP到Redis黑名单（不查数据库）"""
+    async def is_ip_blocked_async(ip_address: str) -> bool:
+        """
+        异步版快速检查（供ASGI中间件使用，不阻塞事件循环）
+        快照就绪时不访问网络；否则通过异步Redis一次往返查询；
+        Redis熔断或失败时使用最近一次的本地快照（可能略旧，但不会整体失去黑名单保护）
+        """
+        if IPServiceOptimized._local_ready:
+            return IPServiceOptimized._local_blocked.contains(ip_address)
+
+        async def query():
+            from database import async_redis_client
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                for entry in candidate_entries(ip_address):
+                    pipe.zscore(IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"], entry)
+                return IPServiceOptimized._is_blocked_by_scores(await pipe.execute())
+
+        try:
+            return await guarded_call(redis_breaker, query)
+        except RedisUnavailable:
+            return IPServiceOptimized._local_blocked.contains(ip_address)
+
+    @staticmethod
+    def add_ip_to_blacklist_fast(ip_address: str, ban_duration: int = None):
+        """快速添加IP或CIDR网段到Redis黑名单（不查数据库），ban_duration为None表示永久"""
+        ip_address = normalize_entry(ip_address)
+        score = IPServiceOptimized._ban_score(ban_duration)
         redis = IPServiceOptimized._get_redis()
         if redis:
             try:
-                redis.sadd(
-                    IPServiceOptimized.REDIS_KEYS["blocked_ips_set"],
-                    ip_address
+                redis.zadd(
+                    IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"],
+                    {ip_address: score}
                 )
+                IPServiceOptimized._local_add(ip_address, score)
+                IPServiceOptimized._publish_change(redis, "add", ip_address, score)
                 logger.info(f"✅ 添加{ip_address}到Redis黑名单")
             except Exception as e:
                 logger.error(f"❌ 添加IP到Redis黑名单失败: {e}")
 
+    @staticmethod
+    async def add_ip_to_blacklist_async(ip_address: str, ban_duration: int = None):
+        """
+        异步添加IP或CIDR网段到Redis黑名单并广播（供ASGI中间件使用，一次往返）
+        先写本地快照，Redis不可用时抛出RedisUnavailable，封禁仅在本worker生效
+        """
+        ip_address = normalize_entry(ip_address)
+        score = IPServiceOptimized._ban_score(ban_duration)
+        IPServiceOptimized._local_add(ip_address, score)
+
+        async def publish():
+            from database import async_redis_client
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                pipe.zadd(IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"], {ip_address: score})
+                pipe.publish(
+                    IPServiceOptimized.REDIS_KEYS["blocked_ips_channel"],
+                    IPServiceOptimized._change_message("add", ip_address, score)
+                )
+                await pipe.execute()
+
+        await guarded_call(redis_breaker, publish)
+        logger.info(f"✅ 添加{ip_address}到Redis黑名单")
+
     @staticmethod
     def remove_ip_from_blacklist_fast(ip_address: str):
-        """快速从Redis黑名单移除IP"""
+        """快速从Redis黑名单移除IP或CIDR网段"""
+        ip_address = normalize_entry(ip_address)
         redis = IPServiceOptimized._get_redis()
         if redis:
             try:
-                redis.srem(
-                    IPServiceOptimized.REDIS_KEYS["blocked_ips_set"],
+                redis.zrem(
+                    IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"],
                     ip_address
                 )
+                IPServiceOptimized._local_remove(ip_address)
+                IPServiceOptimized._publish_change(redis, "remove", ip_address)
                 logger.info(f"✅ 从Redis黑名单移除{ip_address}")
             except Exception as e:
                 logger.error(f"❌ 从Redis黑名单移除IP失败: {e}")
 
     @staticmethod
     def get_blocked_ips_count() -> int:
-        """获取当前封禁IP数量"""
+        """获取当前封禁IP数量（不含已过期未清理的条目）"""
         redis = IPServiceOptimized._get_redis()
         if redis:
             try:
-                return redis.scard(IPServiceOptimized.REDIS_KEYS["blocked_ips_set"])
+                return redis.zcount(IPServiceOptimized.REDIS_KEYS["blocked_ips_zset"], time.time(), "+inf")
             except Exception:
                 pass
         return 0
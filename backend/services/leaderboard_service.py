@@ -0,0 +1,464 @@
+"""
+游戏排行榜 - Redis有序集合按用户保存最高分，提交游戏时增量更新（ZADD GT，只升不降）
+- 总榜：leaderboard:all
+- 日榜：leaderboard:day:{YYYYMMDD}；小时榜：leaderboard:hour:{YYYYMMDDHH}，都保留32天
+- 周榜/月榜：滚动窗口（最近7×24 / 30×24小时，与原先按 now - 7天/30天 过滤一致，精确到小时）：
+  窗口内的完整日榜 + 窗口起点所在那天从当前小时起的小时榜，按最高分合并（ZUNIONSTORE AGGREGATE MAX）
+  成当前小时的物化榜单，每小时首次读取时构建一次，之后随提交增量更新，一小时后过期
+读取榜单为 O(log N + k)，与游戏记录数量无关；玩家昵称/等级等展示字段通过资料缓存批量获取
+
+Redis中的榜单在应用启动时检查并从数据库重建；运行中Redis被清空（或重建标记被淘汰）时，
+读取榜单发现标记缺失会触发后台重建。重建完成前及Redis不可用时直接查询数据库
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, desc
+from models import GameRecord
+from services.user_profile_cache import UserProfileCache
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 记录一次得分（原子执行）
+# KEYS[1]: 总榜  KEYS[2]: 日榜  KEYS[3]: 当前小时周榜  KEYS[4]: 当前小时月榜  KEYS[5]: 最近游戏时间哈希
+# KEYS[6..9]: KEYS[1..4]对应的榜单版本号  KEYS[10]: 小时榜
+# ARGV[1]: 用户ID  ARGV[2]: 分数  ARGV[3]: 日榜/小时榜过期秒数  ARGV[4]: 游戏时间  ARGV[5]: 前N名范围
+# 周榜/月榜只在已构建时更新，避免产生不完整且没有过期时间的榜单；
+# 分数变化且位于前N名时递增该榜单版本号（榜单快照据此刷新）
+RECORD_LUA = """
+for i = 1, 4 do
+    if i <= 2 or redis.call('EXISTS', KEYS[i]) == 1 then
+        local changed = redis.call('ZADD', KEYS[i], 'GT', 'CH', ARGV[2], ARGV[1])
+        if changed == 1 and redis.call('ZREVRANK', KEYS[i], ARGV[1]) < tonumber(ARGV[5]) then
+            redis.call('INCR', KEYS[i + 5])
+            redis.call('EXPIRE', KEYS[i + 5], ARGV[3])
+        end
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[10], 'GT', ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[10], ARGV[3])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[4])
+return 1
+"""
+
+
+class LeaderboardService:
+    """游戏排行榜"""
+
+    PERIODS = ("all", "today", "week", "month")
+    ROLLING_DAYS = {"week": 7, "month": 30}   # 周榜/月榜的滚动窗口天数（最近N×24小时）
+
+    # Redis键名
+    KEY_PREFIX = "leaderboard"
+    REDIS_KEYS = {
+        "all": "leaderboard:all",
+        "last_play": "leaderboard:last_play",        # 用户最近一次游戏时间
+        "built": "leaderboard:built",                # 已从数据库重建的标记
+        "rebuild_lock": "leaderboard:rebuild_lock",
+    }
+
+    TOP_N = 100                   # 榜单接口最多返回的名次（前N名变化时递增榜单版本号）
+    DAY_TTL = 32 * 86400          # 日榜/小时榜保留天数需覆盖月榜窗口（含窗口起点所在的那天）
+    REBUILD_LOCK_TTL = 600
+    REBUILD_BATCH_SIZE = 1000
+    REBUILD_RETRY_INTERVAL = 30   # 读取时发现未重建，每个worker触发后台重建的最小间隔（秒）
+
+    _script = None
+    _rebuild_thread: Optional[threading.Thread] = None
+    _rebuild_requested_at = 0.0
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _day_key(day: date) -> str:
+        return f"{LeaderboardService.KEY_PREFIX}:day:{day.strftime('%Y%m%d')}"
+
+    @staticmethod
+    def _hour_key(moment: datetime) -> str:
+        return f"{LeaderboardService.KEY_PREFIX}:hour:{moment.strftime('%Y%m%d%H')}"
+
+    @staticmethod
+    def _rolling_key(period: str, moment: datetime) -> str:
+        """周榜/月榜在某个小时的物化榜单"""
+        return f"{LeaderboardService.KEY_PREFIX}:{period}:{moment.strftime('%Y%m%d%H')}"
+
+    @staticmethod
+    def _rolling_sources(period: str, moment: datetime) -> List[str]:
+        """
+        滚动窗口 [当前小时 - N天, 现在] 的来源榜单：
+        窗口内的完整日榜（今天及之前N-1天）+ 窗口起点那天从当前小时到23点的小时榜
+        """
+        days = LeaderboardService.ROLLING_DAYS[period]
+        today = moment.date()
+        sources = [LeaderboardService._day_key(today - timedelta(days=offset)) for offset in range(days)]
+        start = datetime.combine(today - timedelta(days=days), dt_time(moment.hour))
+        sources += [LeaderboardService._hour_key(start + timedelta(hours=offset))
+                    for offset in range(24 - moment.hour)]
+        return sources
+
+    @staticmethod
+    def _version_key(board_key: str) -> str:
+        return f"{board_key}:ver"
+
+    @staticmethod
+    def _period_key(redis, period: str, now: datetime) -> str:
+        """获取榜单键；周榜/月榜当前小时未构建时由日榜和小时榜合并构建"""
+        if period == "all":
+            return LeaderboardService.REDIS_KEYS["all"]
+        if period == "today":
+            return LeaderboardService._day_key(now.date())
+
+        key = LeaderboardService._rolling_key(period, now)
+        if not redis.exists(key):
+            sources = LeaderboardService._rolling_sources(period, now)
+            expire_at = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1, minutes=10)
+            pipe = redis.pipeline()
+            pipe.zunionstore(key, sources, aggregate="MAX")
+            pipe.expireat(key, expire_at)
+            pipe.execute()
+        return key
+
+    @staticmethod
+    def board_version(period: str) -> Optional[str]:
+        """
+        榜单当前版本（榜单键 + 版本号，前N名变化或跨天时改变；周榜/月榜的窗口每小时滑动，每小时改变）
+        榜单尚未重建或Redis不可用时返回None
+        """
+        redis = LeaderboardService._get_redis()
+        if not redis:
+            return None
+        now = datetime.now()
+        board_key = {"all": LeaderboardService.REDIS_KEYS["all"], "today": LeaderboardService._day_key(now.date())}.get(
+            period) or LeaderboardService._rolling_key(period, now)
+        try:
+            built, version = redis.mget(LeaderboardService.REDIS_KEYS["built"],
+                                        LeaderboardService._version_key(board_key))
+        except Exception as e:
+            logger.warning(f"读取排行榜版本失败: {e}")
+            return None
+        return f"{board_key}#{version or 0}" if built else None
+
+    @staticmethod
+    def record_score(user_id: int, score: int, play_time: datetime = None):
+        """提交游戏后更新各榜单（一次Redis往返，失败只记录日志）"""
+        redis = LeaderboardService._get_redis()
+        if not redis:
+            return
+        play_time = play_time or datetime.now()
+        try:
+            if LeaderboardService._script is None:
+                LeaderboardService._script = redis.register_script(RECORD_LUA)
+            boards = [
+                LeaderboardService.REDIS_KEYS["all"],
+                LeaderboardService._day_key(play_time.date()),
+                LeaderboardService._rolling_key("week", play_time),
+                LeaderboardService._rolling_key("month", play_time),
+            ]
+            LeaderboardService._script(
+                keys=boards + [LeaderboardService.REDIS_KEYS["last_play"]]
+                + [LeaderboardService._version_key(board) for board in boards]
+                + [LeaderboardService._hour_key(play_time)],
+                args=[user_id, score, LeaderboardService.DAY_TTL, play_time.isoformat(), LeaderboardService.TOP_N]
+            )
+        except Exception as e:
+            logger.error(f"更新排行榜失败: 用户{user_id} 分数{score}: {e}")
+
+    @staticmethod
+    def _top_from_redis(redis, period: str, limit: int) -> Optional[List[Tuple[int, int, Optional[str]]]]:
+        """从Redis读取前limit名：[(用户ID, 最高分, 最近游戏时间)]；榜单尚未重建时返回None"""
+        if not redis.exists(LeaderboardService.REDIS_KEYS["built"]):
+            LeaderboardService._request_rebuild()
+            return None
+        key = LeaderboardService._period_key(redis, period, datetime.now())
+        entries = redis.zrevrange(key, 0, limit - 1, withscores=True)
+        if not entries:
+            return []
+        user_ids = [int(member) for member, _ in entries]
+        latest = redis.hmget(LeaderboardService.REDIS_KEYS["last_play"], user_ids)
+        return [(user_id, int(score), latest_play)
+                for user_id, (_, score), latest_play in zip(user_ids, entries, latest)]
+
+    @staticmethod
+    def _top_from_db(db: Session, period: str, limit: int) -> List[Tuple[int, int, Optional[str]]]:
+        """直接从游戏记录统计（Redis不可用或榜单重建前使用）"""
+        query = db.query(
+            GameRecord.user_id,
+            func.max(GameRecord.score).label('best_score'),
+            func.max(GameRecord.play_time).label('latest_play')
+        )
+        if period == "today":
+            query = query.filter(GameRecord.play_time >= datetime.combine(date.today(), dt_time.min))
+        elif period != "all":
+            since = datetime.now() - timedelta(days=LeaderboardService.ROLLING_DAYS[period])
+            query = query.filter(GameRecord.play_time >= since)
+        rows = query.group_by(GameRecord.user_id).order_by(desc('best_score')).limit(limit).all()
+        return [(user_id, best_score, latest_play.isoformat() if latest_play else None)
+                for user_id, best_score, latest_play in rows]
+
+    @staticmethod
+    def get_leaderboard(db: Session, period: str = "all", limit: int = 50) -> List[Dict]:
+        """
+        获取排行榜前limit名
+        返回：[{"rank", "user_id", "nickname", "best_score", "latest_play", "level", "game_count", "coins"（分）}]
+        """
+        if period not in LeaderboardService.PERIODS:
+            period = "all"
+
+        top = None
+        redis = LeaderboardService._get_redis()
+        if redis:
+            try:
+                top = LeaderboardService._top_from_redis(redis, period, limit)
+            except Exception as e:
+                logger.warning(f"读取排行榜失败，改为查询数据库: {e}")
+        if top is None:
+            top = LeaderboardService._top_from_db(db, period, limit)
+
+        profiles = UserProfileCache.get_many(db, [user_id for user_id, _, _ in top])
+        result = []
+        for rank, (user_id, best_score, latest_play) in enumerate(top, 1):
+            profile = profiles.get(user_id)
+            result.append({
+                "rank": rank,
+                "user_id": user_id,
+                "nickname": (profile.nickname if profile else None) or f"用户{user_id}",
+                "best_score": best_score,
+                "latest_play": latest_play,
+                "level": profile.level if profile else 1,
+                "game_count": profile.game_count if profile else 0,
+                "coins": profile.coins if profile else 0
+            })
+        return result
+
+    @staticmethod
+    def get_around(db: Session, user_id: int, periods=PERIODS, k: int = 5) -> Optional[Dict[str, Dict]]:
+        """
+        获取玩家在各榜单中的名次、百分位和前后各k名玩家（每个榜单 O(log N + k)，不查询游戏记录）
+        名次按竞赛排名（同分同名次 = 分数更高的人数 + 1）；
+        百分位为百分位秩：(分数更低的人数 + 同分人数/2) / 榜单人数 × 100
+        返回：{榜单: {"rank", "best_score", "percentile", "total", "neighbors"}}，未上榜时rank为None；
+        Redis不可用或榜单尚未重建时返回None（不回退到数据库统计）
+        """
+        redis = LeaderboardService._get_redis()
+        if not redis:
+            return None
+        try:
+            if not redis.exists(LeaderboardService.REDIS_KEYS["built"]):
+                LeaderboardService._request_rebuild()
+                return None
+            now = datetime.now()
+            keys = {period: LeaderboardService._period_key(redis, period, now) for period in periods}
+
+            pipe = redis.pipeline(transaction=False)
+            for key in keys.values():
+                pipe.zscore(key, user_id)
+                pipe.zrevrank(key, user_id)
+                pipe.zcard(key)
+            first = pipe.execute()
+
+            positions = {}
+            for index, period in enumerate(keys):
+                score, position, total = first[index * 3:index * 3 + 3]
+                positions[period] = (score, position, total)
+                if score is None:
+                    continue
+                key = keys[period]
+                pipe.zcount(key, f"({score}", "+inf")
+                pipe.zcount(key, "-inf", f"({score}")
+                pipe.zrevrange(key, max(0, position - k), position + k, withscores=True)
+            second = iter(pipe.execute())
+        except Exception as e:
+            logger.warning(f"读取玩家排名失败: {e}")
+            return None
+
+        result = {}
+        windows = {}
+        for period, (score, position, total) in positions.items():
+            if score is None:
+                result[period] = {"rank": None, "best_score": None, "percentile": None,
+                                  "total": total, "neighbors": []}
+                continue
+            higher, lower, window = next(second), next(second), next(second)
+            equal = total - higher - lower
+            result[period] = {
+                "rank": higher + 1,
+                "best_score": int(score),
+                "percentile": round((lower + equal / 2) / total * 100, 2),
+                "total": total,
+                "neighbors": []
+            }
+            windows[period] = (max(0, position - k), window)
+
+        # 窗口第一名的名次需要统计分数更高的人数（与本人同分或位于榜首时可直接得出）
+        first_ranks = {}
+        pending = []
+        for period, (start, window) in windows.items():
+            first_score = window[0][1] if window else None
+            if start == 0:
+                first_ranks[period] = 1
+            elif first_score == result[period]["best_score"]:
+                first_ranks[period] = result[period]["rank"]
+            else:
+                pending.append((period, first_score))
+        if pending:
+            try:
+                pipe = redis.pipeline(transaction=False)
+                for period, first_score in pending:
+                    pipe.zcount(keys[period], f"({first_score}", "+inf")
+                for (period, _), higher in zip(pending, pipe.execute()):
+                    first_ranks[period] = higher + 1
+            except Exception as e:
+                logger.warning(f"读取排名失败: {e}")
+                return None
+
+        profiles = UserProfileCache.get_many(
+            db, [int(member) for _, window in windows.values() for member, _ in window]
+        )
+        for period, (start, window) in windows.items():
+            neighbors = result[period]["neighbors"]
+            for offset, (member, score) in enumerate(window):
+                score = int(score)
+                if offset == 0:
+                    rank = first_ranks[period]
+                elif neighbors[-1]["best_score"] == score:
+                    rank = neighbors[-1]["rank"]   # 同分同名次
+                else:
+                    rank = start + offset + 1
+                member = int(member)
+                profile = profiles.get(member)
+                neighbors.append({
+                    "rank": rank,
+                    "user_id": member,
+                    "nickname": (profile.nickname if profile else None) or f"用户{member}",
+                    "best_score": score,
+                    "level": profile.level if profile else 1,
+                    "is_me": member == user_id
+                })
+        return result
+
+    @staticmethod
+    def start_rebuild():
+        """后台线程中检查并重建榜单（应用启动时调用，不阻塞启动）"""
+        def run():
+            from database import SessionLocal
+            db = SessionLocal()
+            try:
+                LeaderboardService.rebuild(db)
+            finally:
+                db.close()
+
+        thread = threading.Thread(target=run, name="leaderboard-rebuild", daemon=True)
+        LeaderboardService._rebuild_thread = thread
+        thread.start()
+
+    @staticmethod
+    def _request_rebuild():
+        """
+        读取时发现榜单未重建（Redis被清空或重建标记被淘汰）：触发后台重建
+        本worker的重建线程仍在运行或距上次触发不足 REBUILD_RETRY_INTERVAL 秒时跳过；多个worker由重建锁保证只执行一次
+        """
+        thread = LeaderboardService._rebuild_thread
+        if thread is not None and thread.is_alive():
+            return
+        now = time.monotonic()
+        if now - LeaderboardService._rebuild_requested_at < LeaderboardService.REBUILD_RETRY_INTERVAL:
+            return
+        LeaderboardService._rebuild_requested_at = now
+        logger.warning("排行榜重建标记缺失，后台重建榜单")
+        LeaderboardService.start_rebuild()
+
+    @staticmethod
+    def rebuild(db: Session) -> bool:
+        """
+        从游戏记录重建总榜和最近32天的日榜、小时榜（多个worker同时启动时只有一个执行）
+        使用ZADD GT写入，重建期间提交的新分数不会被覆盖；返回是否执行了重建
+        """
+        redis = LeaderboardService._get_redis()
+        if not redis:
+            return False
+        keys = LeaderboardService.REDIS_KEYS
+        try:
+            if redis.exists(keys["built"]):
+                return False
+            if not redis.set(keys["rebuild_lock"], 1, nx=True, ex=LeaderboardService.REBUILD_LOCK_TTL):
+                return False
+        except Exception as e:
+            logger.warning(f"检查排行榜状态失败: {e}")
+            return False
+
+        try:
+            batch_size = LeaderboardService.REBUILD_BATCH_SIZE
+            total = db.query(
+                GameRecord.user_id,
+                func.max(GameRecord.score),
+                func.max(GameRecord.play_time)
+            ).group_by(GameRecord.user_id).yield_per(batch_size)
+            pipe = redis.pipeline(transaction=False)
+            for index, (user_id, best_score, latest_play) in enumerate(total, 1):
+                pipe.zadd(keys["all"], {user_id: best_score}, gt=True)
+                if latest_play:
+                    pipe.hset(keys["last_play"], user_id, latest_play.isoformat())
+                if index % batch_size == 0:
+                    pipe.execute()
+            pipe.execute()
+
+            since = date.today() - timedelta(days=LeaderboardService.DAY_TTL // 86400 - 1)
+            if db.get_bind().dialect.name == "mysql":
+                play_hour = func.date_format(GameRecord.play_time, "%Y%m%d%H")
+            else:
+                play_hour = func.strftime("%Y%m%d%H", GameRecord.play_time)
+            hourly = db.query(
+                GameRecord.user_id,
+                play_hour,
+                func.max(GameRecord.score)
+            ).filter(
+                GameRecord.play_time >= datetime.combine(since, dt_time.min)
+            ).group_by(GameRecord.user_id, play_hour).yield_per(batch_size)
+            day_keys = set()
+            hour_keys = set()
+            for index, (user_id, hour, best_score) in enumerate(hourly, 1):
+                moment = datetime.strptime(hour, "%Y%m%d%H")
+                day_key = LeaderboardService._day_key(moment.date())
+                hour_key = LeaderboardService._hour_key(moment)
+                day_keys.add(day_key)
+                hour_keys.add(hour_key)
+                pipe.zadd(day_key, {user_id: best_score}, gt=True)
+                pipe.zadd(hour_key, {user_id: best_score}, gt=True)
+                if index % batch_size == 0:
+                    pipe.execute()
+            for board_key in day_keys | hour_keys:
+                pipe.expire(board_key, LeaderboardService.DAY_TTL)
+            # 之前构建的周榜/月榜可能不完整，删除后按需重新合并
+            rolling_keys = [LeaderboardService._rolling_key(period, datetime.now())
+                            for period in LeaderboardService.ROLLING_DAYS]
+            for rolling_key in rolling_keys:
+                pipe.delete(rolling_key)
+            pipe.set(keys["built"], datetime.now().isoformat())
+            # 榜单内容整体变化，递增版本号使快照刷新
+            pipe.incr(LeaderboardService._version_key(keys["all"]))
+            for board_key in list(day_keys) + rolling_keys:
+                pipe.incr(LeaderboardService._version_key(board_key))
+                pipe.expire(LeaderboardService._version_key(board_key), LeaderboardService.DAY_TTL)
+            pipe.execute()
+            logger.info("✅ 排行榜已从游戏记录重建")
+            return True
+        except Exception as e:
+            logger.error(f"重建排行榜失败: {e}")
+            return False
+        finally:
+            db.rollback()
+            try:
+                redis.delete(keys["rebuild_lock"])
+            except Exception:
+                pass
@@ -0,0 +1,185 @@
+"""
+排行榜快照 - 把每个榜单（period + limit）的完整响应预先序列化为JSON字节串，附带内容哈希作为ETag
+- 每个worker在内存中保存快照，请求直接返回字节串；客户端带 If-None-Match 且未变化时返回304
+- 快照在榜单前N名变化（榜单版本号改变）或超过最大存活时间时刷新；版本号每个worker最多每秒检查一次
+- 刷新合并为一次构建（single-flight）：进程内同一榜单只有一个线程构建，其他请求继续使用旧快照；
+  多个worker之间通过Redis共享最新快照，并用短期锁保证同一版本只构建一次
+- 本模块的方法会阻塞（线程锁、time.sleep、同步Redis/数据库），须在线程池中调用（路由定义为普通函数）
+"""
+from sqlalchemy.orm import Session
+from schemas import BaseResponse
+from services.leaderboard_service import LeaderboardService
+from services.money import from_cents
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LeaderboardSnapshot:
+    """预序列化的榜单响应"""
+    body: bytes
+    etag: str
+    version: Optional[str]     # 构建时的榜单版本（None表示来自数据库统计）
+    built_at: float            # time.time()
+    checked_at: float          # 最近一次确认版本的时间（time.monotonic()）
+
+    def with_checked(self, checked_at: float) -> "LeaderboardSnapshot":
+        return LeaderboardSnapshot(self.body, self.etag, self.version, self.built_at, checked_at)
+
+
+class LeaderboardSnapshots:
+    """排行榜快照缓存（每个worker一份）"""
+
+    CHECK_INTERVAL = 1.0      # 版本号检查间隔（秒）
+    MAX_AGE = 30              # 快照最长存活时间（秒），昵称、等级等展示字段的最大延迟
+    BUILD_LOCK_TTL = 5        # 跨worker构建锁（秒）
+    WAIT_POLLS = 10           # 没有旧快照可用且其他worker正在构建时，轮询共享快照的次数
+    WAIT_INTERVAL = 0.05
+
+    # Redis键名
+    SHARED_KEY = "leaderboard:snapshot:{period}:{limit}"         # 共享快照（哈希）
+    LOCK_KEY = "leaderboard:snapshot_lock:{period}:{limit}"
+
+    _snapshots: Dict[Tuple[str, int], LeaderboardSnapshot] = {}
+    _locks: Dict[Tuple[str, int], threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _lock_for(key: Tuple[str, int]) -> threading.Lock:
+        lock = LeaderboardSnapshots._locks.get(key)
+        if lock is None:
+            with LeaderboardSnapshots._locks_guard:
+                lock = LeaderboardSnapshots._locks.setdefault(key, threading.Lock())
+        return lock
+
+    @staticmethod
+    def _is_fresh(snapshot: Optional[LeaderboardSnapshot], version: Optional[str]) -> bool:
+        return (snapshot is not None and snapshot.version == version
+                and time.time() - snapshot.built_at < LeaderboardSnapshots.MAX_AGE)
+
+    @staticmethod
+    def render(db: Session, period: str, limit: int, version: Optional[str]) -> LeaderboardSnapshot:
+        """查询榜单并序列化为响应字节串"""
+        result = LeaderboardService.get_leaderboard(db, period, limit)
+        for entry in result:
+            entry["coins"] = from_cents(entry["coins"])
+        body = BaseResponse(
+            message="获取成功",
+            data={
+                "leaderboard": result,
+                "period": period,
+                "total": len(result)
+            }
+        ).model_dump_json().encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        return LeaderboardSnapshot(body, etag, version, time.time(), time.monotonic())
+
+    @staticmethod
+    def _load_shared(redis, period: str, limit: int, version: Optional[str]) -> Optional[LeaderboardSnapshot]:
+        """读取其他worker构建的共享快照（版本一致且未过期时才使用）"""
+        raw = redis.hgetall(LeaderboardSnapshots.SHARED_KEY.format(period=period, limit=limit))
+        if not raw or raw.get("version", "") != (version or ""):
+            return None
+        snapshot = LeaderboardSnapshot(raw["body"].encode(), raw["etag"], version,
+                                       float(raw["built_at"]), time.monotonic())
+        return snapshot if LeaderboardSnapshots._is_fresh(snapshot, version) else None
+
+    @staticmethod
+    def _save_shared(redis, period: str, limit: int, snapshot: LeaderboardSnapshot):
+        key = LeaderboardSnapshots.SHARED_KEY.format(period=period, limit=limit)
+        pipe = redis.pipeline()
+        pipe.hset(key, mapping={
+            "body": snapshot.body.decode(),
+            "etag": snapshot.etag,
+            "version": snapshot.version or "",
+            "built_at": snapshot.built_at
+        })
+        pipe.expire(key, LeaderboardSnapshots.MAX_AGE)
+        pipe.execute()
+
+    @staticmethod
+    def _rebuild(db: Session, period: str, limit: int, version: Optional[str],
+                 stale: Optional[LeaderboardSnapshot]) -> LeaderboardSnapshot:
+        """
+        刷新快照：优先采用其他worker已构建的共享快照；否则抢到构建锁的worker构建并共享，
+        没抢到的有旧快照则继续使用旧快照，没有旧快照则短暂等待共享快照，超时后自行构建
+        """
+        redis = LeaderboardSnapshots._get_redis()
+        if not redis:
+            return LeaderboardSnapshots.render(db, period, limit, version)
+
+        lock_key = LeaderboardSnapshots.LOCK_KEY.format(period=period, limit=limit)
+        try:
+            shared = LeaderboardSnapshots._load_shared(redis, period, limit, version)
+            if shared:
+                return shared
+            if not redis.set(lock_key, 1, nx=True, ex=LeaderboardSnapshots.BUILD_LOCK_TTL):
+                if stale is not None:
+                    return stale
+                for _ in range(LeaderboardSnapshots.WAIT_POLLS):
+                    time.sleep(LeaderboardSnapshots.WAIT_INTERVAL)
+                    shared = LeaderboardSnapshots._load_shared(redis, period, limit, version)
+                    if shared:
+                        return shared
+                return LeaderboardSnapshots.render(db, period, limit, version)
+        except Exception as e:
+            logger.warning(f"读取共享排行榜快照失败: {e}")
+            return LeaderboardSnapshots.render(db, period, limit, version)
+
+        try:
+            snapshot = LeaderboardSnapshots.render(db, period, limit, version)
+            LeaderboardSnapshots._save_shared(redis, period, limit, snapshot)
+            return snapshot
+        except Exception as e:
+            logger.warning(f"保存共享排行榜快照失败: {e}")
+            return LeaderboardSnapshots.render(db, period, limit, version)
+        finally:
+            try:
+                redis.delete(lock_key)
+            except Exception:
+                pass
+
+    @staticmethod
+    def get(db: Session, period: str, limit: int) -> LeaderboardSnapshot:
+        """获取榜单快照（多数请求只读内存，每秒最多一次Redis版本检查）"""
+        key = (period, limit)
+        snapshot = LeaderboardSnapshots._snapshots.get(key)
+        now = time.monotonic()
+        if (snapshot is not None and now - snapshot.checked_at < LeaderboardSnapshots.CHECK_INTERVAL
+                and time.time() - snapshot.built_at < LeaderboardSnapshots.MAX_AGE):
+            return snapshot
+
+        version = LeaderboardService.board_version(period)
+        if LeaderboardSnapshots._is_fresh(snapshot, version):
+            snapshot = snapshot.with_checked(now)
+            LeaderboardSnapshots._snapshots[key] = snapshot
+            return snapshot
+
+        lock = LeaderboardSnapshots._lock_for(key)
+        if not lock.acquire(blocking=snapshot is None):
+            # 本进程已有线程在刷新，先返回旧快照
+            return snapshot
+        try:
+            current = LeaderboardSnapshots._snapshots.get(key)
+            if current is not snapshot and LeaderboardSnapshots._is_fresh(current, version):
+                return current
+            snapshot = LeaderboardSnapshots._rebuild(db, period, limit, version, stale=current)
+            LeaderboardSnapshots._snapshots[key] = snapshot
+            return snapshot
+        finally:
+            lock.release()
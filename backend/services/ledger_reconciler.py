@@ -0,0 +1,246 @@
+"""
+金币账本对账 - 核对每个用户的余额（users.coins）是否等于其金币流水（coin_transactions.amount）之和
+
+按用户ID分批（keyset，每批 chunk_size 个用户）扫描：每批一条用户查询 + 一条按 user_id 范围分组求和的流水查询
+（范围为 (上一批最后的用户ID, 本批最后的用户ID]，最后一批不设上限，批与批之间和最后一个用户之后的
+已删除用户的流水也会计入“无对应用户的流水”），
+两条查询在同一事务（InnoDB可重复读，同一快照）中执行，不会把并发记账误报为差异；
+每批完成后把进度写入Redis检查点，中断后可从检查点继续；
+每批按数据库负载预算休眠（查询耗时 / 运行总时间 ≤ 预算），夜间在线运行不影响接口
+
+修复模式：对有差异的用户加行锁后重新核对，写入一条“管理员调整”流水补齐差额（余额不变，账本与余额对齐）
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from models import User, CoinTransaction, TransactionType
+from config import settings
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LedgerDrift:
+    """一个用户的账本差异（金额为整数分）"""
+    user_id: int
+    balance: int        # users.coins
+    ledger_total: int   # 流水合计
+
+    @property
+    def difference(self) -> int:
+        return self.balance - self.ledger_total
+
+
+class LedgerReconciler:
+    """金币账本对账任务"""
+
+    # Redis键名
+    REDIS_KEYS = {
+        "checkpoint": "ledger_reconcile:checkpoint",   # 进行中的对账进度（哈希）
+        "last_run": "ledger_reconcile:last_run",       # 最近一次完成的对账结果（JSON）
+    }
+
+    REPAIR_DESCRIPTION = "账本对账修正"
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _ledger_totals(db: Session, after_id: int, last_id: Optional[int]) -> Dict[int, int]:
+        """
+        按用户ID范围 (after_id, last_id] 分组统计流水合计（last_id为None表示不设上限）
+        走 (user_id, created_time) 索引的范围扫描
+        """
+        query = db.query(
+            CoinTransaction.user_id,
+            func.coalesce(func.sum(CoinTransaction.amount), 0)
+        ).filter(CoinTransaction.user_id > after_id)
+        if last_id is not None:
+            query = query.filter(CoinTransaction.user_id <= last_id)
+        rows = query.group_by(CoinTransaction.user_id).all()
+        return {user_id: int(total) for user_id, total in rows}
+
+    @staticmethod
+    def scan_chunk(db: Session, after_id: int, limit: int) -> Tuple[Optional[int], int, List[LedgerDrift], int]:
+        """
+        核对ID大于after_id的下一批用户（只读，结束时回滚以释放快照）
+        流水统计范围从after_id开始（包含上一批与本批之间的空隙）；不足limit个用户（最后一批）时不设上限
+        返回：(本批最后一个用户ID（没有更多用户时为None）, 核对用户数, 差异列表, 无对应用户的流水用户数)
+        """
+        try:
+            users = db.query(User.id, User.coins).filter(
+                User.id > after_id
+            ).order_by(User.id).limit(limit).all()
+            if not users:
+                return None, 0, [], len(LedgerReconciler._ledger_totals(db, after_id, None))
+
+            last_id = users[-1][0]
+            totals = LedgerReconciler._ledger_totals(db, after_id, last_id if len(users) == limit else None)
+        finally:
+            db.rollback()
+
+        drifts = []
+        for user_id, coins in users:
+            ledger_total = totals.pop(user_id, 0)
+            if int(coins or 0) != ledger_total:
+                drifts.append(LedgerDrift(user_id, int(coins or 0), ledger_total))
+        # 剩下的是用户已被删除的流水
+        return last_id, len(users), drifts, len(totals)
+
+    @staticmethod
+    def repair(db: Session, drifts: List[LedgerDrift]) -> int:
+        """
+        修复差异：锁定用户行后重新核对（记账引擎先更新用户行再写流水，持有行锁时流水合计不会变化），
+        仍有差异的写入一条调整流水补齐差额；返回修复的用户数
+        """
+        if not drifts:
+            return 0
+        user_ids = [drift.user_id for drift in drifts]
+        try:
+            balances = dict(db.query(User.id, User.coins).filter(
+                User.id.in_(user_ids)
+            ).with_for_update().all())
+            totals = dict(db.query(
+                CoinTransaction.user_id,
+                func.coalesce(func.sum(CoinTransaction.amount), 0)
+            ).filter(CoinTransaction.user_id.in_(user_ids)).group_by(CoinTransaction.user_id).all())
+
+            adjustments = []
+            for user_id, coins in balances.items():
+                coins = int(coins or 0)
+                difference = coins - int(totals.get(user_id, 0))
+                if difference:
+                    adjustments.append(CoinTransaction(
+                        user_id=user_id,
+                        type=TransactionType.ADMIN_ADJUST,
+                        amount=difference,
+                        balance_after=coins,
+                        description=LedgerReconciler.REPAIR_DESCRIPTION
+                    ))
+            db.add_all(adjustments)
+            db.commit()
+            return len(adjustments)
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def load_checkpoint() -> Optional[Dict]:
+        """读取未完成的对账进度"""
+        redis = LedgerReconciler._get_redis()
+        if not redis:
+            return None
+        try:
+            raw = redis.hgetall(LedgerReconciler.REDIS_KEYS["checkpoint"])
+        except Exception as e:
+            logger.warning(f"读取对账检查点失败: {e}")
+            return None
+        if not raw:
+            return None
+        checkpoint = {key: int(raw.get(key, 0)) for key in (
+            "last_user_id", "checked", "drifted", "repaired", "orphans", "drift_total"
+        )}
+        checkpoint["started_at"] = raw.get("started_at")
+        return checkpoint
+
+    @staticmethod
+    def _save_checkpoint(progress: Dict):
+        redis = LedgerReconciler._get_redis()
+        if not redis:
+            return
+        try:
+            redis.hset(LedgerReconciler.REDIS_KEYS["checkpoint"], mapping=progress)
+        except Exception as e:
+            logger.warning(f"保存对账检查点失败: {e}")
+
+    @staticmethod
+    def _finish(progress: Dict):
+        redis = LedgerReconciler._get_redis()
+        if not redis:
+            return
+        try:
+            progress = dict(progress, finished_at=datetime.now().isoformat())
+            pipe = redis.pipeline()
+            pipe.delete(LedgerReconciler.REDIS_KEYS["checkpoint"])
+            pipe.set(LedgerReconciler.REDIS_KEYS["last_run"], json.dumps(progress, ensure_ascii=False))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"保存对账结果失败: {e}")
+
+    @staticmethod
+    def run(repair: bool = False, resume: bool = True, chunk_size: int = None, db_budget: float = None,
+            max_chunks: int = None, on_drift: Callable[[LedgerDrift], None] = None) -> Dict:
+        """
+        执行一轮对账
+        resume: 存在检查点时从检查点继续，否则从头开始
+        db_budget: 数据库负载预算（0~1），每批查询耗时t后休眠 t*(1/预算-1) 秒；≥1表示不休眠
+        max_chunks: 最多处理的批数（None表示直到扫描完所有用户）；未扫描完时保留检查点
+        on_drift: 发现差异时的回调（用于输出报告）
+        返回本轮进度统计（金额为整数分）
+        """
+        from database import SessionLocal
+
+        chunk_size = max(1, chunk_size or settings.LEDGER_RECONCILE_CHUNK_SIZE)
+        db_budget = settings.LEDGER_RECONCILE_DB_BUDGET if db_budget is None else db_budget
+
+        progress = LedgerReconciler.load_checkpoint() if resume else None
+        if progress:
+            logger.info(f"从检查点继续对账: 用户ID > {progress['last_user_id']}")
+        else:
+            progress = {"last_user_id": 0, "checked": 0, "drifted": 0, "repaired": 0,
+                        "orphans": 0, "drift_total": 0, "started_at": datetime.now().isoformat()}
+
+        db = SessionLocal()
+        chunks = 0
+        try:
+            while max_chunks is None or chunks < max_chunks:
+                started = time.perf_counter()
+                last_id, checked, drifts, orphans = LedgerReconciler.scan_chunk(
+                    db, progress["last_user_id"], chunk_size
+                )
+                if last_id is None:
+                    progress["orphans"] += orphans
+                    LedgerReconciler._finish(progress)
+                    progress["finished"] = True
+                    break
+
+                for drift in drifts:
+                    logger.warning(f"账本差异: 用户{drift.user_id} 余额{drift.balance} 流水合计{drift.ledger_total}"
+                                   f" 差额{drift.difference}（分）")
+                    if on_drift:
+                        on_drift(drift)
+                if repair and drifts:
+                    progress["repaired"] += LedgerReconciler.repair(db, drifts)
+
+                progress["last_user_id"] = last_id
+                progress["checked"] += checked
+                progress["drifted"] += len(drifts)
+                progress["orphans"] += orphans
+                progress["drift_total"] += sum(abs(drift.difference) for drift in drifts)
+                if checked < chunk_size:
+                    # 最后一批（流水统计已覆盖最后一个用户之后的ID），无需再扫描
+                    LedgerReconciler._finish(progress)
+                    progress["finished"] = True
+                    break
+                LedgerReconciler._save_checkpoint(progress)
+                chunks += 1
+
+                elapsed = time.perf_counter() - started
+                if 0 < db_budget < 1:
+                    time.sleep(elapsed * (1 / db_budget - 1))
+        finally:
+            db.close()
+
+        progress.setdefault("finished", False)
+        return progress
@@ -4,6 +4,7 @@ from models import UserLevelConfig, User
 from schemas import UserLevelConfigCreate, UserLevelConfigUpdate
 from typing import List, Optional
 from decimal import Decimal
+from services.money import apply_multiplier
 
 class LevelService:
     
@@ -79,21 +80,19 @@ class LevelService:
         ).order_by(UserLevelConfig.level.desc()).first()
     
     @staticmethod
-    def calculate_ad_coins(db: Session, user_level: int, base_coins: float) -> float:
-        """根据用户等级计算广告金币奖励"""
+    def calculate_ad_coins(db: Session, user_level: int, base_coins: int) -> int:
+        """根据用户等级计算广告金币奖励（分，乘以倍数后四舍五入到分）"""
         level_config = LevelService.get_user_level_config(db, user_level)
         if level_config:
-            multiplier = float(level_config.ad_coin_multiplier)
-            return round(base_coins * multiplier, 2)
+            return apply_multiplier(base_coins, level_config.ad_coin_multiplier)
         return base_coins
     
     @staticmethod
-    def calculate_game_coins(db: Session, user_level: int, base_coins: float) -> float:
-        """根据用户等级计算游戏金币奖励"""
+    def calculate_game_coins(db: Session, user_level: int, base_coins: int) -> int:
+        """根据用户等级计算游戏金币奖励（分，乘以倍数后四舍五入到分）"""
         level_config = LevelService.get_user_level_config(db, user_level)
         if level_config:
-            multiplier = float(level_config.game_coin_multiplier)
-            return round(base_coins * multiplier, 2)
+            return apply_multiplier(base_coins, level_config.game_coin_multiplier)
         return base_coins
     
     @staticmethod
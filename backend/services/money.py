@@ -0,0 +1,78 @@
+"""
+金额工具 - 金币和人民币在数据库、服务层和缓存中统一用整数“分”表示（1金币 = 100分，1元 = 100分），
+只在解析输入（系统配置、请求参数）和序列化输出（接口响应、提示文案）时与小数互相转换
+
+取整规则（全部为整数运算，结果是确定的）：
+- 解析小数输入：四舍五入到分
+- 等级倍数奖励（金币 × 倍数）：四舍五入到分
+- 提现所需金币（人民币 × 兑换比例）：向上取整到分
+- 提现手续费（金币 × 费率%）：向上取整到分，手续费不少收
+- 金币折算人民币：向下取整到分，不多付
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Union
+
+CENTS_PER_UNIT = 100
+
+Number = Union[int, float, str, Decimal]
+
+
+def to_cents(value: Number) -> int:
+    """把金币/人民币数值（元）转换为整数分，四舍五入；用于解析配置和请求参数"""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value * CENTS_PER_UNIT
+    try:
+        return int((Decimal(str(value)) * CENTS_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f"无效的金额: {value}")
+
+
+def from_cents(cents: int) -> float:
+    """整数分转换为金币/人民币数值（用于JSON响应）；MySQL的SUM(BIGINT)返回DECIMAL，这里一并转为整数"""
+    return int(cents or 0) / CENTS_PER_UNIT
+
+
+def format_cents(cents: int) -> str:
+    """整数分格式化为两位小数的字符串（用于提示文案）"""
+    cents = int(cents or 0)
+    sign = "-" if cents < 0 else ""
+    units, rest = divmod(abs(cents), CENTS_PER_UNIT)
+    return f"{sign}{units}.{rest:02d}"
+
+
+def _div_half_up(numerator: int, denominator: int) -> int:
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def _div_ceil(numerator: int, denominator: int) -> int:
+    return -(-numerator // denominator)
+
+
+def apply_multiplier(cents: int, multiplier: Number) -> int:
+    """金额乘以倍数（倍数精确到0.01），四舍五入到分"""
+    return _div_half_up(cents * to_cents(multiplier), CENTS_PER_UNIT)
+
+
+def percent_fee(cents: int, rate_percent: Number) -> int:
+    """按百分比费率（精确到0.01%）计算手续费，向上取整到分"""
+    if cents <= 0:
+        return 0
+    return _div_ceil(cents * to_cents(rate_percent), 100 * CENTS_PER_UNIT)
+
+
+def rmb_to_coin_cents(rmb_cents: int, coin_rate: Number) -> int:
+    """人民币（分）按兑换比例（每元金币数）折算所需金币（分），向上取整"""
+    return _div_ceil(rmb_cents * to_cents(coin_rate), CENTS_PER_UNIT)
+
+
+def coin_to_rmb_cents(coin_cents: int, coin_rate: Number) -> int:
+    """金币（分）按兑换比例（每元金币数）折算人民币（分），向下取整"""
+    rate = to_cents(coin_rate)
+    if rate <= 0:
+        return 0
+    return coin_cents * CENTS_PER_UNIT // rate
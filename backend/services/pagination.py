@@ -0,0 +1,65 @@
+"""
+历史记录分页 - 按 (时间, id) 倒序的游标分页（keyset），每页只扫描 size+1 行，与翻页深度无关；
+游标是不透明的字符串，客户端原样传回即可。旧的 page/size 偏移分页仍然保留用于兼容。
+总数（COUNT(*)）只在偏移分页或显式请求时计算
+"""
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+
+
+def encode_cursor(time_value: datetime, row_id: int) -> str:
+    """把最后一行的 (时间, id) 编码为游标"""
+    raw = f"{time_value.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标；格式无效时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        time_part, id_part = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(time_part), int(id_part)
+    except (ValueError, UnicodeDecodeError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def paginate(query: Query, time_column, id_column, size: int, page: int = 1,
+             cursor: Optional[str] = None, include_total: Optional[bool] = None) -> Tuple[List[Any], Dict]:
+    """
+    按 (time_column, id_column) 倒序分页
+    cursor为None时使用偏移分页（兼容旧客户端），否则使用游标分页（空字符串表示第一页）
+    include_total为None时：偏移分页返回总数，游标分页不返回
+    返回：(当前页记录, 分页信息 {"size", "has_more", "next_cursor", ["page", "total", "pages"]})
+    """
+    size = max(1, size)
+    ordered = query.order_by(time_column.desc(), id_column.desc())
+
+    if cursor is None:
+        page = max(1, page)
+        rows = ordered.offset((page - 1) * size).limit(size + 1).all()
+    else:
+        if cursor:
+            cursor_time, cursor_id = decode_cursor(cursor)
+            ordered = ordered.filter(or_(
+                time_column < cursor_time,
+                and_(time_column == cursor_time, id_column < cursor_id)
+            ))
+        rows = ordered.limit(size + 1).all()
+
+    has_more = len(rows) > size
+    rows = rows[:size]
+    meta: Dict = {"size": size, "has_more": has_more, "next_cursor": None}
+    if has_more and rows:
+        last = rows[-1]
+        meta["next_cursor"] = encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+
+    if include_total or (include_total is None and cursor is None):
+        total = query.order_by(None).count()
+        meta["total"] = total
+        meta["pages"] = (total + size - 1) // size
+    if cursor is None:
+        meta["page"] = page
+    return rows, meta
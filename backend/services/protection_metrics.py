@@ -0,0 +1,122 @@
+"""
+防护层运行指标 - 按限流类别统计放行/限流/封禁次数，记录中间件与Redis耗时分布
+指标保存在进程内（请求路径上不访问Redis），由管理后台接口读取
+"""
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图（毫秒），分位数按桶上界近似"""
+
+    BUCKETS_MS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)   # 最后一个桶为 >1000ms
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+        self.total += 1
+        self.sum_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+
+    def _percentile(self, ratio: float) -> Optional[float]:
+        if not self.total:
+            return None
+        target = self.total * ratio
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BUCKETS_MS[index] if index < len(self.BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict:
+        labels = [f"<={b}ms" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.total,
+            "avg_ms": round(self.sum_ms / self.total, 3) if self.total else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self._percentile(0.5),
+            "p95_ms": self._percentile(0.95),
+            "p99_ms": self._percentile(0.99),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class ProtectionMetrics:
+    """防护层指标（每个worker一份）"""
+
+    # 请求结果分类
+    OUTCOMES = (
+        "allowed",          # 放行
+        "limited",          # 超速率限制（429）
+        "banned",           # 触发自动封禁（403）
+        "blocked",          # 命中黑名单（403）
+        "shadow_limited",   # 影子规则判定会被限流（未拦截）
+        "local_fallback",   # Redis不可用，使用本地限流器判定
+    )
+
+    _lock = threading.Lock()
+    _counters: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(ProtectionMetrics.OUTCOMES, 0))
+    _histograms: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+    _limits: Dict = {}
+    _started_at = time.time()
+
+    @staticmethod
+    def record(action: str, outcome: str):
+        """计数一次请求结果"""
+        with ProtectionMetrics._lock:
+            ProtectionMetrics._counters[action][outcome] += 1
+
+    @staticmethod
+    def observe(name: str, elapsed_seconds: float):
+        """记录一次耗时（name: middleware / redis）"""
+        with ProtectionMetrics._lock:
+            ProtectionMetrics._histograms[name].observe(elapsed_seconds * 1000)
+
+    @staticmethod
+    def set_limits(limits: Dict):
+        """登记当前生效的限流配置，随指标一起展示便于对照调参"""
+        ProtectionMetrics._limits = limits
+
+    @staticmethod
+    def snapshot() -> Dict:
+        """导出当前指标"""
+        from services.redis_fallback import redis_breaker
+
+        with ProtectionMetrics._lock:
+            counters = {action: dict(values) for action, values in ProtectionMetrics._counters.items()}
+            histograms = {name: hist.snapshot() for name, hist in ProtectionMetrics._histograms.items()}
+
+        totals = dict.fromkeys(ProtectionMetrics.OUTCOMES, 0)
+        for values in counters.values():
+            for outcome, count in values.items():
+                totals[outcome] += count
+
+        return {
+            "pid": os.getpid(),
+            "started_at": ProtectionMetrics._started_at,
+            "uptime_seconds": int(time.time() - ProtectionMetrics._started_at),
+            "redis_breaker": redis_breaker.state,
+            "totals": totals,
+            "actions": counters,
+            "latency": histograms,
+            "limits": ProtectionMetrics._limits
+        }
+
+    @staticmethod
+    def reset():
+        """清空计数与耗时统计"""
+        with ProtectionMetrics._lock:
+            ProtectionMetrics._counters.clear()
+            ProtectionMetrics._histograms.clear()
+            ProtectionMetrics._started_at = time.time()
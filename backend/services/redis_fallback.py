@@ -0,0 +1,248 @@
+"""
+Redis故障降级 - 熔断器 + 进程内近似限流器
+Redis报错或延迟超出预算时熔断，防护中间件自动切换到本地限流；
+熔断期间定期放行一次探测请求，Redis恢复后自动切回
+"""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+from services.protection_metrics import ProtectionMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class RedisUnavailable(Exception):
+    """Redis熔断中或调用失败（调用方应走本地降级逻辑）"""
+
+
+class CircuitBreaker:
+    """
+    熔断器: closed（正常） -> open（熔断，直接走降级） -> half_open（放行一次探测）
+    连续失败达到阈值即熔断；延迟超出预算的调用也计为失败
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, latency_budget: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """是否允许访问Redis（熔断期间每个reset_timeout只放行一个探测请求）"""
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self, elapsed: float = 0.0):
+        """记录一次成功调用；耗时超出预算按失败处理"""
+        if elapsed > self.latency_budget:
+            self.record_failure(f"延迟{elapsed * 1000:.0f}ms超出预算{self.latency_budget * 1000:.0f}ms")
+            return
+        if self.state == self.CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.warning(f"✅ {self.name}已恢复，退出熔断")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, reason: str = ""):
+        """记录一次失败调用，达到阈值或探测失败时熔断"""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                if self.state == self.CLOSED:
+                    logger.error(f"🔌 {self.name}连续失败{self._failures}次，进入熔断（{reason}）")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def abort_probe(self):
+        """
+        探测调用未完成就被取消（客户端断开、任务取消）：按探测失败处理，重新计时后再放行下一次探测
+        不处理时探测名额一直被占用，熔断永远无法恢复；熔断关闭时的取消不计为失败
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probing:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != self.CLOSED
+
+
+async def guarded_call(breaker: CircuitBreaker, func, *args, **kwargs):
+    """
+    通过熔断器执行一次异步Redis调用
+    熔断中或调用失败时抛出RedisUnavailable，调用方据此走本地降级
+    """
+    if not breaker.allow_request():
+        raise RedisUnavailable(f"{breaker.name}熔断中")
+
+    started = time.perf_counter()
+    try:
+        result = await func(*args, **kwargs)
+    except Exception as e:
+        ProtectionMetrics.observe("redis", time.perf_counter() - started)
+        breaker.record_failure(str(e))
+        raise RedisUnavailable(str(e)) from e
+    except BaseException:
+        # asyncio.CancelledError 等不属于Exception，须释放探测名额
+        breaker.abort_probe()
+        raise
+
+    elapsed = time.perf_counter() - started
+    ProtectionMetrics.observe("redis", elapsed)
+    breaker.record_success(elapsed)
+    return result
+
+
+class _Shard:
+    """计数分片: 计数字典 + 时间轮（按秒为刻度回收过期键）"""
+
+    __slots__ = ("counters", "wheel", "tick", "lock")
+
+    def __init__(self, wheel_size: int):
+        self.counters: Dict[str, List[int]] = {}     # key -> [计数, 过期刻度]
+        self.wheel: List[list] = [[] for _ in range(wheel_size)]
+        self.tick: Optional[int] = None
+        self.lock = threading.Lock()
+
+
+class LocalRateLimiter:
+    """
+    进程内近似限流器（Redis不可用时的兜底）
+    - 按key哈希分片，每个分片独立加锁
+    - 时间轮回收过期计数，每次访问只推进经过的刻度，无需后台线程
+    - 每个分片计数键数量有上限，超出时淘汰最早写入的键，内存有界
+    计数只在本worker内有效，多worker部署时整体放行量约为限额×worker数
+    """
+
+    def __init__(self, shards: int = 16, max_keys_per_shard: int = 20000, wheel_size: int = 512):
+        self.wheel_size = wheel_size
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards = [_Shard(wheel_size) for _ in range(shards)]
+
+    def __len__(self) -> int:
+        return sum(len(shard.counters) for shard in self._shards)
+
+    def _shard_for(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _advance(self, shard: _Shard, now_tick: int):
+        """推进时间轮到当前刻度，删除到期的计数键（调用方持有分片锁）"""
+        if shard.tick is None or now_tick <= shard.tick:
+            if shard.tick is None:
+                shard.tick = now_tick
+            return
+
+        steps = min(now_tick - shard.tick, self.wheel_size)
+        for offset in range(1, steps + 1):
+            index = (shard.tick + offset) % self.wheel_size
+            slot = shard.wheel[index]
+            if not slot:
+                continue
+            remaining = []
+            for key, expire_tick in slot:
+                if expire_tick > now_tick:
+                    # 过期时间超过一圈，留到下一圈
+                    remaining.append((key, expire_tick))
+                    continue
+                entry = shard.counters.get(key)
+                # 键被淘汰后重建会有新的过期刻度，只删除真正到期的
+                if entry is not None and entry[1] <= now_tick:
+                    del shard.counters[key]
+            shard.wheel[index] = remaining
+        shard.tick = now_tick
+
+    def _get(self, shard: _Shard, key: str) -> int:
+        entry = shard.counters.get(key)
+        return entry[0] if entry is not None else 0
+
+    def _incr(self, shard: _Shard, key: str, ttl: int, now_tick: int) -> int:
+        entry = shard.counters.get(key)
+        if entry is not None:
+            entry[0] += 1
+            return entry[0]
+
+        if len(shard.counters) >= self.max_keys_per_shard:
+            # dict保持插入顺序，淘汰最早写入的键
+            shard.counters.pop(next(iter(shard.counters)))
+        expire_tick = now_tick + max(1, ttl)
+        shard.counters[key] = [1, expire_tick]
+        shard.wheel[expire_tick % self.wheel_size].append((key, expire_tick))
+        return 1
+
+    def check(self, limits: Sequence[Tuple[str, int, int]], now: float = None) -> Tuple[int, int, int, int]:
+        """
+        滑动窗口检查（与Redis限流脚本语义一致）
+        limits: [(计数键前缀, 窗口内最大请求数, 窗口长度秒), ...]
+        返回: (是否放行1/0, 估算请求数, 建议重试秒数, 触发限制的序号从1开始)
+        """
+        now = time.time() if now is None else now
+        now_tick = int(now)
+        entries = []
+        for index, (prefix, max_requests, window) in enumerate(limits, 1):
+            bucket = int(now // window)
+            shard = self._shard_for(prefix)
+            with shard.lock:
+                self._advance(shard, now_tick)
+                current = self._get(shard, f"{prefix}:{bucket}")
+                previous = self._get(shard, f"{prefix}:{bucket - 1}")
+
+            elapsed = now % window
+            estimated = int(previous * (window - elapsed) / window) + current
+            if estimated >= max_requests:
+                retry_after = window - elapsed
+                if current < max_requests and previous > 0:
+                    retry_after = min(retry_after, window * (1 - (max_requests - current) / previous) - elapsed)
+                return 0, estimated, max(1, int(-(-retry_after // 1))), index
+            entries.append((shard, f"{prefix}:{bucket}", window))
+
+        for shard, key, window in entries:
+            with shard.lock:
+                self._incr(shard, key, window * 2, now_tick)
+        return 1, 0, 0, 0
+
+    def incr(self, key: str, window: int, now: float = None) -> int:
+        """固定窗口计数，返回窗口内的累计次数（用于违规计数等）"""
+        now = time.time() if now is None else now
+        full_key = f"{key}:{int(now // window)}"
+        shard = self._shard_for(full_key)
+        with shard.lock:
+            self._advance(shard, int(now))
+            return self._incr(shard, full_key, window, int(now))
+
+
+# 全局实例（每个worker一份）
+redis_breaker = CircuitBreaker(
+    name="Redis",
+    failure_threshold=settings.REDIS_BREAKER_FAILURES,
+    reset_timeout=settings.REDIS_BREAKER_RESET_SECONDS,
+    latency_budget=settings.REDIS_LATENCY_BUDGET_MS / 1000
+)
+local_limiter = LocalRateLimiter()
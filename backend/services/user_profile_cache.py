@@ -0,0 +1,286 @@
+"""
+用户资料缓存 - Redis中保存每个用户的资料、余额、等级和计数的紧凑投影，轮询余额等读请求不访问数据库
+
+一致性靠版本号保证：每个用户有一个版本计数（user_profile:ver:{id}），缓存的投影带着写入时的版本号，
+读取时两者一致才算命中。任何修改用户行的事务提交后都会递增版本号（会话事件自动收集：ORM修改的User对象
+和记账引擎的条件UPDATE），旧投影立即失效；回填时如果版本号已在读库期间变化则放弃写入。回填用的读库必须在读取版本号之后开始新事务：
+调用方会话已在事务中时（InnoDB可重复读的快照可能早于版本号读取，会读到旧行）另开会话查询，
+因此不会出现把旧数据当作新版本缓存的情况。Redis不可用时直接查数据库
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from contextlib import contextmanager, nullcontext
+from models import User, UserStatus
+from dataclasses import dataclass, fields
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterable, Optional
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 回填投影（仅当版本号仍为读库前的值时写入，原子执行）
+# KEYS[1]: 版本号  KEYS[2]: 投影  ARGV[1]: 读库前的版本号（空字符串表示当时不存在）
+# ARGV[2]: 投影JSON  ARGV[3]: 投影过期秒数  ARGV[4]: 版本号过期秒数
+# 返回: 1=已写入 0=版本号已变化，放弃写入
+FILL_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current == false then
+    if ARGV[1] ~= '' then
+        return 0
+    end
+    redis.call('SET', KEYS[1], '0')
+elseif current ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """用户行的只读投影（脱离数据库会话，金额为整数分）"""
+    id: int
+    device_id: str
+    device_name: Optional[str]
+    username: Optional[str]
+    nickname: Optional[str]
+    avatar: Optional[str]
+    coins: int
+    total_coins: int
+    level: int
+    experience: int
+    game_count: int
+    best_score: int
+    last_login_time: Optional[datetime]
+    register_time: Optional[datetime]
+    status: UserStatus
+
+    _DATETIME_FIELDS = ("last_login_time", "register_time")
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserProfile":
+        values = {f.name: getattr(user, f.name) for f in fields(cls)}
+        for name in ("coins", "total_coins", "level", "experience", "game_count", "best_score"):
+            values[name] = int(values[name] or 0)
+        values["status"] = values["status"] or UserStatus.ACTIVE
+        return cls(**values)
+
+    def to_json(self, version: str) -> str:
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        for name in self._DATETIME_FIELDS:
+            values[name] = values[name].isoformat() if values[name] else None
+        values["status"] = self.status.value
+        values["_v"] = version
+        return json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str, version: str) -> Optional["UserProfile"]:
+        """解析缓存的投影，版本号不一致或格式无效时返回None"""
+        try:
+            values = json.loads(raw)
+            if values.pop("_v", None) != version:
+                return None
+            for name in cls._DATETIME_FIELDS:
+                values[name] = datetime.fromisoformat(values[name]) if values[name] else None
+            values["status"] = UserStatus(values["status"])
+            return cls(**values)
+        except (TypeError, ValueError, KeyError):
+            return None
+
+
+class UserProfileCache:
+    """用户资料投影缓存（读穿透 + 提交后递增版本号失效）"""
+
+    # Redis键名
+    PROFILE_KEY = "user_profile:{user_id}"
+    VERSION_KEY = "user_profile:ver:{user_id}"
+
+    # 投影过期时间（秒）；版本号的过期时间是它的两倍，且每次回填/递增都会续期，
+    # 保证版本号不会先于投影过期后从0重新计数，从而与残留的旧投影重新“一致”
+    PROFILE_TTL = 3600
+    VERSION_TTL = PROFILE_TTL * 2
+
+    # 会话中待失效的用户ID（session.info的键）
+    _DIRTY_KEY = "user_profile_dirty"
+
+    _script = None
+
+    @staticmethod
+    def _get_redis():
+        """获取Redis客户端"""
+        try:
+            from database import redis_client
+            return redis_client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _keys(user_id: int):
+        return (UserProfileCache.VERSION_KEY.format(user_id=user_id),
+                UserProfileCache.PROFILE_KEY.format(user_id=user_id))
+
+    @staticmethod
+    @contextmanager
+    def _fill_session(db: Session):
+        """
+        回填用的读会话（须在读取版本号之后调用）：调用方会话未开始事务时直接使用，
+        下一条查询开启的新事务快照晚于版本号读取；已在事务中时另开会话，避免读到早于版本号的旧快照
+        """
+        if not db.in_transaction():
+            yield db
+            return
+        fill_db = Session(bind=db.get_bind())
+        try:
+            yield fill_db
+        finally:
+            fill_db.close()
+
+    @staticmethod
+    def _load(db: Session, user_id: int) -> Optional[UserProfile]:
+        user = db.query(User).filter(User.id == user_id).first()
+        return UserProfile.from_model(user) if user else None
+
+    @staticmethod
+    def get(db: Session, user_id) -> Optional[UserProfile]:
+        """
+        获取用户资料投影（命中时一次Redis往返，不访问数据库）
+        未命中时查库并按读库前的版本号回填；用户不存在返回None（不缓存）
+        """
+        try:
+            user_id = int(user_id)
+        except (ValueError, TypeError):
+            return None
+
+        redis = UserProfileCache._get_redis()
+        if not redis:
+            return UserProfileCache._load(db, user_id)
+
+        version_key, profile_key = UserProfileCache._keys(user_id)
+        try:
+            version, raw = redis.mget(version_key, profile_key)
+        except Exception as e:
+            logger.warning(f"读取用户资料缓存失败，改为查询数据库: {e}")
+            return UserProfileCache._load(db, user_id)
+
+        if version is not None and raw is not None:
+            profile = UserProfile.from_json(raw, version)
+            if profile is not None:
+                return profile
+
+        with UserProfileCache._fill_session(db) as fill_db:
+            profile = UserProfileCache._load(fill_db, user_id)
+        if profile is not None:
+            try:
+                if UserProfileCache._script is None:
+                    UserProfileCache._script = redis.register_script(FILL_LUA)
+                UserProfileCache._script(
+                    keys=[version_key, profile_key],
+                    args=[version or "", profile.to_json(version or "0"),
+                          UserProfileCache.PROFILE_TTL, UserProfileCache.VERSION_TTL]
+                )
+            except Exception as e:
+                logger.warning(f"回填用户资料缓存失败: {e}")
+        return profile
+
+    @staticmethod
+    def get_many(db: Session, user_ids: Iterable[int]) -> Dict[int, UserProfile]:
+        """
+        批量获取用户资料投影：一次MGET，未命中的用户一次IN查询后批量回填
+        返回：{用户ID: 投影}（不存在的用户不在结果中）
+        """
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+        if not user_ids:
+            return {}
+
+        profiles: Dict[int, UserProfile] = {}
+        versions: Dict[int, Optional[str]] = {}
+        redis = UserProfileCache._get_redis()
+        if redis:
+            try:
+                values = redis.mget([key for user_id in user_ids for key in UserProfileCache._keys(user_id)])
+                for index, user_id in enumerate(user_ids):
+                    version, raw = values[index * 2], values[index * 2 + 1]
+                    versions[user_id] = version
+                    profile = UserProfile.from_json(raw, version) if version is not None and raw is not None else None
+                    if profile is not None:
+                        profiles[user_id] = profile
+            except Exception as e:
+                logger.warning(f"批量读取用户资料缓存失败，改为查询数据库: {e}")
+                redis = None
+
+        misses = [user_id for user_id in user_ids if user_id not in profiles]
+        if not misses:
+            return profiles
+
+        # Redis不可用时不回填，直接用调用方会话查询
+        with (UserProfileCache._fill_session(db) if redis else nullcontext(db)) as fill_db:
+            loaded = {user.id: UserProfile.from_model(user)
+                      for user in fill_db.query(User).filter(User.id.in_(misses)).all()}
+        profiles.update(loaded)
+        if redis and loaded:
+            try:
+                if UserProfileCache._script is None:
+                    UserProfileCache._script = redis.register_script(FILL_LUA)
+                pipe = redis.pipeline(transaction=False)
+                for user_id, profile in loaded.items():
+                    version = versions.get(user_id)
+                    UserProfileCache._script(
+                        keys=list(UserProfileCache._keys(user_id)),
+                        args=[version or "", profile.to_json(version or "0"),
+                              UserProfileCache.PROFILE_TTL, UserProfileCache.VERSION_TTL],
+                        client=pipe
+                    )
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"批量回填用户资料缓存失败: {e}")
+        return profiles
+
+    @staticmethod
+    def mark_dirty(db: Session, user_id: int):
+        """记录当前事务修改了该用户，提交后失效其缓存（ORM修改的User对象会自动记录，无需调用）"""
+        db.info.setdefault(UserProfileCache._DIRTY_KEY, set()).add(int(user_id))
+
+    @staticmethod
+    def invalidate(user_ids: Iterable[int]):
+        """递增版本号，使这些用户已缓存的投影失效"""
+        user_ids = list(user_ids)
+        redis = UserProfileCache._get_redis()
+        if not redis or not user_ids:
+            return
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for user_id in user_ids:
+                version_key = UserProfileCache._keys(user_id)[0]
+                pipe.incr(version_key)
+                pipe.expire(version_key, UserProfileCache.VERSION_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"用户资料缓存失效失败，尝试直接删除投影 {user_ids}: {e}")
+            try:
+                redis.delete(*[UserProfileCache._keys(user_id)[1] for user_id in user_ids])
+            except Exception:
+                pass
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_dirty_users(session, flush_context, instances):
+    """记录本次flush中修改或删除的用户（新建用户没有缓存，无需处理）"""
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            UserProfileCache.mark_dirty(session, obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    dirty = session.info.pop(UserProfileCache._DIRTY_KEY, None)
+    if dirty:
+        UserProfileCache.invalidate(dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_users(session):
+    session.info.pop(UserProfileCache._DIRTY_KEY, None)
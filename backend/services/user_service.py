@@ -1,12 +1,34 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models import User, CoinTransaction, TransactionType, UserStatus
-from schemas import UserRegister, UserUpdate
-from typing import Optional
+from sqlalchemy import func, update, insert
+from models import User, CoinTransaction, TransactionType, UserStatus, GameRecord, AdWatchRecord
+from schemas import UserRegister, UserUpdate, UserInfo
+from services.user_profile_cache import UserProfile, UserProfileCache
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 from datetime import datetime
-from decimal import Decimal
 import hashlib
 
+
+class InsufficientCoinsError(ValueError):
+    """金币记账失败（用户不存在或余额不足），调用方需回滚事务"""
+
+    def __init__(self, user_id: int, amount: int):
+        super().__init__(f"用户{user_id}金币不足或用户不存在，变动{amount}")
+        self.user_id = user_id
+        self.amount = amount
+
+
+@dataclass(frozen=True)
+class CoinEntry:
+    """一条金币记账分录（金额为整数分，正数为收入，负数为支出）"""
+    user_id: int
+    amount: int
+    type: TransactionType
+    description: Optional[str] = None
+    related_id: Optional[int] = None
+    related_key: Optional[str] = None
+
+
 class UserService:
     
     @staticmethod
@@ -51,6 +73,11 @@ class UserService:
             # 如果user_id不是数字，则按字符串处理
             return db.query(User).filter(User.id == user_id).first()
     
+    @staticmethod
+    def get_user_profile(db: Session, user_id) -> Optional[UserProfile]:
+        """获取用户资料投影（只读，优先读Redis缓存）；需要修改用户行时使用get_user_by_id"""
+        return UserProfileCache.get(db, user_id)
+    
     @staticmethod
     def update_user(db: Session, user_id: int, user_data: UserUpdate) -> Optional[User]:
         """更新用户信息"""
@@ -76,57 +103,85 @@ class UserService:
             db.commit()
     
     @staticmethod
-    def add_coins(db: Session, user_id: int, amount: float, transaction_type: TransactionType, 
+    def post_coins(db: Session, entries: List[CoinEntry]) -> Dict[int, int]:
+        """
+        金币记账引擎：在当前事务中过账一组分录（不提交，由调用方统一提交）
+        每条分录是一条条件UPDATE（coins + x >= 0），余额在SQL中计算，不依赖先查后改；
+        所有流水在最后一次批量INSERT；任一分录失败抛出InsufficientCoinsError，调用方回滚
+        返回：{用户ID: 过账后余额（分）}
+        """
+        returning = db.get_bind().dialect.update_returning
+        balances: Dict[int, int] = {}
+        transactions = []
+
+        for entry in entries:
+            amount = int(entry.amount)
+            values = {User.coins: User.coins + amount}
+            if amount > 0:
+                values[User.total_coins] = User.total_coins + amount
+            stmt = update(User).where(
+                User.id == entry.user_id,
+                User.coins + amount >= 0
+            ).values(values).execution_options(synchronize_session=False)
+
+            if returning:
+                balance_after = db.execute(stmt.returning(User.coins)).scalar()
+                if balance_after is None:
+                    raise InsufficientCoinsError(entry.user_id, amount)
+            else:
+                if not db.execute(stmt).rowcount:
+                    raise InsufficientCoinsError(entry.user_id, amount)
+                # 本事务已更新该行（持有行锁），读到的就是自己写入的余额
+                balance_after = db.query(User.coins).filter(User.id == entry.user_id).scalar()
+
+            balances[entry.user_id] = balance_after
+            UserProfileCache.mark_dirty(db, entry.user_id)
+            transactions.append({
+                "user_id": entry.user_id,
+                "type": entry.type,
+                "amount": amount,
+                "balance_after": balance_after,
+                "description": entry.description,
+                "related_id": entry.related_id,
+                "related_key": entry.related_key
+            })
+
+        if transactions:
+            db.execute(insert(CoinTransaction), transactions)
+        return balances
+
+    @staticmethod
+    def apply_coins(db: Session, user_id: int, amount: int, transaction_type: TransactionType,
+                    description: str = None, related_id: int = None,
+                    related_key: str = None) -> Optional[int]:
+        """
+        在当前事务中变动用户金币（分）并记录流水（不提交，由调用方统一提交）
+        返回变更后的余额（分）；用户不存在或余额不足时返回None（未做任何修改）
+        """
+        try:
+            balances = UserService.post_coins(db, [CoinEntry(
+                user_id, amount, transaction_type, description, related_id, related_key
+            )])
+        except InsufficientCoinsError:
+            return None
+        return balances[user_id]
+
+    @staticmethod
+    def add_coins(db: Session, user_id: int, amount: int, transaction_type: TransactionType, 
                   description: str = None, related_id: int = None) -> bool:
-        """给用户添加金币"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        """给用户添加金币（分）"""
+        if UserService.apply_coins(db, user_id, amount, transaction_type, description, related_id) is None:
             return False
-        
-        # 转换为Decimal类型
-        amount_decimal = Decimal(str(amount))
-        
-        # 更新用户金币
-        user.coins += amount_decimal
-        user.total_coins += amount_decimal
-        
-        # 记录交易
-        transaction = CoinTransaction(
-            user_id=user_id,
-            type=transaction_type,
-            amount=amount_decimal,
-            balance_after=user.coins,
-            description=description,
-            related_id=related_id
-        )
-        
-        db.add(transaction)
         db.commit()
         return True
     
     @staticmethod
-    def deduct_coins(db: Session, user_id: int, amount: float, transaction_type: TransactionType,
+    def deduct_coins(db: Session, user_id: int, amount: int, transaction_type: TransactionType,
                      description: str = None, related_id: int = None) -> bool:
-        """扣除用户金币"""
-        user = db.query(User).filter(User.id == user_id).first()
-        amount_decimal = Decimal(str(amount))
-        if not user or user.coins < amount_decimal:
+        """扣除用户金币（分，余额不足时不扣除）"""
+        if UserService.apply_coins(db, user_id, -amount, transaction_type,
+                                   description, related_id) is None:
             return False
-        
-        # 更新用户金币
-        user.coins -= amount_decimal
-        
-        # 记录交易
-        transaction = CoinTransaction(
-            user_id=user_id,
-            type=transaction_type,
-            amount=-amount_decimal,
-            balance_after=user.coins,
-            description=description,
-            related_id=related_id
-        )
-        
-        db.add(transaction)
         db.commit()
         return True
     
@@ -134,7 +189,7 @@ class UserService:
     def add_register_reward(db: Session, user: User):
         """发放注册奖励"""
         from services.config_service import ConfigService
-        reward_coins = float(ConfigService.get_config(db, "register_reward_coins", "100"))
+        reward_coins = ConfigService.get_register_reward_coins(db)
         
         if reward_coins > 0:
             UserService.add_coins(
@@ -144,28 +199,13 @@ class UserService:
             )
     
     @staticmethod
-    def update_game_stats(db: Session, user_id: int, score: int, duration: int, needles: int):
-        """更新游戏统计"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            user.game_count += 1
-            if score > user.best_score:
-                user.best_score = score
-            
-            # 增加经验值
-            experience_gain = max(1, score // 10)
-            user.experience += experience_gain
-            
-            # 计算等级（每1000经验升一级）
-            new_level = user.experience // 1000 + 1
-            user.level = new_level
-            
-            db.commit()
-    
-    @staticmethod
-    def get_user_stats(db: Session, user_id: int) -> dict:
-        """获取用户统计信息"""
-        user = db.query(User).filter(User.id == user_id).first()
+    def get_user_stats(db: Session, user_id: int, user: UserProfile = None) -> dict:
+        """
+        获取用户统计信息
+        user: 调用方已获取的用户资料（避免重复查询）
+        """
+        if user is None:
+            user = UserService.get_user_profile(db, user_id)
         if not user:
             return {}
         
@@ -183,7 +223,7 @@ class UserService:
         ).scalar() or 0
         
         return {
-            "user_info": user,
+            "user_info": UserInfo.from_orm(user).dict(),
             "today_games": today_games,
             "today_ads": today_ads,
             "next_level_exp": (user.level * 1000) - user.experience
@@ -6,7 +6,7 @@ from services.config_service import ConfigService
 from datetime import datetime, date
 from typing import Dict, Optional
 from sqlalchemy import func
-from decimal import Decimal
+from services.money import format_cents, from_cents, percent_fee, rmb_to_coin_cents
 
 class WithdrawService:
     
@@ -14,43 +14,42 @@ class WithdrawService:
     def submit_withdraw_request(db: Session, user_id: int, withdraw_data: WithdrawRequestSchema) -> Dict:
         """提交提现申请"""
         # 验证用户存在
-        user = UserService.get_user_by_id(db, user_id)
+        user = UserService.get_user_profile(db, user_id)
         if not user:
             return {"success": False, "message": "用户不存在"}
         
-        # 获取系统配置
-        min_amount = float(ConfigService.get_min_withdraw_amount(db))
-        max_amount = float(ConfigService.get_max_withdraw_amount(db))
-        coin_rate = float(ConfigService.get_coin_to_rmb_rate(db))
-        min_coins = float(ConfigService.get_withdrawal_min_coins(db))
-        fee_rate = float(ConfigService.get_withdrawal_fee_rate(db))
+        # 获取系统配置（金额均为整数分）
+        min_amount = ConfigService.get_min_withdraw_amount(db)
+        max_amount = ConfigService.get_max_withdraw_amount(db)
+        coin_rate = ConfigService.get_coin_to_rmb_rate(db)
+        min_coins = ConfigService.get_withdrawal_min_coins(db)
+        fee_rate = ConfigService.get_withdrawal_fee_rate(db)
         
         # 验证提现金额
         if withdraw_data.amount < min_amount:
-            return {"success": False, "message": f"提现金额不能少于{min_amount}元"}
+            return {"success": False, "message": f"提现金额不能少于{format_cents(min_amount)}元"}
         
         if withdraw_data.amount > max_amount:
-            return {"success": False, "message": f"提现金额不能超过{max_amount}元"}
+            return {"success": False, "message": f"提现金额不能超过{format_cents(max_amount)}元"}
         
-        # 计算需要消耗的金币（包含手续费）
-        withdraw_amount = float(withdraw_data.amount)
-        base_coins = withdraw_amount * coin_rate  # 基础金币需求
-        fee_coins = (base_coins * fee_rate / 100.0) if fee_rate > 0 else 0.0
+        # 计算需要消耗的金币（包含手续费）：所需金币和手续费均向上取整到分
+        base_coins = rmb_to_coin_cents(withdraw_data.amount, coin_rate)  # 基础金币需求
+        fee_coins = percent_fee(base_coins, fee_rate) if fee_rate > 0 else 0
         coins_needed = base_coins + fee_coins
         
         # 验证用户金币是否达到最小提现要求
-        if float(user.coins) < min_coins:
+        if user.coins < min_coins:
             return {
                 "success": False, 
-                "message": f"金币余额不足，最少需要{min_coins}金币才能提现，当前余额{user.coins}金币"
+                "message": f"金币余额不足，最少需要{format_cents(min_coins)}金币才能提现，当前余额{format_cents(user.coins)}金币"
             }
         
         # 验证用户金币余额
-        if float(user.coins) < coins_needed:
-            fee_message = f"（含手续费{fee_coins:.2f}金币）" if fee_rate > 0 else ""
+        if user.coins < coins_needed:
+            fee_message = f"（含手续费{format_cents(fee_coins)}金币）" if fee_rate > 0 else ""
             return {
                 "success": False, 
-                "message": f"金币余额不足，需要{coins_needed:.2f}金币{fee_message}，当前余额{user.coins}金币"
+                "message": f"金币余额不足，需要{format_cents(coins_needed)}金币{fee_message}，当前余额{format_cents(user.coins)}金币"
             }
         
         # 检查每日提现次数限制
@@ -76,21 +75,22 @@ class WithdrawService:
         if pending_request:
             return {"success": False, "message": "您有未处理的提现申请，请等待审核完成"}
         
-        # 扣除金币
-        success = UserService.deduct_coins(
-            db, user_id, coins_needed,
+        # 扣除金币并创建提现申请（同一事务，余额不足时条件UPDATE不生效）
+        balance_after = UserService.apply_coins(
+            db, user_id, -coins_needed,
             TransactionType.WITHDRAW,
-            f"提现申请 - {withdraw_data.amount}元"
+            f"提现申请 - {format_cents(withdraw_data.amount)}元"
         )
         
-        if not success:
+        if balance_after is None:
+            db.rollback()
             return {"success": False, "message": "金币扣除失败"}
         
         # 创建提现申请
         withdraw_request = WithdrawRequest(
             user_id=user_id,
-            amount=Decimal(str(withdraw_data.amount)),
-            coins_used=Decimal(str(coins_needed)),
+            amount=withdraw_data.amount,
+            coins_used=coins_needed,
             alipay_account=withdraw_data.alipay_account,
             real_name=withdraw_data.real_name,
             status=WithdrawStatus.PENDING
@@ -101,16 +101,16 @@ class WithdrawService:
         db.refresh(withdraw_request)
         
         # 构建返回信息
-        fee_message = f"，手续费{fee_coins:.2f}金币" if fee_rate > 0 else ""
+        fee_message = f"，手续费{format_cents(fee_coins)}金币" if fee_rate > 0 else ""
         
         return {
             "success": True,
-            "message": f"提现申请提交成功，请等待审核。消耗金币{coins_needed:.2f}{fee_message}",
+            "message": f"提现申请提交成功，请等待审核。消耗金币{format_cents(coins_needed)}{fee_message}",
             "data": {
                 "request_id": withdraw_request.id,
-                "amount": float(withdraw_request.amount),
-                "coins_used": float(withdraw_request.coins_used),
-                "fee_coins": float(fee_coins),
+                "amount": from_cents(withdraw_request.amount),
+                "coins_used": from_cents(withdraw_request.coins_used),
+                "fee_coins": from_cents(fee_coins),
                 "fee_rate": float(fee_rate),
                 "status": withdraw_request.status.value
             }
@@ -141,7 +141,7 @@ class WithdrawService:
             "message": "提现申请已批准",
             "data": {
                 "request_id": withdraw_request.id,
-                "amount": float(withdraw_request.amount),
+                "amount": from_cents(withdraw_request.amount),
                 "status": withdraw_request.status.value
             }
         }
@@ -159,27 +159,36 @@ class WithdrawService:
         if withdraw_request.status != WithdrawStatus.PENDING:
             return {"success": False, "message": "该申请已处理"}
         
-        # 退还金币给用户
-        UserService.add_coins(
-            db, withdraw_request.user_id, float(withdraw_request.coins_used),
+        # 条件更新状态，并发拒绝同一申请时只有一个能成功（避免重复退款）
+        claimed = db.query(WithdrawRequest).filter(
+            WithdrawRequest.id == withdraw_id,
+            WithdrawRequest.status == WithdrawStatus.PENDING
+        ).update({
+            WithdrawRequest.status: WithdrawStatus.REJECTED,
+            WithdrawRequest.admin_note: admin_note,
+            WithdrawRequest.process_time: datetime.now()
+        }, synchronize_session=False)
+        if not claimed:
+            db.rollback()
+            return {"success": False, "message": "该申请已处理"}
+        
+        # 退还金币给用户（与状态变更同一事务提交）
+        UserService.apply_coins(
+            db, withdraw_request.user_id, withdraw_request.coins_used,
             TransactionType.ADMIN_ADJUST,
             f"提现申请被拒绝，退还金币 - 申请ID: {withdraw_id}",
             withdraw_id
         )
         
-        # 更新申请状态
-        withdraw_request.status = WithdrawStatus.REJECTED
-        withdraw_request.admin_note = admin_note
-        withdraw_request.process_time = datetime.now()
-        
         db.commit()
+        db.refresh(withdraw_request)
         
         return {
             "success": True,
             "message": "提现申请已拒绝，金币已退还",
             "data": {
                 "request_id": withdraw_request.id,
-                "coins_returned": float(withdraw_request.coins_used),
+                "coins_returned": from_cents(withdraw_request.coins_used),
                 "status": withdraw_request.status.value
             }
         }
@@ -210,7 +219,7 @@ class WithdrawService:
             "message": "提现已完成",
             "data": {
                 "request_id": withdraw_request.id,
-                "amount": float(withdraw_request.amount),
+                "amount": from_cents(withdraw_request.amount),
                 "status": withdraw_request.status.value
             }
         }
@@ -263,7 +272,7 @@ class WithdrawService:
         
         return {
             "total_requests": total_requests,
-            "total_amount": float(total_amount),
+            "total_amount": from_cents(total_amount),
             "status_counts": {
                 "pending": pending_count,
                 "approved": approved_count,
@@ -272,7 +281,7 @@ class WithdrawService:
             },
             "latest_request": {
                 "id": latest_request.id,
-                "amount": float(latest_request.amount),
+                "amount": from_cents(latest_request.amount),
                 "status": latest_request.status.value,
                 "request_time": latest_request.request_time
             } if latest_request else None,
@@ -2,8 +2,9 @@
 """
 同步IP黑名单到Redis - 定期运行此脚本或在启动时运行
 使用方法:
-  python sync_ip_blacklist.py          # 同步一次
-  python sync_ip_blacklist.py --watch  # 持续监控并同步
+  python sync_ip_blacklist.py          # 增量同步一次（首次运行自动全量）
+  python sync_ip_blacklist.py --full   # 全量同步一次（临时键构建后原子替换）
+  python sync_ip_blacklist.py --watch  # 持续监控：每轮增量同步，每隔若干轮全量校准
 """
 import sys
 import time
@@ -12,12 +13,16 @@ from database import get_db
 from services.ip_service_optimized import IPServiceOptimized
 
 
-def sync_once():
+def sync_once(full=False):
     """同步一次"""
     db = next(get_db())
     try:
-        count = IPServiceOptimized.sync_blocked_ips_to_redis(db)
-        print(f"✅ 同步完成: {count}个封禁IP已加载到Redis")
+        if full:
+            count = IPServiceOptimized.sync_blocked_ips_to_redis(db)
+            print(f"✅ 全量同步完成: {count}个封禁IP已加载到Redis")
+        else:
+            count = IPServiceOptimized.sync_blacklist_delta(db)
+            print(f"✅ 增量同步完成: {count}个条目有变更")
         return count
     except Exception as e:
         print(f"❌ 同步失败: {e}")
@@ -26,14 +31,16 @@ def sync_once():
         db.close()
 
 
-def sync_watch(interval=60):
-    """持续监控并同步"""
-    print(f"🔄 开始监控模式，每{interval}秒同步一次...")
+def sync_watch(interval=60, full_every=60):
+    """持续监控并同步（增量同步捕获不到直接删除的记录，定期全量校准）"""
+    print(f"🔄 开始监控模式，每{interval}秒增量同步一次，每{full_every}轮全量同步一次...")
     print("按 Ctrl+C 停止\n")
 
     try:
+        rounds = 0
         while True:
-            sync_once()
+            sync_once(full=(rounds % full_every == 0))
+            rounds += 1
             time.sleep(interval)
     except KeyboardInterrupt:
         print("\n✋ 已停止监控")
@@ -43,13 +50,15 @@ def main():
     parser = argparse.ArgumentParser(description='同步IP黑名单到Redis')
     parser.add_argument('--watch', action='store_true', help='持续监控模式')
     parser.add_argument('--interval', type=int, default=60, help='监控间隔（秒），默认60')
+    parser.add_argument('--full', action='store_true', help='全量同步')
+    parser.add_argument('--full-every', type=int, default=60, help='监控模式下每多少轮全量同步一次，默认60')
 
     args = parser.parse_args()
 
     if args.watch:
-        sync_watch(args.interval)
+        sync_watch(args.interval, max(1, args.full_every))
     else:
-        sync_once()
+        sync_once(full=args.full)
 
 
 if __name__ == "__main__":
@@ -27,8 +27,8 @@ def get_ufw_blocked_ips():
         lines = result.stdout.split('\n')
         
         for line in lines:
-            # 匹配类似: [1] DENY IN 192.168.1.1
-            match = re.search(r'DENY.*?(\d+\.\d+\.\d+\.\d+)', line)
+            # 匹配类似: [1] DENY IN 192.168.1.1 或 192.168.1.0/24（保留网段前缀）
+            match = re.search(r'DENY.*?(\d+\.\d+\.\d+\.\d+(?:/\d+)?)', line)
             if match:
                 ip = match.group(1)
                 blocked_ips.append(ip)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+广告目录抽样测试脚本
+验证Walker/Vose别名表的抽样分布、权重为0的广告不参与抽样，
+以及按条件选择时的重抽和兜底（services/ad_catalog.py），不访问数据库和Redis
+使用方法: python test_ad_catalog.py
+"""
+
+import random
+from collections import Counter
+from datetime import datetime
+
+from models import AdStatus
+from services.ad_catalog import AdCatalogSnapshot, AliasTable, CatalogAd
+
+
+def make_ad(ad_id: int, weight: int) -> CatalogAd:
+    now = datetime.now()
+    return CatalogAd(
+        id=ad_id, name=f"广告{ad_id}", ad_type="video", video_url=None, webpage_url=None,
+        image_url=None, duration=30, reward_coins=100, daily_limit=10, min_watch_duration=15,
+        weight=weight, status=AdStatus.ACTIVE, start_time=None, end_time=None,
+        created_time=now, updated_time=now
+    )
+
+
+def test_alias_distribution():
+    """别名表抽样频率与权重成正比"""
+    print("\n" + "="*60)
+    print("测试: 别名表抽样分布")
+    print("="*60)
+
+    random.seed(20250101)
+    for weights in ([1, 1, 1, 1], [1, 2, 3, 4], [100, 1, 1], [7], [0.5, 2.5, 1]):
+        table = AliasTable(weights)
+        assert all(0.0 <= p <= 1.0 for p in table.prob)
+        samples = 200000
+        counts = Counter(table.sample() for _ in range(samples))
+        total = sum(weights)
+        for index, weight in enumerate(weights):
+            expected = weight / total
+            actual = counts[index] / samples
+            assert abs(actual - expected) < 0.01, (weights, index, actual, expected)
+        print(f"✅ 权重 {weights} 分布正确")
+
+    # 权重为0的项不会被抽中
+    table = AliasTable([0, 3, 0, 1])
+    assert {table.sample() for _ in range(10000)} == {1, 3}
+    print("✅ 权重为0的项不会被抽中")
+
+
+def test_snapshot_choose():
+    """快照选择：过滤条件、重抽后的兜底、没有可选广告"""
+    print("\n" + "="*60)
+    print("测试: 快照按条件选择")
+    print("="*60)
+
+    random.seed(42)
+    ads = [make_ad(1, 10), make_ad(2, 30), make_ad(3, 0), make_ad(4, 60)]
+    snapshot = AdCatalogSnapshot(ads, version="1")
+    assert [ad.id for ad in snapshot.ads] == [1, 2, 4]    # 权重为0只保留按ID查询
+    assert snapshot.get(3).weight == 0 and snapshot.get(99) is None
+
+    counts = Counter(snapshot.choose().id for _ in range(100000))
+    assert set(counts) == {1, 2, 4}
+    assert abs(counts[4] / 100000 - 0.6) < 0.01
+
+    # 过滤掉权重最大的广告后，剩余广告仍按权重选择（10:30）
+    counts = Counter(snapshot.choose(lambda ad: ad.id != 4).id for _ in range(100000))
+    assert set(counts) == {1, 2}
+    assert abs(counts[2] / 100000 - 0.75) < 0.01
+    print("✅ 过滤后仍按权重选择")
+
+    # 只有一个权重很小的广告可选：多次重抽未中后兜底，仍能选中
+    rare = AdCatalogSnapshot([make_ad(1, 1), make_ad(2, 100000)], version="1")
+    calls = []
+
+    def only_rare(ad):
+        calls.append(ad.id)
+        return ad.id == 1
+
+    assert rare.choose(only_rare).id == 1
+    assert len(calls) <= AdCatalogSnapshot.MAX_REJECTIONS + 2
+    print("✅ 连续重抽未中时兜底选择")
+
+    assert snapshot.choose(lambda ad: False) is None
+    assert AdCatalogSnapshot([], version=None).choose() is None
+    assert AdCatalogSnapshot([make_ad(1, 0)], version=None).choose() is None
+    print("✅ 没有可选广告时返回None")
+
+
+def main():
+    """运行所有测试"""
+    test_alias_distribution()
+    test_snapshot_choose()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ from database import get_db, redis_client
 from services.ip_service import IPService
 from services.config_service import ConfigService
 from services.ad_service import AdService
+from services.ad_catalog import AdCatalog
 
 
 def test_ip_blacklist_cache():
@@ -106,8 +107,8 @@ def test_active_ads_cache():
     db = next(get_db())
 
     try:
-        # 清除缓存
-        redis_client.delete("active_ads")
+        # 清除缓存（递增广告目录版本号）
+        AdCatalog.invalidate()
 
         # 第一次查询（数据库）
         start = time.time()
@@ -119,12 +120,12 @@ def test_active_ads_cache():
         result2 = AdService._get_active_ads_cached(db)
         time2 = (time.time() - start) * 1000
 
-        # 检查Redis缓存
-        cached = redis_client.get("active_ads")
+        # 检查广告目录版本号
+        cached = redis_client.get(AdCatalog.VERSION_KEY)
 
         print(f"第一次查询（数据库）: {time1:.2f}ms - 广告数量: {len(result1)}")
         print(f"第二次查询（缓存）: {time2:.2f}ms - 广告数量: {len(result2)}")
-        print(f"Redis缓存存在: {'是' if cached else '否'}")
+        print(f"广告目录版本号: {cached}")
         print(f"性能提升: {((time1 - time2) / time1 * 100):.1f}%")
 
         if time2 < time1:
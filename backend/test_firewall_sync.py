@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+防火墙同步比对测试脚本
+使用内存SQLite黑名单 + FakeFirewallRunner（内存模拟ipset/iptables）验证 reconcile 的增删和超时刷新，
+不需要root权限，也不会修改系统防火墙
+使用方法: python test_firewall_sync.py
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+import auto_sync_firewall
+from auto_sync_firewall import FakeFirewallRunner, FirewallSyncManager, IPSET_NAMES, SUBNET_PREFIX
+
+
+def create_manager():
+    """创建使用内存黑名单和模拟防火墙的同步管理器（持久化文件写到临时目录）"""
+    rules_dir = tempfile.mkdtemp(prefix="firewall-sync-test-")
+    auto_sync_firewall.IPSET_RULES_FILE = os.path.join(rules_dir, "ipset.rules")
+    auto_sync_firewall.IPTABLES_RULES_FILE = os.path.join(rules_dir, "rules.v4")
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE ip_blacklist (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ip_address VARCHAR(45) NOT NULL UNIQUE,
+                is_active INTEGER DEFAULT 1,
+                expire_time DATETIME
+            )
+        """))
+    runner = FakeFirewallRunner()
+    return FirewallSyncManager(runner=runner, engine=engine), runner, engine
+
+
+def ban(engine, ip_address, expire_time=None, is_active=1):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO ip_blacklist (ip_address, is_active, expire_time) VALUES (:ip, :active, :expire)
+            ON CONFLICT (ip_address) DO UPDATE SET is_active = :active, expire_time = :expire
+        """), {"ip": ip_address, "active": is_active, "expire": expire_time})
+
+
+def test_reconcile():
+    """全量比对：新增、合并同网段、移除解封、重复比对不下发"""
+    print("\n" + "="*60)
+    print("测试: reconcile 比对下发")
+    print("="*60)
+
+    manager, runner, engine = create_manager()
+    ipv4_subnet = f"112.82.180.0/{SUBNET_PREFIX[4]}"
+    ban(engine, "112.82.180.220")
+    ban(engine, "112.82.180.7", datetime.now() + timedelta(hours=1))   # 同一网段，取永久
+    ban(engine, "10.0.0.0/8", datetime.now() + timedelta(hours=1))
+    ban(engine, "2001:db8::1")
+    ban(engine, "8.8.8.8", datetime.now() - timedelta(hours=1))          # 已过期
+    ban(engine, "9.9.9.9", is_active=0)                                   # 已解封
+
+    stats = manager.reconcile()
+    v4, v6 = runner.sets[IPSET_NAMES[4]], runner.sets[IPSET_NAMES[6]]
+    assert stats == {"desired": 3, "added": 3, "removed": 0}, stats
+    assert v4[ipv4_subnet] == 0, v4
+    assert 0 < v4["10.0.0.0/8"] <= 3600, v4
+    assert set(v4) == {ipv4_subnet, "10.0.0.0/8"}, v4
+    assert set(v6) == {f"2001:db8::/{SUBNET_PREFIX[6]}"}, v6
+    assert len(runner.rules) == 2, runner.rules
+    print(f"✅ 首次比对: {stats}")
+
+    # 状态一致时不再下发
+    restores = sum(command.startswith("ipset restore") for command in runner.commands)
+    stats = manager.reconcile()
+    assert stats == {"desired": 3, "added": 0, "removed": 0}, stats
+    assert sum(command.startswith("ipset restore") for command in runner.commands) == restores
+    print(f"✅ 重复比对不下发: {stats}")
+
+    # 解封移除、延长期限刷新超时
+    ban(engine, "2001:db8::1", is_active=0)
+    ban(engine, "10.0.0.0/8", datetime.now() + timedelta(days=1))
+    stats = manager.reconcile()
+    assert stats == {"desired": 2, "added": 1, "removed": 1}, stats
+    assert runner.sets[IPSET_NAMES[6]] == {}
+    assert runner.sets[IPSET_NAMES[4]]["10.0.0.0/8"] > 3600
+    print(f"✅ 解封和续期: {stats}")
+
+
+def test_database_unavailable():
+    """数据库不可用时跳过比对，不清空已有封禁"""
+    print("\n" + "="*60)
+    print("测试: 数据库不可用")
+    print("="*60)
+
+    manager, runner, engine = create_manager()
+    ban(engine, "112.82.180.220")
+    manager.reconcile()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE ip_blacklist"))
+
+    assert manager.reconcile() is None
+    assert len(runner.sets[IPSET_NAMES[4]]) == 1
+    print("✅ 保留已有封禁")
+
+
+def main():
+    """运行所有测试"""
+    test_reconcile()
+    test_database_unavailable()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+IP前缀匹配测试脚本
+验证黑名单条目规范化、IPv4/IPv6网段前缀树匹配（services/ip_prefix_trie.py）
+以及受信代理下的客户端IP解析（services/client_ip.py），不需要数据库和Redis
+使用方法: python test_ip_prefix_trie.py
+"""
+
+import ipaddress
+import random
+
+from config import settings
+from services.client_ip import resolve_client_ip
+from services.ip_prefix_trie import (
+    IPPrefixTrie, ban_entry_for_ip, candidate_entries, normalize_entry, normalize_ip
+)
+
+
+def test_normalize():
+    """条目规范化：网段统一为network/prefix，IPv6压缩，IPv4映射地址还原"""
+    print("\n" + "="*60)
+    print("测试: 条目规范化")
+    print("="*60)
+
+    assert normalize_entry("1.2.3.4/24") == "1.2.3.0/24"
+    assert normalize_entry("1.2.3.0/24") == "1.2.3.0/24"
+    assert normalize_entry("1.2.3.4/32") == "1.2.3.4"
+    assert normalize_entry("2001:0db8:0000::1/64") == "2001:db8::/64"
+    assert normalize_entry("::ffff:1.2.3.4") == "1.2.3.4"
+    assert normalize_entry("::ffff:1.2.3.4/120") == "1.2.3.0/24"
+    assert normalize_entry("not-an-ip") == "not-an-ip"
+    assert normalize_ip("fe80::1%eth0") == "fe80::1"
+    assert normalize_ip(" 10.0.0.1 ") == "10.0.0.1"
+
+    prefix_v4, prefix_v6 = settings.IP_BAN_PREFIX_V4, settings.IP_BAN_PREFIX_V6
+    assert ban_entry_for_ip("112.82.180.220") == str(ipaddress.ip_network(f"112.82.180.220/{prefix_v4}", strict=False))
+    assert ban_entry_for_ip("2001:db8::1") == str(ipaddress.ip_network(f"2001:db8::1/{prefix_v6}", strict=False))
+    assert candidate_entries("112.82.180.220") == ["112.82.180.220", ban_entry_for_ip("112.82.180.220")]
+    print("✅ 规范化正确")
+
+
+def test_trie_matching():
+    """单个地址、网段、IPv4/IPv6互不干扰，移除只影响完全相同的条目"""
+    print("\n" + "="*60)
+    print("测试: 前缀树匹配")
+    print("="*60)
+
+    trie = IPPrefixTrie(["1.2.3.0/24", "10.0.0.5", "2001:db8::/32", "bad-entry"])
+    assert len(trie) == 3
+    assert "1.2.3.77" in trie and "1.2.4.1" not in trie
+    assert "10.0.0.5" in trie and "10.0.0.6" not in trie
+    assert "2001:db8:1::9" in trie and "2001:db9::1" not in trie
+    assert "::ffff:1.2.3.9" in trie                  # IPv4映射地址按IPv4匹配
+    assert "" not in trie and "unknown" not in trie
+
+    assert not trie.add("garbage")
+    assert trie.add("1.2.3.4/24") and len(trie) == 3  # 规范化后与已有条目相同
+    assert trie.add("1.0.0.0/8") and len(trie) == 4
+    assert trie.remove("1.2.3.0/24")
+    assert "1.2.3.77" in trie                         # 仍被更大的网段覆盖
+    assert trie.remove("1.0.0.0/8") and "1.2.3.77" not in trie
+    assert not trie.remove("1.0.0.0/8")
+    assert not trie.remove("10.0.0.0/24")             # 不存在的条目
+    assert "10.0.0.5" in trie
+
+    everything = IPPrefixTrie(["0.0.0.0/0"])
+    assert "8.8.8.8" in everything and "2001:db8::1" not in everything
+    print("✅ 前缀树匹配正确")
+
+
+def test_trie_matches_reference():
+    """随机条目和地址，与逐条 ipaddress 比对的结果一致"""
+    print("\n" + "="*60)
+    print("测试: 随机比对")
+    print("="*60)
+
+    rng = random.Random(20250101)
+    networks = []
+    for _ in range(300):
+        if rng.random() < 0.7:
+            address = ipaddress.IPv4Address(rng.getrandbits(32))
+            networks.append(ipaddress.ip_network(f"{address}/{rng.choice([8, 16, 20, 24, 28, 32])}", strict=False))
+        else:
+            address = ipaddress.IPv6Address(rng.getrandbits(128))
+            networks.append(ipaddress.ip_network(f"{address}/{rng.choice([32, 48, 64, 128])}", strict=False))
+    trie = IPPrefixTrie(str(network) for network in networks)
+
+    checked = 0
+    for network in networks:
+        # 网段内的地址和网段附近的地址
+        first, last = int(network.network_address), int(network.broadcast_address)
+        limit = 2 ** network.max_prefixlen - 1
+        for value in {first, last, max(0, first - 1), min(limit, last + 1)}:
+            address = ipaddress.ip_address(value) if network.version == 4 else ipaddress.IPv6Address(value)
+            ip = str(address)
+            expected = any(address in candidate for candidate in networks if candidate.version == address.version)
+            assert (ip in trie) == expected, ip
+            checked += 1
+    print(f"✅ {checked}个地址与参考实现一致")
+
+
+def test_client_ip():
+    """只在直连地址为受信代理时读取转发头，取最右侧的非受信地址"""
+    print("\n" + "="*60)
+    print("测试: 客户端IP解析")
+    print("="*60)
+
+    original = settings.TRUSTED_PROXIES
+    try:
+        settings.TRUSTED_PROXIES = "127.0.0.1, 10.0.0.0/8"
+        # 非受信直连：忽略客户端伪造的转发头
+        assert resolve_client_ip("203.0.113.9", "1.1.1.1", "2.2.2.2") == "203.0.113.9"
+        # 受信代理：跳过右侧的受信代理，取第一个非受信地址（左侧的值由客户端填写）
+        assert resolve_client_ip("127.0.0.1", "1.1.1.1, 203.0.113.9, 10.1.2.3") == "203.0.113.9"
+        assert resolve_client_ip("127.0.0.1", "10.0.0.1, 10.0.0.2") == "10.0.0.1"
+        assert resolve_client_ip("127.0.0.1", None, "198.51.100.7") == "198.51.100.7"
+        assert resolve_client_ip("127.0.0.1", " , ", None) == "127.0.0.1"
+        assert resolve_client_ip("::ffff:203.0.113.9") == "203.0.113.9"
+        assert resolve_client_ip(None) == "unknown"
+
+        # 配置变化后生效
+        settings.TRUSTED_PROXIES = ""
+        assert resolve_client_ip("127.0.0.1", "1.1.1.1") == "127.0.0.1"
+    finally:
+        settings.TRUSTED_PROXIES = original
+    print("✅ 客户端IP解析正确")
+
+
+def main():
+    """运行所有测试"""
+    test_normalize()
+    test_trie_matching()
+    test_trie_matches_reference()
+    test_client_ip()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
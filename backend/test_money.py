@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+金额工具测试脚本
+验证整数分的解析、格式化和各种取整规则（services/money.py），不需要数据库和Redis
+使用方法: python test_money.py
+"""
+
+from decimal import Decimal
+
+from services.money import (
+    apply_multiplier, coin_to_rmb_cents, format_cents, from_cents,
+    percent_fee, rmb_to_coin_cents, to_cents
+)
+
+
+def test_parse_and_format():
+    """解析小数输入（四舍五入到分）和格式化输出"""
+    print("\n" + "="*60)
+    print("测试: 解析与格式化")
+    print("="*60)
+
+    assert to_cents(3) == 300
+    assert to_cents("0.1") == 10
+    assert to_cents(0.1 + 0.2) == 30            # 浮点误差按十进制字符串处理
+    assert to_cents("1.005") == 101             # 半分向上
+    assert to_cents("-1.005") == -101           # 负数远离零取整
+    assert to_cents(Decimal("12.344")) == 1234
+    assert to_cents(None) == 0 and to_cents("") == 0
+    try:
+        to_cents("abc")
+        raise AssertionError("无效金额应抛出ValueError")
+    except ValueError:
+        pass
+
+    assert from_cents(1234) == 12.34
+    assert from_cents(None) == 0
+    assert from_cents(Decimal("250")) == 2.5    # MySQL SUM(BIGINT) 返回DECIMAL
+    assert format_cents(5) == "0.05"
+    assert format_cents(-105) == "-1.05"
+    assert format_cents(100000) == "1000.00"
+    print("✅ 解析与格式化正确")
+
+
+def test_rounding_rules():
+    """倍数奖励四舍五入，手续费和所需金币向上取整，折算人民币向下取整"""
+    print("\n" + "="*60)
+    print("测试: 取整规则")
+    print("="*60)
+
+    # 等级倍数：金币 × 倍数，四舍五入到分
+    assert apply_multiplier(333, "1.5") == 500      # 499.5 -> 500
+    assert apply_multiplier(333, "1.2") == 400      # 399.6 -> 400
+    assert apply_multiplier(101, "1.01") == 102     # 102.01 -> 102
+    assert apply_multiplier(-333, "1.5") == -500
+    assert apply_multiplier(1000, 1) == 1000
+
+    # 手续费：向上取整，不少收；金额为0或负数时不收
+    assert percent_fee(1000, "3") == 30
+    assert percent_fee(1001, "3") == 31             # 30.03 -> 31
+    assert percent_fee(1, "0.01") == 1
+    assert percent_fee(0, "5") == 0 and percent_fee(-100, "5") == 0
+
+    # 人民币 -> 所需金币（向上取整）与 金币 -> 人民币（向下取整）
+    assert rmb_to_coin_cents(100, "33.33") == 3333
+    assert rmb_to_coin_cents(1, "33.33") == 34      # 33.33 -> 34
+    assert coin_to_rmb_cents(3333, "33.33") == 100
+    assert coin_to_rmb_cents(3332, "33.33") == 99   # 不多付
+    assert coin_to_rmb_cents(1000, 0) == 0
+
+    # 往返不产生差额：按所需金币扣除后，折算回的人民币不少于申请金额
+    for rmb_cents in (1, 99, 100, 12345):
+        for rate in ("1", "10", "33.33", "100"):
+            coins = rmb_to_coin_cents(rmb_cents, rate)
+            assert coin_to_rmb_cents(coins, rate) >= rmb_cents, (rmb_cents, rate)
+    print("✅ 取整规则正确")
+
+
+def main():
+    """运行所有测试"""
+    test_parse_and_format()
+    test_rounding_rules()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
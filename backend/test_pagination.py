@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+历史记录分页测试脚本
+验证游标编码、(时间, id) 游标翻页（同一时间多条记录不重不漏）、has_more 和偏移分页的总数
+（services/pagination.py），使用内存SQLite，不需要MySQL
+使用方法: python test_pagination.py
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import Column, DateTime, Integer, create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from services.pagination import decode_cursor, encode_cursor, paginate
+
+Base = declarative_base()
+
+
+class HistoryRow(Base):
+    __tablename__ = "history_rows"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    created_time = Column(DateTime, nullable=False)
+
+
+def create_session(count: int, user_id: int = 1):
+    """创建内存数据库，写入count条记录（每3条共用同一时间，模拟同一秒内的多条流水）"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    db.add_all([HistoryRow(id=i, user_id=user_id, created_time=start + timedelta(seconds=i // 3))
+                for i in range(1, count + 1)])
+    db.add(HistoryRow(id=count + 1, user_id=user_id + 1, created_time=start))   # 其他用户的记录
+    db.commit()
+    return db
+
+
+def test_cursor_encoding():
+    """游标往返一致、URL安全，无效游标抛出ValueError"""
+    print("\n" + "="*60)
+    print("测试: 游标编码")
+    print("="*60)
+
+    moment = datetime(2025, 3, 4, 5, 6, 7, 890123)
+    cursor = encode_cursor(moment, 12345)
+    assert decode_cursor(cursor) == (moment, 12345)
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+
+    for bad in ("not-a-cursor", "", "###", encode_cursor(moment, 1)[:-3]):
+        try:
+            decode_cursor(bad)
+            raise AssertionError(f"应拒绝无效游标: {bad!r}")
+        except ValueError:
+            pass
+    print("✅ 游标编码正确")
+
+
+def test_cursor_pages():
+    """游标翻页：按 (时间, id) 倒序，不重不漏，最后一页 has_more=False"""
+    print("\n" + "="*60)
+    print("测试: 游标翻页")
+    print("="*60)
+
+    db = create_session(25)
+    query = db.query(HistoryRow).filter(HistoryRow.user_id == 1)
+    seen = []
+    cursor = ""
+    pages = 0
+    while True:
+        rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, cursor=cursor)
+        pages += 1
+        seen.extend(row.id for row in rows)
+        assert "total" not in meta and "page" not in meta    # 游标分页默认不计算总数
+        if not meta["has_more"]:
+            assert meta["next_cursor"] is None
+            break
+        assert len(rows) == 4 and meta["next_cursor"]
+        cursor = meta["next_cursor"]
+
+    assert seen == list(range(25, 0, -1)), seen
+    assert pages == 7
+    print(f"✅ {pages}页共{len(seen)}条，顺序正确")
+
+    # 恰好整页：最后一页满页时 has_more=False，不会多出一个空页
+    db = create_session(8)
+    query = db.query(HistoryRow).filter(HistoryRow.user_id == 1)
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, cursor="")
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, cursor=meta["next_cursor"])
+    assert [row.id for row in rows] == [4, 3, 2, 1] and not meta["has_more"]
+
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, cursor="", include_total=True)
+    assert meta["total"] == 8 and meta["pages"] == 2
+    print("✅ 整页边界和显式总数")
+
+
+def test_offset_pages():
+    """偏移分页（兼容旧客户端）：返回页码和总数，越界页为空"""
+    print("\n" + "="*60)
+    print("测试: 偏移分页")
+    print("="*60)
+
+    db = create_session(10)
+    query = db.query(HistoryRow).filter(HistoryRow.user_id == 1)
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, page=3)
+    assert [row.id for row in rows] == [2, 1]
+    assert meta == {"size": 4, "has_more": False, "next_cursor": None, "total": 10, "pages": 3, "page": 3}
+
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, page=1)
+    assert [row.id for row in rows] == [10, 9, 8, 7] and meta["has_more"]
+
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=0, page=0, include_total=False)
+    assert len(rows) == 1 and meta["page"] == 1 and "total" not in meta   # size/page 最小为1
+
+    rows, meta = paginate(query, HistoryRow.created_time, HistoryRow.id, size=4, page=9)
+    assert rows == [] and not meta["has_more"]
+    print("✅ 偏移分页正确")
+
+
+def main():
+    """运行所有测试"""
+    test_cursor_encoding()
+    test_cursor_pages()
+    test_offset_pages()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+限流脚本测试脚本
+在fakeredis（需要安装lupa以支持Lua）上执行 RATE_LIMIT_LUA，验证滑动窗口估算、重试时间，
+以及多维度限流的“任一超限整体拒绝且不计数”（middleware/enhanced_protection.py），不需要真实Redis
+使用方法: python test_rate_limit_lua.py
+"""
+
+import fakeredis
+
+from middleware.enhanced_protection import RATE_LIMIT_LUA
+
+
+def create_script():
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    return redis, redis.register_script(RATE_LIMIT_LUA)
+
+
+def build_call(now: float, limits: list):
+    """与中间件相同的键和参数布局: limits = [(标识, 最大请求数, 窗口秒数), ...]"""
+    keys, args = [], [now]
+    for identity, max_requests, window in limits:
+        bucket = int(now // window)
+        keys.append(f"rate_limit:{identity}:{bucket}")
+        keys.append(f"rate_limit:{identity}:{bucket - 1}")
+        args.extend([max_requests, window])
+    return keys, args
+
+
+def check(script, now: float, limits: list) -> list:
+    keys, args = build_call(now, limits)
+    return script(keys=keys, args=args)
+
+
+def test_single_window():
+    """单维度：达到上限拒绝，计数键设置两个窗口的过期时间"""
+    print("\n" + "="*60)
+    print("测试: 单维度窗口")
+    print("="*60)
+
+    redis, script = create_script()
+    limits = [("ip:1.2.3.4:login", 3, 60)]
+    now = 6000.0                                          # 窗口 [6000, 6060)
+    assert [check(script, now, limits)[0] for _ in range(3)] == [1, 1, 1]
+    assert check(script, now + 10, limits) == [0, 3, 50, 1]   # 当前窗口剩余50秒
+
+    current_key = build_call(now, limits)[0][0]
+    assert redis.get(current_key) == "3"                  # 被拒绝的请求不计数
+    assert 60 < redis.ttl(current_key) <= 120
+    print("✅ 上限、重试时间和过期时间正确")
+
+
+def test_sliding_estimate():
+    """下一窗口按上一窗口剩余比例估算，重试时间为权重衰减到可放行的时间"""
+    print("\n" + "="*60)
+    print("测试: 滑动窗口估算")
+    print("="*60)
+
+    redis, script = create_script()
+    limits = [("ip:1.2.3.4:default", 4, 60)]
+    now = 6000.0
+    for _ in range(4):
+        check(script, now, limits)
+
+    # 下一窗口过半：上一窗口的4次估算为2次，本窗口还能放行2次
+    later = now + 90
+    assert [check(script, later, limits)[0] for _ in range(2)] == [1, 1]
+    allowed, estimated, retry_after, index = check(script, later, limits)
+    assert (allowed, estimated, index) == (0, 4, 1)
+    # 上一窗口权重需降到 (4-2)/4 以下：60*(1-2/4)-30 = 0，最少返回1秒
+    assert retry_after == 1
+
+    # 上一窗口滑出后只看本窗口计数
+    assert check(script, now + 125, limits)[0] == 1
+    print("✅ 估算和重试时间正确")
+
+
+def test_all_or_nothing():
+    """多维度（IP+用户）：任一维度超限整体拒绝，其他维度也不计数"""
+    print("\n" + "="*60)
+    print("测试: 多维度整体计数")
+    print("="*60)
+
+    redis, script = create_script()
+    now = 6000.0
+    limits = [("ip:5.6.7.8:withdraw", 100, 3600), ("user:42:withdraw", 2, 3600)]
+    ip_key, user_key = build_call(now, limits)[0][0], build_call(now, limits)[0][2]
+
+    assert [check(script, now, limits)[0] for _ in range(2)] == [1, 1]
+    assert redis.get(ip_key) == "2" and redis.get(user_key) == "2"
+
+    for _ in range(5):
+        allowed, estimated, _, index = check(script, now, limits)
+        assert (allowed, estimated, index) == (0, 2, 2)
+    assert redis.get(ip_key) == "2"                       # 被用户维度拒绝的请求没有计入IP维度
+    assert redis.get(user_key) == "2"
+
+    # 第一个维度超限时同样不计入第二个维度（该IP已计数2次，限额改为2）
+    other_user = [("ip:5.6.7.8:withdraw", 2, 3600), ("user:43:withdraw", 2, 3600)]
+    allowed, _, _, index = check(script, now, other_user)
+    assert (allowed, index) == (0, 1)
+    assert redis.get(build_call(now, other_user)[0][2]) is None
+    print("✅ 任一维度超限时所有维度都不计数")
+
+
+def main():
+    """运行所有测试"""
+    test_single_window()
+    test_sliding_estimate()
+    test_all_or_nothing()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
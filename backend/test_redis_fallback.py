@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Redis故障降级测试脚本
+验证熔断器的状态切换（closed -> open -> half_open -> closed/open）、探测名额的释放，
+以及进程内限流器的滑动窗口、时间轮回收和内存上限（services/redis_fallback.py），不需要Redis
+使用方法: python test_redis_fallback.py
+"""
+
+import asyncio
+import time
+
+from services.redis_fallback import CircuitBreaker, LocalRateLimiter, RedisUnavailable, guarded_call
+
+
+def create_breaker(reset_timeout=0.05, latency_budget=1.0):
+    return CircuitBreaker("测试Redis", failure_threshold=3, reset_timeout=reset_timeout,
+                          latency_budget=latency_budget)
+
+
+def test_breaker_transitions():
+    """连续失败熔断、超时后只放行一次探测、探测成功恢复/失败重新熔断"""
+    print("\n" + "="*60)
+    print("测试: 熔断器状态切换")
+    print("="*60)
+
+    breaker = create_breaker()
+    breaker.record_failure("超时")
+    breaker.record_failure("超时")
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow_request()
+    breaker.record_success()                          # 成功清零连续失败计数
+    for _ in range(3):
+        breaker.record_failure("超时")
+    assert breaker.state == CircuitBreaker.OPEN and breaker.is_open
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()                    # 探测请求
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()                # 探测期间其他请求走降级
+    breaker.record_failure("探测失败")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success(0.001)
+    assert breaker.state == CircuitBreaker.CLOSED and not breaker.is_open
+    print("✅ closed -> open -> half_open -> open -> half_open -> closed")
+
+    # 延迟超出预算计为失败
+    slow = create_breaker(latency_budget=0.01)
+    for _ in range(3):
+        slow.record_success(0.5)
+    assert slow.state == CircuitBreaker.OPEN
+    print("✅ 延迟超出预算触发熔断")
+
+
+def test_guarded_call():
+    """guarded_call：失败转换为RedisUnavailable，探测被取消时释放探测名额"""
+    print("\n" + "="*60)
+    print("测试: guarded_call")
+    print("="*60)
+
+    breaker = create_breaker()
+
+    async def fail():
+        raise ConnectionError("连接被拒绝")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "PONG"
+
+    async def scenario():
+        for _ in range(3):
+            try:
+                await guarded_call(breaker, fail)
+                raise AssertionError("应抛出RedisUnavailable")
+            except RedisUnavailable:
+                pass
+        assert breaker.state == CircuitBreaker.OPEN
+        try:
+            await guarded_call(breaker, ok)
+            raise AssertionError("熔断中应直接抛出RedisUnavailable")
+        except RedisUnavailable:
+            pass
+
+        # 探测请求被取消（客户端断开）：重新熔断计时，之后仍能放行新的探测
+        await asyncio.sleep(0.06)
+        probe = asyncio.create_task(guarded_call(breaker, hang))
+        await asyncio.sleep(0.01)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+        assert breaker.state == CircuitBreaker.OPEN
+
+        await asyncio.sleep(0.06)
+        assert await guarded_call(breaker, ok) == "PONG"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        # 熔断关闭时的取消不计为失败
+        task = asyncio.create_task(guarded_call(breaker, hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+    print("✅ 失败转换、探测取消后恢复")
+
+
+def test_local_limiter_window():
+    """滑动窗口：窗口内达到限额拒绝，按上一窗口的剩余比例估算，多条限制任一超限即拒绝且不计数"""
+    print("\n" + "="*60)
+    print("测试: 本地限流滑动窗口")
+    print("="*60)
+
+    limiter = LocalRateLimiter(shards=4)
+    limits = [("ip:1.2.3.4:login", 3, 10)]
+    now = 1000.0                                       # 窗口 [1000, 1010)
+    assert [limiter.check(limits, now)[0] for _ in range(3)] == [1, 1, 1]
+    allowed, estimated, retry_after, index = limiter.check(limits, now + 1)
+    assert (allowed, estimated, index) == (0, 3, 1) and 1 <= retry_after <= 10
+
+    # 下一窗口过半：上一窗口的3次按剩余一半估算为1次，本窗口只能再放行2次
+    assert [limiter.check(limits, now + 15)[0] for _ in range(3)] == [1, 1, 0]
+    # 上一窗口完全滑出后重新计数
+    assert limiter.check(limits, now + 30)[0] == 1
+
+    # 多条限制：第二条超限时拒绝，第一条也不计数
+    multi = [("ip:5.6.7.8:all", 100, 60), ("ip:5.6.7.8:submit", 1, 60)]
+    assert limiter.check(multi, now)[0] == 1
+    allowed, _, _, index = limiter.check(multi, now)
+    assert allowed == 0 and index == 2
+    # 被拒绝的那次没有计入第一条：限额2时还能放行1次
+    assert [limiter.check([("ip:5.6.7.8:all", 2, 60)], now)[0] for _ in range(2)] == [1, 0]
+    print("✅ 滑动窗口估算和多条限制")
+
+
+def test_local_limiter_memory():
+    """时间轮回收过期计数，分片键数量有上限"""
+    print("\n" + "="*60)
+    print("测试: 本地限流内存回收")
+    print("="*60)
+
+    limiter = LocalRateLimiter(shards=1, max_keys_per_shard=50, wheel_size=16)
+    now = 2000.0
+    for i in range(200):
+        limiter.check([(f"ip:10.0.0.{i}:default", 10, 5)], now)
+    assert len(limiter) == 50                          # 超出上限淘汰最早写入的键
+
+    limiter.check([("ip:10.0.1.1:default", 10, 5)], now + 11)   # 推进时间轮，之前的键（10秒后过期）被回收
+    assert len(limiter) == 1
+
+    # 固定窗口计数（违规计数）
+    assert [limiter.incr("violations:1.2.3.4", 60, now) for _ in range(3)] == [1, 2, 3]
+    assert limiter.incr("violations:1.2.3.4", 60, now + 60) == 1
+    print("✅ 过期回收和键数量上限")
+
+
+def main():
+    """运行所有测试"""
+    test_breaker_transitions()
+    test_guarded_call()
+    test_local_limiter_window()
+    test_local_limiter_memory()
+
+    print("\n" + "="*60)
+    print("✅ 所有测试完成！")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    main()